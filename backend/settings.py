@@ -82,6 +82,14 @@ DATABASES = {
     'default': dj_database_url.config(default=config('DATABASE_URL'))
 }
 
+# SQLite: wait for a competing writer instead of failing at once, and run
+# tests on a file. The default in-memory test database is in shared-cache
+# mode, where table locks fail immediately ("database table is locked")
+# rather than honouring the busy timeout, so concurrent-write tests flake.
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default'].setdefault('OPTIONS', {}).setdefault('timeout', 20)
+    DATABASES['default'].setdefault('TEST', {}).setdefault('NAME', str(BASE_DIR / 'test_db.sqlite3'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
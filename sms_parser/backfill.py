@@ -0,0 +1,150 @@
+"""Re-parse large SMS archives on a process pool, outside Django.
+
+Input and output are JSONL or CSV files (picked by extension). Each input
+record needs the message under ``sms``, ``text`` or ``raw_sms`` and optionally a
+``sender``. Results are written in input order, one ``parse_sms`` dict per
+record::
+
+    python -m sms_parser.backfill archive.csv parsed.jsonl --workers 8 --chunk-size 1000
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from sms_parser import parser
+
+RESULT_FIELDS = [
+    "reference_id", "network_provider", "type", "amount", "customer_phone", "customer_name",
+    "balance", "transaction_fee", "date_transaction", "raw_sms", "sender", "model_version",
+]
+
+
+def _is_csv(path):
+    return path.lower().endswith(".csv")
+
+
+def _message_of(record):
+    return record.get("sms") or record.get("text") or record.get("raw_sms") or ""
+
+
+def iter_records(path):
+    """Yield ``(sms_text, sender)`` pairs from a JSONL or CSV file (``-`` is stdin)."""
+    f = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+    try:
+        if _is_csv(path):
+            for row in csv.DictReader(f):
+                yield _message_of(row), row.get("sender") or None
+        else:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                yield _message_of(record), record.get("sender")
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def iter_chunks(records, chunk_size):
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ResultWriter:
+    """Writes parse results as JSONL or CSV depending on the output path."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = sys.stdout if path == "-" else open(path, "w", newline="", encoding="utf-8")
+        self.csv_writer = None
+        if _is_csv(path):
+            self.csv_writer = csv.DictWriter(self.file, fieldnames=RESULT_FIELDS, extrasaction="ignore")
+            self.csv_writer.writeheader()
+
+    def write(self, result):
+        if self.csv_writer:
+            self.csv_writer.writerow({k: "" if v is None else str(v) for k, v in result.items()})
+        else:
+            self.file.write(json.dumps(result, default=str) + "\n")
+
+    def close(self):
+        if self.file is sys.stdout:
+            self.file.flush()
+        else:
+            self.file.close()
+
+
+def _init_worker():
+    # Load the model once per worker process, before the first chunk arrives
+    parser.warm_up()
+
+
+def _parse_chunk(chunk):
+    messages = [sms_text for sms_text, _ in chunk]
+    senders = [sender for _, sender in chunk]
+    return parser.parse_many(messages, senders)
+
+
+def parse_ordered(records, workers=None, chunk_size=500):
+    """Parse ``records`` on a process pool and yield result chunks in input order.
+
+    At most ``2 * workers`` chunks are in flight, so memory stays bounded no
+    matter how large the input is.
+    """
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        pending = deque()
+        for chunk in iter_chunks(records, chunk_size):
+            pending.append(pool.submit(_parse_chunk, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def backfill(input_path, output_path, workers=None, chunk_size=500, progress_every=20):
+    """Parse ``input_path`` into ``output_path``; returns ``{"messages", "seconds", "rate"}``."""
+    writer = ResultWriter(output_path)
+    total = 0
+    start = time.perf_counter()
+    try:
+        for n, results in enumerate(parse_ordered(iter_records(input_path), workers, chunk_size), 1):
+            for result in results:
+                writer.write(result)
+            total += len(results)
+            if progress_every and n % progress_every == 0:
+                elapsed = time.perf_counter() - start
+                print(f"⏳ {total} messages, {total / elapsed:,.0f} msg/s", file=sys.stderr)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    return {"messages": total, "seconds": elapsed, "rate": total / elapsed if elapsed else 0.0}
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Re-parse an SMS archive on a process pool.")
+    arg_parser.add_argument("input", help="JSONL or CSV file with sms/text and sender fields ('-' for stdin JSONL)")
+    arg_parser.add_argument("output", help="JSONL or CSV file for the parsed results ('-' for stdout JSONL)")
+    arg_parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    arg_parser.add_argument("--chunk-size", type=int, default=500, help="messages per task")
+    args = arg_parser.parse_args(argv)
+
+    stats = backfill(args.input, args.output, args.workers, args.chunk_size)
+    print(f"✅ Parsed {stats['messages']} messages in {stats['seconds']:.1f}s "
+          f"({stats['rate']:,.0f} msg/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
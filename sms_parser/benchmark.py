@@ -0,0 +1,554 @@
+"""Parser benchmarks replayed over ``real_sms_dataset.csv``.
+
+Run from the project root, e.g.::
+
+    python -m sms_parser.benchmark context
+    python -m sms_parser.benchmark cache
+    python -m sms_parser.benchmark import
+    python -m sms_parser.benchmark dates
+    python -m sms_parser.benchmark run --synthetic 2000000 --output after.json
+    python -m sms_parser.benchmark compare before.json after.json
+"""
+import argparse
+import csv
+import gc
+import json
+import math
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from itertools import islice
+
+from sms_parser import dates, parser
+
+DATASET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "real_sms_dataset.csv")
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter so nothing is already imported
+_IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+from sms_parser import parser
+imported = time.perf_counter()
+heavy = sorted(m for m in ("django", "joblib", "numpy", "sklearn") if m in sys.modules)
+has_model = parser.warm_up()
+warmed = time.perf_counter()
+print(json.dumps({"import": imported - start, "warm_up": warmed - imported, "model": has_model, "heavy": heavy}))
+"""
+
+
+def load_dataset(path=DATASET_PATH):
+    """Return ``(text, label)`` rows from the labelled dataset."""
+    with open(path, newline="", encoding="utf-8") as f:
+        return [(row["text"], row["label"]) for row in csv.DictReader(f)]
+
+
+# The two sides of ``context``: the same extractors and keyword type rules,
+# composed per call or around one shared context. The cascade, the template
+# cache and the classifier are left out of both, so only the sharing differs.
+def _parse_sms_per_call(sms_text, sender=None):
+    """``parse_sms`` as it was composed before ``ParseContext``.
+
+    Every extractor gets the raw string and rebuilds its own lowercased,
+    stripped and punctuation-free copies; the reference is matched twice.
+    """
+    result = {"raw_sms": sms_text, "sender": sender}
+    result["type"] = parser.detect_transaction_type(sms_text)
+    result["reference_id"], _ = parser.extract_reference_and_provider(sms_text, sender)
+    result["network_provider"] = parser.detect_provider(sender, sms_text)
+    result["amount"] = parser.extract_amount(sms_text)
+    result["balance"] = parser.extract_balance(sms_text)
+    result["transaction_fee"] = parser.extract_transaction_fee(sms_text)
+    result["customer_name"], result["customer_phone"] = parser.extract_customer_info(sms_text)
+    result["date_transaction"] = parser.parse_transaction_date(sms_text)
+    return result
+
+
+def _parse_sms_shared_context(sms_text, sender=None):
+    """The same fields from one ``ParseContext``, as ``parse_sms`` builds them."""
+    ctx = parser.ParseContext(sms_text, sender)
+    return parser._build_result(ctx, parser.detect_transaction_type(ctx))
+
+
+# The date patterns and strptime-based parsing used before sms_parser.dates
+_LEGACY_DATE_PATTERNS = [re.compile(pattern) for pattern in [
+    r'(\d{1,2}/\d{1,2}/\d{2,4}\s+\d{1,2}:\d{2}(?::\d{2})?)',
+    r'(\d{4}/\d{1,2}/\d{1,2}\s+\d{1,2}:\d{2}:\d{2})',
+    r'tarehe\s+(\d{1,2}/\d{1,2}/\d{2,4})\s+(?:saa\s+)?(\d{1,2}:\d{2})',
+    r'mnamo\s+(\d{1,2}/\d{1,2}/\d{2,4})[,\s]+(\d{1,2}:\d{2})',
+    r'(\d{1,2}/\d{1,2}/\d{2,4})\s+(\d{1,2}:\d{2})',
+]]
+
+
+def _legacy_date_from_match(match):
+    if len(match.groups()) == 1:
+        date_str = match.group(1)
+        if date_str.count('/') == 2:
+            parts = date_str.split()
+            date_part = parts[0]
+            time_part = parts[1] if len(parts) > 1 else "00:00"
+            date_components = date_part.split('/')
+            if len(date_components[2]) == 2:
+                year = int(date_components[2])
+                year = 2000 + year if year < 50 else 1900 + year
+                formatted_date = f"{date_components[0]}/{date_components[1]}/{year} {time_part}"
+                return datetime.strptime(formatted_date, "%d/%m/%Y %H:%M")
+            if date_components[0].isdigit() and int(date_components[0]) > 12:
+                return datetime.strptime(date_str, "%Y/%m/%d %H:%M:%S")
+            return datetime.strptime(date_str, "%d/%m/%Y %H:%M")
+    else:
+        date_part = match.group(1)
+        time_part = match.group(2)
+        date_components = date_part.split('/')
+        if len(date_components[2]) == 2:
+            year = int(date_components[2])
+            year = 2000 + year if year < 50 else 1900 + year
+            formatted_date = f"{date_components[0]}/{date_components[1]}/{year} {time_part}"
+            return datetime.strptime(formatted_date, "%d/%m/%Y %H:%M")
+        return datetime.strptime(f"{date_part} {time_part}", "%d/%m/%Y %H:%M")
+    return None
+
+
+def _legacy_parse_transaction_date(sms_text):
+    """``parse_transaction_date`` before the date engine (error prints silenced)."""
+    for pattern in _LEGACY_DATE_PATTERNS:
+        match = pattern.search(sms_text)
+        if match:
+            try:
+                parsed = _legacy_date_from_match(match)
+            except Exception:
+                continue
+            if parsed is not None:
+                return parsed
+    return None
+
+
+class _CopyCountingStr(str):
+    """A message that counts how often it is copied into a new view."""
+
+    copies = 0
+
+    def lower(self):
+        _CopyCountingStr.copies += 1
+        return str.lower(self)
+
+    def strip(self, *args):
+        _CopyCountingStr.copies += 1
+        return str.strip(self, *args)
+
+    def replace(self, *args):
+        _CopyCountingStr.copies += 1
+        return str.replace(self, *args)
+
+
+def _measure(funcs, messages, repeat):
+    """``[(best-of-repeat µs per message, text copies per message)]``, one per function.
+
+    The functions take turns within each repeat, so drift in machine load
+    hits every side alike.
+    """
+    runs = [[] for _ in funcs]
+    for _ in range(repeat):
+        for func, timings in zip(funcs, runs):
+            gc.collect()
+            start = time.perf_counter()
+            for text in messages:
+                func(text)
+            timings.append((time.perf_counter() - start) / len(messages) * 1e6)
+
+    rows = []
+    for func, timings in zip(funcs, runs):
+        _CopyCountingStr.copies = 0
+        for text in messages:
+            func(_CopyCountingStr(text))
+        rows.append((min(timings), _CopyCountingStr.copies / len(messages)))
+    return rows
+
+
+def bench_context(args):
+    messages = [text for text, _ in load_dataset(args.dataset)]
+    if args.limit:
+        messages = messages[:args.limit]
+
+    # Same fields on both sides, or the timings compare different work
+    for text in messages:
+        per_call, shared = _parse_sms_per_call(text), _parse_sms_shared_context(text)
+        if any(per_call[field] != shared[field] for field in per_call):
+            raise AssertionError(f"ParseContext changed the result for: {text!r}")
+
+    print(f"📊 Replaying {len(messages)} messages (best of {args.repeat}, rules only on both sides)")
+    names = ["per-call extractors", "shared ParseContext"]
+    rows = _measure([_parse_sms_per_call, _parse_sms_shared_context], messages, args.repeat)
+    for name, (latency, copies) in zip(names, rows):
+        print(f"  {name:<28} {latency:8.1f} µs/msg   {copies:5.1f} text copies/msg")
+
+    (base_latency, base_copies), (ctx_latency, ctx_copies) = rows
+    speed = f"{base_latency / ctx_latency:.2f}x faster" if ctx_latency < base_latency \
+        else f"{ctx_latency / base_latency:.2f}x slower"
+    print(f"{'✅' if ctx_latency < base_latency else '⚠️'} ParseContext is {speed}, "
+          f"{base_copies - ctx_copies:.1f} fewer text copies per message")
+
+
+def bench_cache(args):
+    messages = [text for text, _ in load_dataset(args.dataset)]
+    if args.limit:
+        messages = messages[:args.limit]
+    if args.model:
+        parser.set_model_path(args.model)
+    model, version = parser.get_model_and_version()
+    if model is None:
+        print("⚠️ No classifier available: the template cache only ever stands in for it")
+        return 1
+    # The cache is only consulted for these: everything else is settled by the rules
+    ambiguous = [text for text in messages if parser.rule_confidence(text)[1] < parser.TYPE_CONFIDENCE_THRESHOLD]
+    maxsize = parser.template_cache.maxsize or 1024
+
+    def measure(corpus):
+        # Steady state: every run starts with the corpus' templates already seen once
+        runs = {0: [], maxsize: []}
+        for _ in range(args.repeat):
+            for size, timings in runs.items():
+                parser.template_cache.clear()
+                parser.template_cache.maxsize = size
+                for text in corpus:
+                    parser.parse_sms(text)
+                parser.template_cache.hits = parser.template_cache.misses = 0
+                gc.collect()
+                start = time.perf_counter()
+                for text in corpus:
+                    parser.parse_sms(text)
+                timings.append((time.perf_counter() - start) / len(corpus) * 1e6)
+        return min(runs[0]), min(runs[maxsize]), parser.template_cache_stats()["hit_rate"]
+
+    print(f"📊 parse_sms with the classifier ({version}), template cache off vs on, best of {args.repeat}")
+    try:
+        for label, corpus in ((f"all {len(messages)} messages", messages),
+                              (f"{len(ambiguous)} ambiguous to the rules", ambiguous)):
+            off, on, hit_rate = measure(corpus)
+            print(f"  {label:<30} off {off:8.1f} µs/msg   on {on:8.1f} µs/msg   "
+                  f"{off / on:5.2f}x   hit rate {hit_rate:.0%}")
+    finally:
+        parser.template_cache.clear()
+        parser.template_cache.maxsize = maxsize
+    return 0
+
+
+def bench_import(args):
+    runs = []
+    for _ in range(args.repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", _IMPORT_PROBE], cwd=PROJECT_ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    import_ms = statistics.median(run["import"] for run in runs) * 1000
+    warm_ms = statistics.median(run["warm_up"] for run in runs) * 1000
+    print(f"📊 Import of sms_parser.parser, median of {args.repeat} fresh interpreters")
+    print(f"  import              {import_ms:8.1f} ms   heavy modules loaded: {', '.join(runs[0]['heavy']) or 'none'}")
+    print(f"  warm_up() (model: {'yes' if runs[0]['model'] else 'no'}) {warm_ms:8.1f} ms")
+    print(f"✅ Import no longer pays model loading: {import_ms:.1f} ms instead of {import_ms + warm_ms:.1f} ms")
+
+
+def _best_of(func, messages, repeat):
+    runs = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        for text in messages:
+            func(text)
+        runs.append((time.perf_counter() - start) / len(messages) * 1e6)
+    return min(runs)
+
+
+def bench_dates(args):
+    messages = [text for text, _ in load_dataset(args.dataset)]
+    if args.limit:
+        messages = messages[:args.limit]
+
+    legacy = [_legacy_parse_transaction_date(text) for text in messages]
+    dates.reset_date_stats()
+    current = [dates.parse_date(text) for text in messages]
+    stats = dates.date_stats()
+
+    print(f"📊 Parsing dates in {len(messages)} messages (best of {args.repeat})")
+    legacy_latency = _best_of(_legacy_parse_transaction_date, messages, args.repeat)
+    # Cold: every timestamp is new to the memo, as for a stream of unrelated SMS
+    cold_latency = _best_of(lambda text: (dates._to_datetime.cache_clear(), dates.parse_date(text)),
+                            messages, args.repeat)
+    warm_latency = _best_of(dates.parse_date, messages, args.repeat)
+    print(f"  {'strptime (previous)':<24} {legacy_latency:8.2f} µs/msg   found {sum(d is not None for d in legacy)}")
+    print(f"  {'date engine, cold memo':<24} {cold_latency:8.2f} µs/msg   found {stats['parsed']}")
+    print(f"  {'date engine, warm memo':<24} {warm_latency:8.2f} µs/msg")
+
+    changed = sum(old is not None and new != old for old, new in zip(legacy, current))
+    recovered = sum(old is None and new is not None for old, new in zip(legacy, current))
+    print(f"  {changed} timestamps changed (AM/PM, seconds), {recovered} recovered, "
+          f"{stats['invalid']} invalid, {stats['missing']} without a timestamp")
+    print(f"✅ {legacy_latency / cold_latency:.1f}x faster cold, {legacy_latency / warm_latency:.1f}x with the memo")
+
+
+# ✅ Benchmark Suite (run / compare)
+# Targets replayed one message at a time; each gets the raw string, as a
+# caller outside parse_sms would pass it.
+EXTRACTORS = {
+    "extract_reference_and_provider": parser.extract_reference_and_provider,
+    "detect_provider": lambda sms_text: parser.detect_provider(None, sms_text),
+    "detect_transaction_type": parser.detect_transaction_type,
+    "extract_amount": parser.extract_amount,
+    "extract_balance": parser.extract_balance,
+    "extract_transaction_fee": parser.extract_transaction_fee,
+    "extract_customer_info": parser.extract_customer_info,
+    "parse_transaction_date": parser.parse_transaction_date,
+}
+
+# Parts of a message that vary between SMS sharing a template
+_SYNTHETIC_FIELDS = re.compile(r"(\b(?=[A-Z]*\d)(?=\d*[A-Z])[A-Z0-9]{8,}\b|(?<=Tsh)\s?[\d,]+(?:\.\d{2})?)")
+
+
+def _reroll(field, rng):
+    # Same shape (letters stay letters, digits stay digits), new value
+    return "".join(
+        rng.choice("0123456789") if char.isdigit() else rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") if char.isalpha()
+        else char
+        for char in field
+    )
+
+
+def synthetic_corpus(count, seed=0, path=DATASET_PATH):
+    """Yield ``count`` synthetic SMS built from the dataset's templates.
+
+    References and ``Tsh`` amounts are re-rolled per message with the same
+    shape, so the stream looks like production traffic (few templates,
+    unique values) while only the dataset itself is ever held in memory.
+    """
+    templates = [_SYNTHETIC_FIELDS.split(text) for text, _ in load_dataset(path)]
+    rng = random.Random(seed)
+    for _ in range(count):
+        pieces = rng.choice(templates)
+        # split() with a group alternates fixed text and variable fields
+        yield "".join(_reroll(piece, rng) if i % 2 else piece for i, piece in enumerate(pieces))
+
+
+class LatencyHistogram:
+    """Constant-memory latency recorder with ~2% wide log buckets."""
+
+    _BASE = math.log(1.02)
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.total_ns = 0
+
+    def record(self, elapsed_ns, messages=1):
+        per_message = max(elapsed_ns / messages, 1)
+        self.buckets[int(math.log(per_message) / self._BASE)] += messages
+        self.count += messages
+        self.total_ns += elapsed_ns
+
+    def percentile(self, fraction):
+        threshold = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= threshold:
+                return math.exp((bucket + 0.5) * self._BASE) / 1000
+        return 0.0
+
+    def summary(self):
+        seconds = self.total_ns / 1e9
+        return {
+            "messages": self.count,
+            "throughput": self.count / seconds if seconds else 0.0,
+            "mean_us": self.total_ns / self.count / 1000 if self.count else 0.0,
+            "p50_us": self.percentile(0.50),
+            "p99_us": self.percentile(0.99),
+        }
+
+
+def _replay(func, messages, passes=1):
+    histogram = LatencyHistogram()
+    clock = time.perf_counter_ns
+    for _ in range(passes):
+        for text in messages:
+            start = clock()
+            func(text)
+            histogram.record(clock() - start)
+    return histogram
+
+
+def _replay_batches(messages, batch_size):
+    histogram = LatencyHistogram()
+    clock = time.perf_counter_ns
+    messages = iter(messages)
+    while True:
+        batch = list(islice(messages, batch_size))
+        if not batch:
+            return histogram
+        start = clock()
+        parser.parse_many(batch)
+        histogram.record(clock() - start, len(batch))
+
+
+def _model_modes(model):
+    yield "rules", None
+    if model is not None:
+        yield "model", model
+
+
+def bench_run(args):
+    messages = [text for text, _ in load_dataset(args.dataset)]
+    model = parser.get_model()
+    results = {}
+
+    def report(key, histogram, cache=None):
+        results[key] = histogram.summary()
+        if cache is not None:
+            results[key]["template_cache_hit_rate"] = cache["hit_rate"]
+            results[key]["type_tiers"] = parser.type_cascade_stats()["counts"]
+            parser.reset_type_cascade_stats()
+        row = results[key]
+        print(f"  {key:<52} {row['throughput']:>10,.0f} msg/s   p50 {row['p50_us']:8.1f} µs   p99 {row['p99_us']:8.1f} µs")
+
+    print(f"📊 Dataset: {len(messages)} messages x {args.passes} passes, "
+          f"synthetic: {args.synthetic:,} messages, model: {'yes' if model is not None else 'not available'}")
+    try:
+        for mode, mode_model in _model_modes(model):
+            parser.set_model(mode_model)
+            parser.reset_type_cascade_stats()
+            parser.template_cache.clear()
+            report(f"dataset/parse_sms/{mode}", _replay(parser.parse_sms, messages, args.passes),
+                   parser.template_cache_stats())
+            parser.template_cache.clear()
+            report(f"dataset/parse_many/{mode}", _replay_batches(messages * args.passes, args.batch_size),
+                   parser.template_cache_stats())
+            if args.synthetic:
+                parser.template_cache.clear()
+                report(f"synthetic/parse_sms/{mode}",
+                       _replay(parser.parse_sms, synthetic_corpus(args.synthetic, args.seed, args.dataset)),
+                       parser.template_cache_stats())
+                parser.template_cache.clear()
+                report(f"synthetic/parse_many/{mode}",
+                       _replay_batches(synthetic_corpus(args.synthetic, args.seed, args.dataset), args.batch_size),
+                       parser.template_cache_stats())
+    finally:
+        parser.set_model(model)
+
+    # Extractors never call the classifier, so they only run once
+    for name, func in EXTRACTORS.items():
+        report(f"dataset/{name}", _replay(func, messages, args.passes))
+
+    run = {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.platform(),
+            "dataset_messages": len(messages),
+            "passes": args.passes,
+            "synthetic_messages": args.synthetic,
+            "batch_size": args.batch_size,
+            "model": model is not None,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(run, f, indent=2)
+    print(f"✅ Results saved to {args.output}")
+
+
+def compare_runs(baseline, current, threshold=0.10):
+    """Rows of ``(key, metric, before, after, change, regressed)`` for benchmarks in both runs.
+
+    A benchmark regresses when its throughput drops, or its p50/p99 latency
+    grows, by more than ``threshold`` (a fraction).
+    """
+    rows = []
+    for key in sorted(set(baseline["results"]) & set(current["results"])):
+        before, after = baseline["results"][key], current["results"][key]
+        for metric, higher_is_better in (("throughput", True), ("p50_us", False), ("p99_us", False)):
+            old, new = before[metric], after[metric]
+            change = (new - old) / old if old else 0.0
+            regressed = -change > threshold if higher_is_better else change > threshold
+            rows.append((key, metric, old, new, change, regressed))
+    return rows
+
+
+def bench_compare(args):
+    runs = []
+    for path in (args.baseline, args.current):
+        with open(path, encoding="utf-8") as f:
+            runs.append(json.load(f))
+    baseline, current = runs
+
+    for side, run in (("baseline", baseline), ("current", current)):
+        meta = run["meta"]
+        print(f"📄 {side:<8} {meta['created']}  python {meta['python']}  model: {meta['model']}  {meta['machine']}")
+    only = set(baseline["results"]) ^ set(current["results"])
+    if only:
+        print(f"⚠️ Not in both runs, skipped: {', '.join(sorted(only))}")
+
+    rows = compare_runs(baseline, current, args.threshold)
+    for key, metric, old, new, change, regressed in rows:
+        flag = "❌ REGRESSION" if regressed else ""
+        print(f"  {key:<52} {metric:<10} {old:>12,.1f} -> {new:>12,.1f}  {change:+7.1%} {flag}")
+
+    regressions = [row for row in rows if row[5]]
+    if regressions:
+        print(f"❌ {len(regressions)} regressions beyond {args.threshold:.0%}")
+        return 1
+    print(f"✅ No regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--dataset", default=DATASET_PATH, help="labelled CSV with text,label columns")
+    subcommands = arg_parser.add_subparsers(dest="command", required=True)
+
+    context = subcommands.add_parser("context", help="per-call extractors vs the shared ParseContext")
+    context.add_argument("--repeat", type=int, default=5)
+    context.add_argument("--limit", type=int, default=0, help="only replay the first N messages")
+    context.set_defaults(func=bench_context)
+
+    cache = subcommands.add_parser("cache", help="parse_sms with and without the template type cache")
+    cache.add_argument("--repeat", type=int, default=5)
+    cache.add_argument("--limit", type=int, default=0, help="only replay the first N messages")
+    cache.add_argument("--model", default=None, help="classifier file (default: the parser's own)")
+    cache.set_defaults(func=bench_cache)
+
+    startup = subcommands.add_parser("import", help="import time with lazy model loading vs warm-up cost")
+    startup.add_argument("--repeat", type=int, default=5)
+    startup.set_defaults(func=bench_import)
+
+    date_engine = subcommands.add_parser("dates", help="strptime date parsing vs the date engine")
+    date_engine.add_argument("--repeat", type=int, default=5)
+    date_engine.add_argument("--limit", type=int, default=0, help="only replay the first N messages")
+    date_engine.set_defaults(func=bench_dates)
+
+    run = subcommands.add_parser("run", help="throughput and p50/p99 latency of parse_sms and every extractor")
+    run.add_argument("--passes", type=int, default=5, help="replays of the dataset per benchmark")
+    run.add_argument("--synthetic", type=int, default=100_000, help="synthetic messages to stream (0 to skip)")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--batch-size", type=int, default=500, help="messages per parse_many call")
+    run.add_argument("--output", default="benchmark_results.json", help="where to save the results as JSON")
+    run.set_defaults(func=bench_run)
+
+    compare = subcommands.add_parser("compare", help="flag regressions between two saved runs")
+    compare.add_argument("baseline", help="JSON saved by 'run' before the change")
+    compare.add_argument("current", help="JSON saved by 'run' after the change")
+    compare.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown as a fraction")
+    compare.set_defaults(func=bench_compare)
+
+    args = arg_parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+"""Compact, memory-mapped form of the TF-IDF + MultinomialNB classifier.
+
+``train_model.py`` exports the fitted pipeline into one ``.smsnb`` file:
+
+    8 bytes   magic  b"SMSNB\\x00\\x01\\x00"
+    8 bytes   header length (little-endian uint64)
+    header    JSON: classes, tokenizer settings, and offset/dtype/shape per array
+    arrays    64-byte aligned, little-endian:
+              token_hashes      uint64 [n_features]            sorted blake2b-64 of each token
+              idf               float64 [n_features]           in token_hashes order
+              feature_log_prob  float64 [n_features, n_classes]
+              class_log_prior   float64 [n_classes]
+
+Loading maps the file read-only, so every worker process on a host shares
+the same pages and startup takes milliseconds instead of unpickling the
+vocabulary dict. Prediction tokenizes like ``TfidfVectorizer`` (lowercase,
+``(?u)\\b\\w\\w+\\b``), looks token hashes up with ``searchsorted`` and takes the
+Naive Bayes argmax with a few NumPy operations.
+"""
+import json
+import os
+import re
+import struct
+from hashlib import blake2b
+
+import numpy as np
+
+MAGIC = b"SMSNB\x00\x01\x00"
+EXTENSION = ".smsnb"
+_ALIGN = 64
+_ARRAYS = ("token_hashes", "idf", "feature_log_prob", "class_log_prior")
+TOKEN_MEMO_SIZE = 100_000
+
+
+def token_hash(token):
+    return int.from_bytes(blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _check_supported(vectorizer):
+    # Only the settings train_model.py uses are replicated at predict time
+    unsupported = {
+        "analyzer": (vectorizer.analyzer, "word"),
+        "ngram_range": (tuple(vectorizer.ngram_range), (1, 1)),
+        "preprocessor": (vectorizer.preprocessor, None),
+        "tokenizer": (vectorizer.tokenizer, None),
+        "strip_accents": (vectorizer.strip_accents, None),
+        "binary": (vectorizer.binary, False),
+    }
+    for name, (value, expected) in unsupported.items():
+        if value != expected:
+            raise ValueError(f"Compact export does not support TfidfVectorizer({name}={value!r})")
+    if vectorizer.norm not in ("l2", None):
+        raise ValueError(f"Compact export does not support TfidfVectorizer(norm={vectorizer.norm!r})")
+
+
+def export_pipeline(pipeline, path):
+    """Write a fitted ``Pipeline([('tfidf', TfidfVectorizer), ('clf', MultinomialNB)])`` to ``path``."""
+    vectorizer = pipeline.named_steps["tfidf"]
+    classifier = pipeline.named_steps["clf"]
+    _check_supported(vectorizer)
+
+    tokens = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+    hashes = np.array([token_hash(token) for token in tokens], dtype="<u8")
+    if len(np.unique(hashes)) != len(hashes):
+        raise ValueError("Token hash collision in the vocabulary; cannot export a compact model")
+    order = np.argsort(hashes)
+
+    idf = vectorizer.idf_ if vectorizer.use_idf else np.ones(len(tokens))
+    arrays = {
+        "token_hashes": hashes[order],
+        "idf": np.ascontiguousarray(idf[order], dtype="<f8"),
+        # One row per token, so a message only gathers the rows it uses
+        "feature_log_prob": np.ascontiguousarray(classifier.feature_log_prob_.T[order], dtype="<f8"),
+        "class_log_prior": np.ascontiguousarray(classifier.class_log_prior_, dtype="<f8"),
+    }
+
+    header = {
+        "classes": [str(label) for label in classifier.classes_],
+        "lowercase": bool(vectorizer.lowercase),
+        "token_pattern": vectorizer.token_pattern,
+        "norm": vectorizer.norm,
+        "sublinear_tf": bool(vectorizer.sublinear_tf),
+        "arrays": {},
+    }
+    # Offsets are relative to the end of the header block
+    offset = 0
+    for name in _ARRAYS:
+        array = arrays[name]
+        header["arrays"][name] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+        offset += -(-array.nbytes // _ALIGN) * _ALIGN
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // _ALIGN) * _ALIGN
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for name in _ARRAYS:
+            f.seek(data_start + header["arrays"][name]["offset"])
+            f.write(arrays[name].tobytes())
+    os.replace(tmp_path, path)
+    return path
+
+
+class CompactNB:
+    """Predicts like the exported pipeline from a memory-mapped ``.smsnb`` file."""
+
+    def __init__(self, path):
+        self.path = path
+        buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        if bytes(buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a compact SMS model")
+        header_length = struct.unpack("<Q", bytes(buffer[len(MAGIC):len(MAGIC) + 8]))[0]
+        header_end = len(MAGIC) + 8 + header_length
+        header = json.loads(bytes(buffer[len(MAGIC) + 8:header_end]).decode("utf-8"))
+        data_start = -(-header_end // _ALIGN) * _ALIGN
+
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"]))
+            arrays[name] = np.frombuffer(
+                buffer, dtype=dtype, count=count, offset=data_start + spec["offset"],
+            ).reshape(spec["shape"])
+
+        self.classes_ = np.array(header["classes"], dtype=object)
+        self.lowercase = header["lowercase"]
+        self.norm = header["norm"]
+        self.sublinear_tf = header["sublinear_tf"]
+        self.token_hashes = arrays["token_hashes"]
+        self.idf = arrays["idf"]
+        self.feature_log_prob = arrays["feature_log_prob"]
+        self.class_log_prior = arrays["class_log_prior"]
+        self._token_pattern = re.compile(header["token_pattern"])
+        self._buffer = buffer
+        # Per-process memo of in-vocabulary token -> feature column. Never
+        # changed in place: a reader keeps whichever dict it picked up.
+        self._columns = {}
+
+    def _resolve(self, token_lists):
+        """``{token: column}`` for this call (-1 out of vocabulary).
+
+        Tokens missing from the memo are looked up with one vectorized
+        ``searchsorted``. Only in-vocabulary tokens are memoized, so
+        references and amounts (new in nearly every SMS) do not fill it.
+        """
+        memo = self._columns
+        columns, unseen = {}, set()
+        for tokens in token_lists:
+            for token in tokens:
+                column = memo.get(token)
+                if column is None:
+                    unseen.add(token)
+                else:
+                    columns[token] = column
+        if not unseen:
+            return columns
+
+        unseen = list(unseen)
+        hashes = np.fromiter((token_hash(token) for token in unseen), dtype=np.uint64, count=len(unseen))
+        positions = np.minimum(np.searchsorted(self.token_hashes, hashes), len(self.token_hashes) - 1)
+        found = self.token_hashes[positions] == hashes
+        learned = {}
+        for token, position, known in zip(unseen, positions.tolist(), found.tolist()):
+            columns[token] = position if known else -1
+            if known:
+                learned[token] = position
+        if learned:
+            # Swapped in whole, never cleared under another thread's feet
+            self._columns = learned if len(memo) + len(learned) > TOKEN_MEMO_SIZE else {**memo, **learned}
+        return columns
+
+    def decision_function(self, texts):
+        """Joint log-likelihood per class and message (``MultinomialNB.predict_joint_log_proba``)."""
+        if self.lowercase:
+            texts = [text.lower() for text in texts]
+        token_lists = [self._token_pattern.findall(text) for text in texts]
+        columns = self._resolve(token_lists)
+
+        # Flat (row, column, count) triplets, rows in order
+        rows, features, counts, lengths = [], [], [], []
+        for row, tokens in enumerate(token_lists):
+            row_counts = {}
+            for token in tokens:
+                column = columns[token]
+                if column >= 0:
+                    row_counts[column] = row_counts.get(column, 0) + 1
+            rows.extend([row] * len(row_counts))
+            features.extend(row_counts)
+            counts.extend(row_counts.values())
+            lengths.append(len(row_counts))
+
+        scores = np.tile(self.class_log_prior, (len(texts), 1))
+        if not features:
+            return scores
+        features = np.array(features, dtype=np.intp)
+        tf = np.array(counts, dtype=np.float64)
+        if self.sublinear_tf:
+            tf = np.log(tf) + 1
+        weights = tf * self.idf[features]
+
+        if len(texts) == 1:
+            # Single message (the parse_sms path): one dot product, no segment bookkeeping
+            if self.norm == "l2":
+                weights /= np.sqrt(weights @ weights)
+            scores[0] += weights @ self.feature_log_prob[features]
+            return scores
+
+        rows = np.array(rows, dtype=np.intp)
+        if self.norm == "l2":
+            weights /= np.sqrt(np.bincount(rows, weights=weights * weights, minlength=len(texts)))[rows]
+        contributions = weights[:, None] * self.feature_log_prob[features]
+        lengths = np.array(lengths)
+        non_empty = lengths > 0
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))[non_empty]
+        scores[non_empty] += np.add.reduceat(contributions, starts, axis=0)
+        return scores
+
+    def predict(self, texts):
+        texts = list(texts)
+        if not texts:
+            return self.classes_[:0]
+        return self.classes_[np.argmax(self.decision_function(texts), axis=1)]
+
+    def __repr__(self):
+        return f"CompactNB({self.path!r}, {len(self.token_hashes)} tokens, {len(self.classes_)} classes)"
+
+
+def load(path):
+    return CompactNB(path)
@@ -0,0 +1,104 @@
+"""Transaction date engine for SMS timestamps.
+
+Every supported layout is matched by one precompiled regex with named
+groups, and the components go straight into ``datetime(...)`` as integers:
+
+    25/03/24 14:30                  dd/mm/yy hh:mm (also dd/mm/yyyy, with :ss)
+    Tarehe 5/3/25 2:15 PM           12-hour clock with AM/PM
+    mnamo 5/3/25, saa 9:05 AM       "saa"/"tar" and commas between date and time
+    2024/03/25 14:30:15             yyyy/mm/dd hh:mm:ss
+
+Two-digit years below 50 are 20xx, the rest 19xx. Results are memoized per
+matched timestamp, since bursts of SMS often share one, and failures are
+counted in ``date_stats()`` instead of being printed.
+"""
+import re
+from collections import Counter
+from datetime import datetime
+from functools import lru_cache
+
+DATE_PATTERN = re.compile(r"""
+    (?:
+        (?P<iso_year>\d{4})/(?P<iso_month>\d{1,2})/(?P<iso_day>\d{1,2})
+      | (?P<day>\d{1,2})/(?P<month>\d{1,2})/(?P<year>\d{4}|\d{2})
+    )
+    (?!\d)
+    [,\s]+(?:(?:saa|tar)\s+)?
+    (?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?
+    (?:\s*(?P<meridiem>[ap])\.?m\b\.?)?
+""", re.IGNORECASE | re.VERBOSE)
+
+DATE_CACHE_SIZE = 512
+
+# Best-effort counters: cheap enough for the hot path, and a rare lost
+# increment under threads does not matter for monitoring.
+_counts = Counter()
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def _to_datetime(iso_year, iso_month, iso_day, day, month, year, hour, minute, second, meridiem):
+    if iso_year:
+        year, month, day = int(iso_year), int(iso_month), int(iso_day)
+    else:
+        year, month, day = int(year), int(month), int(day)
+        if year < 100:
+            year += 2000 if year < 50 else 1900
+
+    hour = int(hour)
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem in "pP" else 0)
+
+    try:
+        return datetime(year, month, day, hour, int(minute), int(second or 0))
+    except ValueError:
+        return None
+
+
+def parse_date(text):
+    """Return the first valid timestamp in ``text`` as a ``datetime``, or ``None``.
+
+    Every timestamp starts with up to four digits and a ``/``, so the regex is
+    only tried on the digits right before each slash (found with
+    ``str.find``) instead of at every position of the message. A match with
+    impossible values (``31/02/24``, ``25:00``) is counted as invalid and the
+    search moves on to the next candidate.
+    """
+    next_start = 0
+    slash = text.find("/")
+    while slash != -1:
+        start = max(slash - 4, next_start)
+        while start < slash and not text[start].isdigit():
+            start += 1
+        while start < slash:
+            match = DATE_PATTERN.match(text, start)
+            if match:
+                # Named groups are declared in _to_datetime's argument order
+                parsed = _to_datetime(*match.groups())
+                if parsed is not None:
+                    _counts["parsed"] += 1
+                    return parsed
+                _counts["invalid"] += 1
+                next_start = match.end()
+                break
+            start += 1
+        else:
+            next_start = max(next_start, slash)
+        slash = text.find("/", max(slash + 1, next_start))
+
+    _counts["missing"] += 1
+    return None
+
+
+def date_stats():
+    """Counters since start-up (or the last ``reset_date_stats()``) plus memo usage."""
+    stats = {outcome: _counts[outcome] for outcome in ("parsed", "invalid", "missing")}
+    info = _to_datetime.cache_info()
+    stats["cache"] = {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize}
+    return stats
+
+
+def reset_date_stats():
+    _counts.clear()
+    _to_datetime.cache_clear()
@@ -0,0 +1,169 @@
+"""Optional per-pattern hit and timing counters for ``sms_parser.parser``.
+
+Switch it on at runtime (or with ``SMS_PARSER_INSTRUMENT=1`` before the
+parser is imported), send traffic through the parser, then read the
+counters::
+
+    from sms_parser import parser
+    parser.enable_instrumentation()
+    ...
+    parser.instrumentation_stats()          # dict, JSON-serializable
+    print(parser.instrumentation_report())  # text table
+
+Or replay a file (default: the labelled dataset) and dump the report::
+
+    python -m sms_parser.instrumentation --input export.jsonl --json stats.json
+
+Two views are kept. Per pattern (``"amount[7]"``): attempts, hits and time
+spent. Per extractor call and provider: how many patterns were tried
+before the winner, which index won, and the total time.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class PatternStats:
+    """Thread-safe counters fed by the parser while instrumentation is on."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # (field, index) -> [attempts, hits, nanoseconds, pattern source]
+            self.patterns = {}
+            # (field, provider) -> counters for whole extractor calls
+            self.extractors = {}
+
+    def _attempts(self):
+        return getattr(self._local, "attempts", 0)
+
+    def attempt(self, field, index, pattern, hit, elapsed_ns):
+        """One pattern tried once."""
+        self._local.attempts = self._attempts() + 1
+        with self._lock:
+            entry = self.patterns.get((field, index))
+            if entry is None:
+                entry = self.patterns[(field, index)] = [0, 0, 0, getattr(pattern, "pattern", str(pattern))]
+            entry[0] += 1
+            entry[1] += bool(hit)
+            entry[2] += elapsed_ns
+
+    def start(self):
+        """Token for ``finish``: start time and this thread's attempt count so far."""
+        return time.perf_counter_ns(), self._attempts()
+
+    def finish(self, token, field, provider, winner):
+        """One extractor call done; ``winner`` is the matching index, or ``None``/-1 for a miss."""
+        started, attempts_before = token
+        elapsed_ns = time.perf_counter_ns() - started
+        hit = winner is not None and winner != -1
+        tried = self._attempts() - attempts_before
+        with self._lock:
+            entry = self.extractors.get((field, provider))
+            if entry is None:
+                entry = self.extractors[(field, provider)] = {
+                    "calls": 0, "hits": 0, "tried_before_hit": 0, "nanoseconds": 0, "winners": Counter(),
+                }
+            entry["calls"] += 1
+            entry["nanoseconds"] += elapsed_ns
+            if hit:
+                entry["hits"] += 1
+                entry["tried_before_hit"] += max(tried - 1, 0)
+                entry["winners"][str(winner)] += 1
+
+    def snapshot(self):
+        """All counters as plain, JSON-serializable data."""
+        with self._lock:
+            patterns = [
+                {
+                    "pattern": f"{field}[{index}]", "field": field, "index": index,
+                    "attempts": attempts, "hits": hits, "seconds": ns / 1e9, "source": source,
+                }
+                for (field, index), (attempts, hits, ns, source) in self.patterns.items()
+            ]
+            extractors = [
+                {
+                    "field": field, "provider": provider, "calls": entry["calls"], "hits": entry["hits"],
+                    "avg_tried_before_hit": entry["tried_before_hit"] / entry["hits"] if entry["hits"] else 0.0,
+                    "seconds": entry["nanoseconds"] / 1e9, "winners": dict(entry["winners"]),
+                }
+                for (field, provider), entry in self.extractors.items()
+            ]
+
+        providers = Counter()
+        for row in extractors:
+            providers[row["provider"]] += row["seconds"]
+        return {
+            "patterns": sorted(patterns, key=lambda row: (row["field"], str(row["index"]))),
+            "extractors": sorted(extractors, key=lambda row: (row["field"], row["provider"])),
+            "provider_seconds": dict(providers),
+        }
+
+    def report(self, top=15):
+        """Text report: extractors per provider, the costliest patterns, and patterns that never hit."""
+        data = self.snapshot()
+        lines = ["📊 Extractors by provider"]
+        lines.append(f"  {'field':<10} {'provider':<12} {'calls':>8} {'hit %':>7} {'tried first':>11} {'total ms':>10}")
+        for row in data["extractors"]:
+            hit_rate = row["hits"] / row["calls"] * 100 if row["calls"] else 0.0
+            lines.append(f"  {row['field']:<10} {row['provider']:<12} {row['calls']:>8} {hit_rate:>6.1f}% "
+                         f"{row['avg_tried_before_hit']:>11.2f} {row['seconds'] * 1000:>10.1f}")
+
+        lines.append("📊 Time per provider")
+        for provider, seconds in sorted(data["provider_seconds"].items(), key=lambda item: -item[1]):
+            lines.append(f"  {provider:<12} {seconds * 1000:>10.1f} ms")
+
+        lines.append(f"📊 Costliest patterns (top {top})")
+        lines.append(f"  {'pattern':<22} {'attempts':>9} {'hits':>8} {'hit %':>7} {'total ms':>10} {'µs/try':>8}")
+        for row in sorted(data["patterns"], key=lambda row: -row["seconds"])[:top]:
+            hit_rate = row["hits"] / row["attempts"] * 100 if row["attempts"] else 0.0
+            lines.append(f"  {row['pattern']:<22} {row['attempts']:>9} {row['hits']:>8} {hit_rate:>6.1f}% "
+                         f"{row['seconds'] * 1000:>10.1f} {row['seconds'] / row['attempts'] * 1e6:>8.2f}")
+
+        dead = [row for row in data["patterns"] if not row["hits"]]
+        lines.append(f"⚠️ Patterns tried but never matched: {len(dead)}")
+        for row in dead:
+            lines.append(f"  {row['pattern']:<22} {row['attempts']:>9} tries  {row['source'][:70]}")
+        return "\n".join(lines)
+
+
+def main(argv=None):
+    from sms_parser import parser
+    from sms_parser.backfill import iter_records
+
+    arg_parser = argparse.ArgumentParser(description="Replay SMS with pattern instrumentation and print the report.")
+    arg_parser.add_argument("--input", default=None, help="JSONL or CSV with sms/text and sender (default: the dataset)")
+    arg_parser.add_argument("--json", default=None, help="also write the raw counters to this JSON file")
+    arg_parser.add_argument("--top", type=int, default=15, help="patterns listed in the costliest table")
+    args = arg_parser.parse_args(argv)
+
+    if args.input is None:
+        from sms_parser.benchmark import load_dataset
+        records = ((text, None) for text, _ in load_dataset())
+    else:
+        records = iter_records(args.input)
+
+    stats = parser.enable_instrumentation()
+    stats.reset()
+    total = 0
+    for sms_text, sender in records:
+        parser.parse_sms(sms_text, sender)
+        total += 1
+
+    print(f"✅ Replayed {total} messages")
+    print(stats.report(args.top))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(stats.snapshot(), f, indent=2)
+        print(f"✅ Counters saved to {args.json}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
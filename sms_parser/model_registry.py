@@ -0,0 +1,246 @@
+"""Versioned classifier files with an atomically switched "active" pointer.
+
+A registry is a directory::
+
+    models/
+        versions/20261018T170501Z-3f2a9c1b.smsnb
+        versions/20261020T091244Z-be41d007.pkl
+        ACTIVE          {"version": ..., "previous": ..., "activated": ...}
+
+``ACTIVE`` is only ever replaced whole (``os.replace``), so a reader sees
+the old pointer or the new one, never half of each. Parsers started with
+``SMS_MODEL_REGISTRY=models`` (or ``parser.use_model_registry``) stat it
+at most every ``SMS_MODEL_POLL_SECONDS`` and, when it changes, load and
+warm up the new version on a background thread before swapping it in;
+requests keep using the old model until then::
+
+    python -m sms_parser.model_registry publish sms_parser/sms_model.smsnb --activate
+    python -m sms_parser.model_registry list
+    python -m sms_parser.model_registry activate 20261018T170501Z-3f2a9c1b
+    python -m sms_parser.model_registry rollback
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REGISTRY = os.environ.get(
+    "SMS_MODEL_REGISTRY", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+)
+POLL_SECONDS = float(os.environ.get("SMS_MODEL_POLL_SECONDS", "2"))
+MODEL_EXTENSIONS = (".smsnb", ".pkl")
+
+
+def _versions_dir(registry):
+    return os.path.join(registry, "versions")
+
+
+def _pointer_path(registry):
+    return os.path.join(registry, "ACTIVE")
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def list_versions(registry=DEFAULT_REGISTRY):
+    """Version names, oldest first (names start with their publish time)."""
+    try:
+        names = os.listdir(_versions_dir(registry))
+    except FileNotFoundError:
+        return []
+    return sorted(os.path.splitext(name)[0] for name in names if name.endswith(MODEL_EXTENSIONS))
+
+
+def version_path(registry, version):
+    for extension in MODEL_EXTENSIONS:
+        path = os.path.join(_versions_dir(registry), version + extension)
+        if os.path.exists(path):
+            return path
+    raise LookupError(f"Model version {version!r} is not in {registry}")
+
+
+def read_pointer(registry=DEFAULT_REGISTRY):
+    """The ``ACTIVE`` record, or ``None`` before anything was activated."""
+    try:
+        with open(_pointer_path(registry), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def active_version(registry=DEFAULT_REGISTRY):
+    pointer = read_pointer(registry)
+    return pointer["version"] if pointer else None
+
+
+def publish(model_file, registry=DEFAULT_REGISTRY):
+    """Copy ``model_file`` into the registry under a new version name and return it."""
+    extension = os.path.splitext(model_file)[1]
+    if extension not in MODEL_EXTENSIONS:
+        raise ValueError(f"Unsupported model file {model_file!r}; expected one of {MODEL_EXTENSIONS}")
+
+    digest = hashlib.sha256()
+    with open(model_file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    version = f"{stamp}-{digest.hexdigest()[:8]}"
+
+    os.makedirs(_versions_dir(registry), exist_ok=True)
+    path = os.path.join(_versions_dir(registry), version + extension)
+    # Copied under a temporary name so a watcher never maps a half-written file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    shutil.copyfile(model_file, tmp_path)
+    os.replace(tmp_path, path)
+    return version
+
+
+def activate(version, registry=DEFAULT_REGISTRY):
+    """Point ``ACTIVE`` at ``version``; running parsers pick it up on their next poll."""
+    version_path(registry, version)
+    current = active_version(registry)
+    _write_atomic(_pointer_path(registry), json.dumps({
+        "version": version,
+        "previous": current if current != version else (read_pointer(registry) or {}).get("previous"),
+        "activated": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }))
+    return version
+
+
+def rollback(registry=DEFAULT_REGISTRY):
+    """Re-activate the version that was active before the current one."""
+    pointer = read_pointer(registry)
+    if not pointer or not pointer.get("previous"):
+        raise LookupError("Nothing to roll back to")
+    return activate(pointer["previous"], registry)
+
+
+class RegistryWatcher:
+    """Follows a registry's ``ACTIVE`` pointer on behalf of one process.
+
+    ``check()`` sits on the parse path: between polls it is one clock read,
+    and a poll is one ``os.stat``. A changed pointer is loaded by
+    ``load(path)`` and warmed up on a background thread, then handed to
+    ``swap(model, version)``; a version that fails to load is logged and
+    skipped until the pointer changes again.
+    """
+
+    def __init__(self, registry, load, swap, poll_seconds=POLL_SECONDS):
+        self.registry = os.path.abspath(registry)
+        self.load = load
+        self.swap = swap
+        self.poll_seconds = poll_seconds
+        self.version = None
+        self._stamp = None
+        self._next_poll = 0.0
+        self._loading = False
+        self._lock = threading.Lock()
+
+    def _pointer_stamp(self):
+        try:
+            stat = os.stat(_pointer_path(self.registry))
+        except FileNotFoundError:
+            return None
+        # The inode changes on every os.replace, even within one mtime tick
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def load_active(self):
+        """Load the active version synchronously (first use); ``(model, version)``."""
+        self._stamp = self._pointer_stamp()
+        self._next_poll = time.monotonic() + self.poll_seconds
+        version = active_version(self.registry)
+        if version is None:
+            logger.warning("Model registry %s has no active version", self.registry)
+            return None, None
+        model = self.load(version_path(self.registry, version))
+        if model is None:
+            return None, None
+        self.version = version
+        return model, version
+
+    def check(self):
+        now = time.monotonic()
+        if now < self._next_poll or self._loading:
+            return
+        self._next_poll = now + self.poll_seconds
+        stamp = self._pointer_stamp()
+        if stamp == self._stamp:
+            return
+        with self._lock:
+            if self._loading or stamp == self._stamp:
+                return
+            self._stamp = stamp
+            version = active_version(self.registry)
+            if version is None or version == self.version:
+                return
+            self._loading = True
+        threading.Thread(target=self._reload, args=(version,), name="sms-model-reload", daemon=True).start()
+
+    def _reload(self, version):
+        started = time.perf_counter()
+        try:
+            model = self.load(version_path(self.registry, version))
+            if model is None:
+                return
+            # Pay the first-prediction cost here rather than on a request
+            model.predict(["warm up"])
+            self.swap(model, version)
+            self.version = version
+            logger.info("Switched SMS classifier to %s in %.2fs", version, time.perf_counter() - started)
+        except Exception as e:
+            logger.warning("Could not switch SMS classifier to %s: %s", version, e)
+        finally:
+            self._loading = False
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Publish, activate and roll back classifier versions.")
+    arg_parser.add_argument("--registry", default=DEFAULT_REGISTRY, help="registry directory")
+    subcommands = arg_parser.add_subparsers(dest="command", required=True)
+
+    publish_cmd = subcommands.add_parser("publish", help="copy a .smsnb or .pkl file in as a new version")
+    publish_cmd.add_argument("model_file")
+    publish_cmd.add_argument("--activate", action="store_true", help="also make it the active version")
+    activate_cmd = subcommands.add_parser("activate", help="make a published version active")
+    activate_cmd.add_argument("version")
+    subcommands.add_parser("rollback", help="re-activate the previously active version")
+    subcommands.add_parser("list", help="list published versions")
+    args = arg_parser.parse_args(argv)
+
+    try:
+        if args.command == "publish":
+            version = publish(args.model_file, args.registry)
+            print(f"✅ Published {version}")
+            if args.activate:
+                activate(version, args.registry)
+                print(f"✅ Activated {version}")
+        elif args.command == "activate":
+            print(f"✅ Activated {activate(args.version, args.registry)}")
+        elif args.command == "rollback":
+            print(f"↩️ Rolled back to {rollback(args.registry)}")
+        else:
+            active = active_version(args.registry)
+            for version in list_versions(args.registry):
+                print(f"{'*' if version == active else ' '} {version}")
+    except (LookupError, ValueError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
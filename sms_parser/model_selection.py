@@ -0,0 +1,203 @@
+"""Compare candidate transaction-type classifiers on accuracy and latency together.
+
+Every candidate is trained on the same 80/20 split ``train_model.py`` uses
+and reported next to the rule-only ``detect_transaction_type`` baseline::
+
+    python -m sms_parser.model_selection
+    python -m sms_parser.model_selection --candidates tfidf-nb char-svm rules --json selection.json
+
+Vectorized feature matrices are cached on disk with ``joblib.Memory``, so
+candidates sharing a vectorizer (and later runs) only fit it once. Fitting
+and scoring run in parallel on all cores; latency and size are measured
+afterwards, one candidate at a time, so workers do not skew each other's
+timings.
+"""
+import argparse
+import json
+import os
+import pickle
+import statistics
+import sys
+import tempfile
+import time
+
+from joblib import Memory, Parallel, delayed
+from sklearn.base import clone
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, f1_score
+from sklearn.model_selection import train_test_split
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.pipeline import Pipeline
+from sklearn.svm import LinearSVC
+
+from sms_parser import compact_model, parser
+from sms_parser.benchmark import DATASET_PATH, load_dataset
+
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "sms_model_selection")
+
+# name -> (pipeline step name, unfitted vectorizer)
+FEATURES = {
+    "word": ("tfidf", TfidfVectorizer(lowercase=True, stop_words='english')),
+    "char": ("tfidf", TfidfVectorizer(lowercase=True, analyzer='char_wb', ngram_range=(2, 5),
+                                      min_df=2, sublinear_tf=True)),
+    "hash": ("hash", HashingVectorizer(lowercase=True, stop_words='english', alternate_sign=False,
+                                       norm=None, n_features=2 ** 18)),
+}
+
+# name -> (features, unfitted classifier); "tfidf-nb" is what train_model.py ships
+CANDIDATES = {
+    "tfidf-nb": ("word", MultinomialNB()),
+    "tfidf-svm": ("word", LinearSVC()),
+    "tfidf-logreg": ("word", LogisticRegression(max_iter=1000)),
+    "char-nb": ("char", MultinomialNB(alpha=0.1)),
+    "char-svm": ("char", LinearSVC()),
+    "char-logreg": ("char", LogisticRegression(max_iter=1000)),
+    "hash-nb": ("hash", MultinomialNB(alpha=0.01)),
+}
+# Extra rows that need no fitting of their own
+COMPACT_CANDIDATE = "tfidf-nb-compact"
+RULES_CANDIDATE = "rules"
+
+
+def split_dataset(path=DATASET_PATH):
+    rows = load_dataset(path)
+    texts, labels = [text for text, _ in rows], [label for _, label in rows]
+    return train_test_split(texts, labels, test_size=0.2, random_state=42)
+
+
+def _vectorize(vectorizer, train_texts, test_texts):
+    vectorizer = clone(vectorizer)
+    started = time.perf_counter()
+    X_train = vectorizer.fit_transform(train_texts)
+    return vectorizer, X_train, vectorizer.transform(test_texts), time.perf_counter() - started
+
+
+def _score(labels, predicted):
+    return {
+        "macro_f1": f1_score(labels, predicted, average='macro', zero_division=0),
+        "accuracy": accuracy_score(labels, predicted),
+    }
+
+
+def _fit_candidate(name, memory, split):
+    X_train_texts, X_test_texts, y_train, y_test = split
+    features, classifier = CANDIDATES[name]
+    step, vectorizer = FEATURES[features]
+    vectorizer, X_train, X_test, vectorize_seconds = memory.cache(_vectorize)(vectorizer, X_train_texts, X_test_texts)
+
+    classifier = clone(classifier)
+    started = time.perf_counter()
+    classifier.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - started
+
+    row = {"candidate": name, "features": features, "fit_seconds": vectorize_seconds + fit_seconds}
+    row.update(_score(y_test, classifier.predict(X_test)))
+    return row, Pipeline([(step, vectorizer), ('clf', classifier)])
+
+
+def _latency(predict_one, predict_batch, texts, samples):
+    """Median and p95 single-message time, and per-message time in one batch, in microseconds."""
+    single = []
+    for text in texts[:samples]:
+        started = time.perf_counter_ns()
+        predict_one(text)
+        single.append((time.perf_counter_ns() - started) / 1000)
+    started = time.perf_counter_ns()
+    predict_batch(texts)
+    batch = (time.perf_counter_ns() - started) / 1000 / len(texts)
+    single.sort()
+    return {
+        "single_p50_us": statistics.median(single),
+        "single_p95_us": single[min(len(single) - 1, int(len(single) * 0.95))],
+        "batch_us": batch,
+    }
+
+
+def _rules_predict(text):
+    return parser.detect_transaction_type(text)
+
+
+def evaluate(names, split, memory, jobs=-1, samples=200):
+    """Fit ``names`` in parallel, then time each one; returns report rows."""
+    _, test_texts, _, y_test = split
+    fitted = [name for name in names if name in CANDIDATES]
+    if COMPACT_CANDIDATE in names and "tfidf-nb" not in fitted:
+        fitted.append("tfidf-nb")
+
+    # Fill the feature cache first, one job per vectorizer, so candidate jobs only read it
+    used = {CANDIDATES[name][0] for name in fitted}
+    Parallel(n_jobs=jobs)(
+        delayed(memory.cache(_vectorize))(FEATURES[features][1], split[0], test_texts) for features in used
+    )
+    results = Parallel(n_jobs=jobs)(delayed(_fit_candidate)(name, memory, split) for name in fitted)
+
+    rows = []
+    for row, pipeline in results:
+        if row["candidate"] in names:
+            row.update(_latency(lambda text: pipeline.predict([text]), pipeline.predict, test_texts, samples))
+            row["size_bytes"] = len(pickle.dumps(pipeline, protocol=pickle.HIGHEST_PROTOCOL))
+            rows.append(row)
+        if row["candidate"] == "tfidf-nb" and COMPACT_CANDIDATE in names:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = compact_model.export_pipeline(pipeline, os.path.join(tmp, "model" + compact_model.EXTENSION))
+                compact = compact_model.load(path)
+                compact_row = {"candidate": COMPACT_CANDIDATE, "features": "word", "fit_seconds": row["fit_seconds"]}
+                compact_row.update(_score(y_test, compact.predict(test_texts)))
+                compact_row.update(_latency(lambda text: compact.predict([text]), compact.predict, test_texts, samples))
+                compact_row["size_bytes"] = os.path.getsize(path)
+                del compact
+            rows.append(compact_row)
+
+    if RULES_CANDIDATE in names:
+        row = {"candidate": RULES_CANDIDATE, "features": "keywords", "fit_seconds": 0.0}
+        row.update(_score(y_test, [_rules_predict(text) for text in test_texts]))
+        row.update(_latency(_rules_predict, lambda texts: [_rules_predict(text) for text in texts],
+                            test_texts, samples))
+        row["size_bytes"] = 0
+        rows.append(row)
+
+    return sorted(rows, key=lambda row: (-row["macro_f1"], row["single_p50_us"]))
+
+
+def format_table(rows):
+    lines = [f"  {'candidate':<18} {'macro-F1':>8} {'accuracy':>8} {'fit s':>7} "
+             f"{'1 msg p50 µs':>12} {'p95 µs':>8} {'batch µs/msg':>12} {'size KB':>9}"]
+    for row in rows:
+        lines.append(f"  {row['candidate']:<18} {row['macro_f1']:>8.3f} {row['accuracy']:>8.3f} "
+                     f"{row['fit_seconds']:>7.2f} {row['single_p50_us']:>12.1f} {row['single_p95_us']:>8.1f} "
+                     f"{row['batch_us']:>12.2f} {row['size_bytes'] / 1024:>9.0f}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    choices = list(CANDIDATES) + [COMPACT_CANDIDATE, RULES_CANDIDATE]
+    arg_parser = argparse.ArgumentParser(description="Compare classifier candidates on macro-F1, latency and size.")
+    arg_parser.add_argument("--dataset", default=DATASET_PATH, help="CSV with text,label columns")
+    arg_parser.add_argument("--candidates", nargs="+", choices=choices, default=choices)
+    arg_parser.add_argument("--jobs", type=int, default=-1, help="parallel workers (default: all cores)")
+    arg_parser.add_argument("--samples", type=int, default=200, help="messages timed one by one per candidate")
+    arg_parser.add_argument("--cache-dir", default=CACHE_DIR, help="on-disk cache of vectorized features")
+    arg_parser.add_argument("--clear-cache", action="store_true", help="drop cached features first")
+    arg_parser.add_argument("--json", default=None, help="also write the rows to this JSON file")
+    args = arg_parser.parse_args(argv)
+
+    memory = Memory(args.cache_dir, verbose=0)
+    if args.clear_cache:
+        memory.clear(warn=False)
+
+    split = split_dataset(args.dataset)
+    print(f"🚀 {len(args.candidates)} candidates, {len(split[0])} training / {len(split[1])} test messages")
+    rows = evaluate(args.candidates, split, memory, jobs=args.jobs, samples=args.samples)
+
+    print("📊 Model selection (best macro-F1 first)")
+    print(format_table(rows))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+        print(f"✅ Results saved to {args.json}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,278 +1,800 @@
+import os
 import re
 import sys
 import json
-import joblib
-from datetime import datetime
-
-# 🔑 Django Model Support (Only if needed)
-try:
-    import os
-    import django
-    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "your_project_name.settings")
-    django.setup()
-    from transactions.models import Provider
-except:
-    Provider = None
-
-# Load trained model
-try:
-    model = joblib.load("sms_parser/sms_model.pkl")
-except:
-    model = None
+import time
+import argparse
+import logging
+import threading
+from collections import Counter, OrderedDict
+from functools import cached_property
 
-# ✅ Enhanced Reference and Provider Extraction
-def extract_reference_and_provider(sms_text, sender=None):
-    sms_text = sms_text.strip()
-    reference_id = None
-    provider = sender or "UNKNOWN"
-
-    # 1️⃣ M-Pesa Reference Patterns (Most Common)
-    mpesa_patterns = [
-        r'\b([A-Z]{2,3}\d{1,2}[A-Z]\d[A-Z0-9]{6,8})\b',  # Standard M-Pesa format like CCC3H3KXJZV
-        r'\b(C[A-Z0-9]{8,12})\b',  # C followed by alphanumeric
-        r'(?:Reference|Ref|TxnID|Transaction ID)[\s:]*([A-Z0-9]{8,15})'
-    ]
-    
-    for pattern in mpesa_patterns:
-        match = re.search(pattern, sms_text, re.IGNORECASE)
-        if match:
-            reference_id = match.group(1).upper()
-            provider = "M-PESA"
-            return reference_id, provider
-
-    # 2️⃣ TigoPesa/Mixx by Yas Reference Patterns
-    tigo_patterns = [
-        r'(?:Kumbukumbu\s+No[:\.]?\s*)(\d{10,15})',
-        r'(?:Kumbukumbu\s+namba[:\s]*)(\d{10,15})',
-        r'(?:Kumbukumbu\s+no[:\.]?\s*)(\d{10,15})',
-        r'(?:Kumbukumbu\s+ya\s+malipo.[:\.]?\s*)(\d{10,15})',
-        r'(?: Muamala\s[:\.]?\s*)(\d{10,15})',
-        r'(?:TxnID\s*[:\-]?\s*)(\d{6,15})'
-    ]
-    
-    for pattern in tigo_patterns:
-        match = re.search(pattern, sms_text, re.IGNORECASE)
-        if match:
-            reference_id = match.group(1)
-            provider = "TIGOPESA" if "tigo" in sms_text.lower() else "YAS"
-            return reference_id, provider
-
-    # 3️⃣ AirtelMoney Reference Patterns
-    airtel_patterns = [
-        r'(?:TID|Transaction ID|TXN Id|Muamala No)[:\s]*([A-Z]{2}\d{6}\.\d{4}\.[A-Z0-9]{6,8})',
-        r'(?:TID|Transaction ID)[:\s]*([A-Z0-9]{10,20})',
-        r'Muamala\s+No[:\s]*([A-Z0-9]{10,20})'
-    ]
-    
-    for pattern in airtel_patterns:
-        match = re.search(pattern, sms_text, re.IGNORECASE)
-        if match:
-            reference_id = match.group(1)
-            provider = "AIRTELMONEY"
-            return reference_id, provider
-
-    # 4️⃣ HaloPesa Reference Patterns
-    halo_patterns = [
-        r'(?:Utambulisho\s+wa\s+muamala|Utambulisho\s+wa\s+Muamala)[:\s]*(\d{10,15})',
-        r'HALODEP(\d+)',  # For deposit references
-    ]
-    
-    for pattern in halo_patterns:
-        match = re.search(pattern, sms_text, re.IGNORECASE)
-        if match:
-            reference_id = match.group(1) if pattern != r'HALODEP(\d+)' else f"HALODEP{match.group(1)}"
-            provider = "HALOPESA"
-            return reference_id, provider
-
-    # 5️⃣ Generic Reference Patterns (fallback)
-    generic_patterns = [
-        r'(?:Reference|Ref)[:\s]*([A-Z0-9]{6,15})',
-        r'(?:Transaction|Txn)[:\s]*([A-Z0-9]{6,15})'
-    ]
-    
-    for pattern in generic_patterns:
-        match = re.search(pattern, sms_text, re.IGNORECASE)
+from sms_parser.dates import DATE_PATTERN, parse_date
+from sms_parser.instrumentation import PatternStats
+
+logger = logging.getLogger(__name__)
+
+# Importing this module has no side effects: Django and the classifier are
+# only touched when a message is actually parsed (or on warm_up()).
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sms_model.pkl")
+# Memory-mapped export written by train_model.py; preferred when present
+DEFAULT_COMPACT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sms_model.smsnb")
+
+
+# 🔑 Django Provider Registry Support (Only if needed)
+def _is_registered_provider(name):
+    """Whether ``name`` is in the Provider table, when running inside Django.
+
+    Uses the in-memory registry the transactions app loads at startup, so it
+    costs no query. Outside Django nothing is imported and this is ``False``.
+    """
+    registry = sys.modules.get("transactions.provider_registry")
+    if registry is None:
+        return False
+    return registry.provider_registry.is_known(name)
+
+
+# 🧠 Lazily Loaded Classifier
+# (model, version) swapped as one tuple, so a parse never pairs a model with another's version
+_active_model = (None, None)
+_model_loaded = False
+_model_lock = threading.Lock()
+_model_path = os.path.abspath(os.environ["SMS_MODEL_PATH"]) if os.environ.get("SMS_MODEL_PATH") else None
+# Set while following a model registry (see sms_parser.model_registry)
+_registry_watcher = None
+
+
+def _default_model_path():
+    if os.path.exists(DEFAULT_COMPACT_MODEL_PATH):
+        return DEFAULT_COMPACT_MODEL_PATH
+    return DEFAULT_MODEL_PATH
+
+
+def _load_model(path):
+    try:
+        if path.endswith(".smsnb"):
+            from sms_parser import compact_model
+            return compact_model.load(path)
+        import joblib
+        return joblib.load(path)
+    except Exception as e:
+        logger.warning("SMS classifier unavailable, using rule-based types (%s): %s", path, e)
+        return None
+
+
+def _load_active_model():
+    if _registry_watcher is not None:
+        return _registry_watcher.load_active()
+    path = _model_path or _default_model_path()
+    model = _load_model(path)
+    return model, os.path.basename(path) if model is not None else None
+
+
+def get_model_and_version():
+    """``(classifier, version)``, loaded once (thread-safely) on first use; ``(None, None)`` if unavailable."""
+    global _active_model, _model_loaded
+    if not _model_loaded:
+        with _model_lock:
+            if not _model_loaded:
+                _active_model = _load_active_model()
+                _model_loaded = True
+    elif _registry_watcher is not None:
+        _registry_watcher.check()
+    return _active_model
+
+
+def get_model():
+    """The classifier, loaded once (thread-safely) on first use; ``None`` if unavailable."""
+    return get_model_and_version()[0]
+
+
+def _swap_model(watcher, model, version):
+    global _active_model
+    with _model_lock:
+        # A model pinned or another source chosen meanwhile wins over a late reload
+        if _registry_watcher is watcher:
+            _active_model = (model, version)
+    # Cached templates carry types the previous model decided
+    template_cache.clear()
+
+
+def set_model(model, version=None):
+    """Pin the classifier (and stop following a registry); ``None`` switches to the rule-based types."""
+    global _active_model, _model_loaded, _registry_watcher
+    with _model_lock:
+        _active_model, _model_loaded, _registry_watcher = (model, version), True, None
+    template_cache.clear()
+
+
+def set_model_path(path):
+    """Point the parser at another model file; it is loaded on next use."""
+    global _active_model, _model_loaded, _model_path, _registry_watcher
+    with _model_lock:
+        _active_model, _model_loaded, _model_path = (None, None), False, os.path.abspath(path)
+        _registry_watcher = None
+    template_cache.clear()
+
+
+def use_model_registry(registry, poll_seconds=None):
+    """Follow a model registry's active version, hot-swapping it when it changes.
+
+    The active version is loaded on next use; after that a changed pointer
+    is loaded and warmed up in the background while parsing continues with
+    the current model (see ``sms_parser.model_registry``).
+    """
+    global _active_model, _model_loaded, _registry_watcher
+    from sms_parser import model_registry
+
+    def swap(model, version):
+        _swap_model(watcher, model, version)
+
+    watcher = model_registry.RegistryWatcher(registry, _load_model, swap)
+    if poll_seconds is not None:
+        watcher.poll_seconds = poll_seconds
+    with _model_lock:
+        _active_model, _model_loaded, _registry_watcher = (None, None), False, watcher
+    return watcher
+
+
+def warm_up():
+    """Load the classifier and run one prediction so the first real parse is not slow.
+
+    Returns ``True`` when a model is available.
+    """
+    model = get_model()
+    if model is None:
+        return False
+    model.predict(["warm up"])
+    return True
+
+
+def __getattr__(name):
+    # ``parser.model`` keeps working for callers that read it directly
+    if name == "model":
+        return get_model()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+if os.environ.get("SMS_MODEL_REGISTRY") and _model_path is None:
+    use_model_registry(os.environ["SMS_MODEL_REGISTRY"])
+
+
+# 📊 Optional Pattern Instrumentation
+# None while switched off, so the hot paths only pay one global lookup
+_pattern_stats = None
+
+
+def enable_instrumentation():
+    """Start recording per-pattern hits and timings; returns the ``PatternStats``."""
+    global _pattern_stats
+    if _pattern_stats is None:
+        _pattern_stats = PatternStats()
+    return _pattern_stats
+
+
+def disable_instrumentation():
+    """Stop recording; returns the counters collected so far (or ``None``)."""
+    global _pattern_stats
+    stats, _pattern_stats = _pattern_stats, None
+    return stats
+
+
+def instrumentation_stats():
+    return _pattern_stats.snapshot() if _pattern_stats is not None else None
+
+
+def instrumentation_report(top=15):
+    if _pattern_stats is None:
+        return "Pattern instrumentation is off (call enable_instrumentation())"
+    return _pattern_stats.report(top)
+
+
+def _instrumented(field, ctx, find, *args):
+    # Times one extractor call and records which index won for ctx's provider
+    stats = _pattern_stats
+    if stats is None:
+        return find(*args)
+    token = stats.start()
+    result = find(*args)
+    stats.finish(token, field, ctx.provider_key or "UNKNOWN", ctx.winners.get(field))
+    return result
+
+
+if os.environ.get("SMS_PARSER_INSTRUMENT", "").lower() in ("1", "true", "yes"):
+    enable_instrumentation()
+
+
+# ✅ Precompiled Pattern Chains
+class PatternChain:
+    """Ordered, precompiled regexes for one extractor; the first match wins.
+
+    ``indices`` keeps each pattern's position in the full list it was taken
+    from, so provider-specific subsets still refer to the same pattern.
+    """
+
+    def __init__(self, name, patterns, flags=0, indices=None, field=None):
+        self.name = name
+        # Label of the list ``indices`` refer to (subsets keep their parent's),
+        # used by the instrumentation
+        self.field = field or name
+        self.patterns = [p if isinstance(p, re.Pattern) else re.compile(p, flags) for p in patterns]
+        self.indices = list(indices) if indices is not None else list(range(len(self.patterns)))
+        self._pairs = list(zip(self.indices, self.patterns))
+
+    def subset(self, indices, name=None):
+        original = dict(self._pairs)
+        return PatternChain(
+            name or self.name,
+            [original[i] for i in indices],
+            indices=list(indices),
+            field=self.field,
+        )
+
+    def without(self, other, name=None):
+        return self.subset([i for i in self.indices if i not in other.indices], name)
+
+    def search(self, text, convert=None):
+        """Return the first match (or ``convert(match)``) in chain order.
+
+        A ``ValueError`` from ``convert`` moves on to the next pattern.
+        """
+        return self.search_indexed(text, convert)[1]
+
+    def search_indexed(self, text, convert=None):
+        """Like ``search`` but returns ``(index, result)``.
+
+        ``index`` is the winning pattern's position in the full list, or
+        ``None`` when nothing matched.
+        """
+        stats = _pattern_stats
+        if stats is None:
+            for index, pattern in self._pairs:
+                result = _apply(pattern, text, convert)
+                if result is not None:
+                    return index, result
+            return None, None
+        clock = time.perf_counter_ns
+        for index, pattern in self._pairs:
+            start = clock()
+            result = _apply(pattern, text, convert)
+            stats.attempt(self.field, index, pattern, result is not None, clock() - start)
+            if result is not None:
+                return index, result
+        return None, None
+
+    def ordered(self):
+        """``(index, pattern)`` pairs in chain order."""
+        return self._pairs
+
+    def __len__(self):
+        return len(self.patterns)
+
+
+def _apply(pattern, text, convert):
+    match = pattern.search(text)
+    if match is None or convert is None:
+        return match
+    try:
+        return convert(match)
+    except ValueError:
+        return None
+
+
+def _to_float(match):
+    return float(match.group(1).replace(",", ""))
+
+
+# 1️⃣ M-Pesa Reference Patterns (Most Common)
+MPESA_REFERENCE_PATTERNS = PatternChain("reference:M-PESA", [
+    r'\b([A-Z]{2,3}\d{1,2}[A-Z]\d[A-Z0-9]{6,8})\b',  # Standard M-Pesa format like CCC3H3KXJZV
+    r'\b(C[A-Z0-9]{8,12})\b',  # C followed by alphanumeric
+    r'(?:Reference|Ref|TxnID|Transaction ID)[\s:]*([A-Z0-9]{8,15})'
+], re.IGNORECASE)
+
+# 2️⃣ TigoPesa/Mixx by Yas Reference Patterns
+TIGO_REFERENCE_PATTERNS = PatternChain("reference:YAS", [
+    r'(?:Kumbukumbu\s+No[:\.]?\s*)(\d{10,15})',
+    r'(?:Kumbukumbu\s+namba[:\s]*)(\d{10,15})',
+    r'(?:Kumbukumbu\s+no[:\.]?\s*)(\d{10,15})',
+    r'(?:Kumbukumbu\s+ya\s+malipo.[:\.]?\s*)(\d{10,15})',
+    r'(?: Muamala\s[:\.]?\s*)(\d{10,15})',
+    r'(?:TxnID\s*[:\-]?\s*)(\d{6,15})'
+], re.IGNORECASE)
+
+# 3️⃣ AirtelMoney Reference Patterns
+AIRTEL_REFERENCE_PATTERNS = PatternChain("reference:AIRTELMONEY", [
+    r'(?:TID|Transaction ID|TXN Id|Muamala No)[:\s]*([A-Z]{2}\d{6}\.\d{4}\.[A-Z0-9]{6,8})',
+    r'(?:TID|Transaction ID)[:\s]*([A-Z0-9]{10,20})',
+    r'Muamala\s+No[:\s]*([A-Z0-9]{10,20})'
+], re.IGNORECASE)
+
+# 4️⃣ HaloPesa Reference Patterns
+HALO_REFERENCE_PATTERNS = PatternChain("reference:HALOPESA", [
+    r'(?:Utambulisho\s+wa\s+muamala|Utambulisho\s+wa\s+Muamala)[:\s]*(\d{10,15})',
+    r'HALODEP(\d+)',  # For deposit references
+], re.IGNORECASE)
+
+# 5️⃣ Generic Reference Patterns (fallback)
+GENERIC_REFERENCE_PATTERNS = PatternChain("reference:GENERIC", [
+    r'(?:Reference|Ref)[:\s]*([A-Z0-9]{6,15})',
+    r'(?:Transaction|Txn)[:\s]*([A-Z0-9]{6,15})'
+], re.IGNORECASE)
+
+# Provider reference chains in the order they are tried when the provider is unknown
+REFERENCE_PATTERNS = {
+    "M-PESA": MPESA_REFERENCE_PATTERNS,
+    "YAS": TIGO_REFERENCE_PATTERNS,
+    "AIRTELMONEY": AIRTEL_REFERENCE_PATTERNS,
+    "HALOPESA": HALO_REFERENCE_PATTERNS,
+}
+
+AMOUNT_PATTERNS = PatternChain("amount", [
+    # Basic patterns
+    r'(?:kiasi|amount)[\s:]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+    r'(?:umepokea|received)[\s]*(?:pesa[\s]*)?tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+    r'(?:umelipa|paid)[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+    r'(?:umetuma|sent)[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+    r'(?:umetoa|withdraw)[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+    r'(?:umeweka|deposit)[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+    r'(?:umeongeza[\s]*salio[\s]*la)[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+
+    # M-Pesa specific
+    r'tsh[\s:\.]*([\d,]+(?:\.\d{2})?)[\s]*(?:kutoka|kwenda|kwa)',
+    r'tsh[\s:\.]*([\d,]+(?:\.\d{2})?)[\s]*(?:imetumwa|imehamishiwa)',
+
+    # Airtel Money specific
+    r'(?:umepokea|umetuma|umetoa|umelipa)[\s]*tsh[\s]*([\d,]+(?:\.\d{2})?)',
+
+    # HaloPesa specific
+    r'(?:umelipia|umepokea|umetoa)[\s]*tsh[\s]*([\d,]+(?:\.\d{2})?)',
+
+    # Yas/TigoPesa specific
+    r'kiasi[\s]*tsh[\s]*([\d,]+(?:\.\d{2})?)',
+    r'(?:kutoka|kwenda)[\s]*kwa.*?[\s]*tsh[\s]*([\d,]+(?:\.\d{2})?)',
+
+    # Fee patterns
+    r'(?:ada|kamisheni|makato)[\s]*(?:ya[\s]*)?tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+    r'(?:mrejaa|fee)[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+
+    # General patterns
+    r'tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+])
+
+BALANCE_PATTERNS = PatternChain("balance", [
+    # M-Pesa patterns
+    r'salio\s+lako\s+(?:jipya\s+)?(?:la\s+)?(?:m-pesa\s+)?ni\s+tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+    r'salio\s+(?:jipya\s+)?ni\s+tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+    r'salio\s+(?:la\s+)?(?:akaunti\s+ya\s+)?(?:mtaji|kazi)\s+ni\s+tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+
+    # Airtel Money patterns
+    r'salio\s+tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+
+    # HaloPesa patterns
+    r'salio\s+lako\s+(?:jipya\s+)?(?:la\s+)?halopesa\s+ni\s+tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+
+    # Yas/TigoPesa patterns
+    r'salio\s+(?:jipya\s+)?ni\s+tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+
+    # Generic patterns
+    r'salio[\s\w]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+])
+
+FEE_PATTERNS = PatternChain("fee", [
+    # Standard fee patterns
+    r'(?:kamisheni|commission)[\s]*(?:pamoja\s+na\s+kodi\s*)?tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+    r'(?:ada|fee)[\s]*(?:ya\s*)?tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+    r'(?:makato|deduction)[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+    r'(?:mrejaa|charges)[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+    r'(?:tozo|tax)[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+
+    # Combined fee patterns
+    r'jumla\s+ya\s+makato\s+tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+    r'ada\s+ya\s+huduma[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+
+    # Service fee patterns
+    r'ada\s+ya\s+huduma.*?imekatwa[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
+])
+
+PHONE_PATTERNS = PatternChain("phone", [
+    r'\b(255\d{9})\b',  # 255xxxxxxxxx
+    r'\b(0[67]\d{8})\b',  # 06xxxxxxxx or 07xxxxxxxx
+    r'\b([67]\d{8})\b',   # 6xxxxxxxx or 7xxxxxxxx
+    r'\b(\d{8,9})\b'      # 8-9 digit numbers
+])
+
+NAME_PATTERNS = PatternChain("name", [
+    # Pattern: "kutoka 255xxx - NAME" or "kutoka NAME"
+    r'(?:kutoka|from)[\s]*(?:\d+[\s]*-[\s]*)?([A-Z][A-Z\s]+?)(?:\.|,|\s+\d|\s+wakati|\s+salio)',
+
+    # Pattern: "kwenda NAME" or "kwa NAME"
+    r'(?:kwenda|kwa)[\s]*(?:\d+[\s]*-[\s]*)?([A-Z][A-Z\s]+?)(?:\.|,|\s+\d|\s+salio|\s+wakati)',
+
+    r'kwa\s+mpokeaji\s+wa\s+\w+\s+([A-Z][A-Z\s]{2,})(?=\s*[-\.])'
+
+    # Pattern: "NAME, wakati" or "NAME wakati"
+    r'([A-Z][A-Z\s]+?)[\s]*,?[\s]*wakati',
+
+    # Pattern for Airtel: "Wakala: NAME"
+    r'[Ww]akala:[\s]*([A-Z][A-Z\s]+?)(?:\.|,|\s+\d|\s+salio)',
+
+    # Generic capitalized name pattern
+    r'([A-Z]{2,}(?:\s+[A-Z]{2,})*(?:\s+[A-Z]{2,})*)',
+], re.IGNORECASE)
+
+
+# ✅ Provider Registry
+# Each provider only runs the keyword amount patterns plus the amount/balance
+# patterns written for it. Everything else (other providers, fee lookalikes,
+# the catch-all "tsh N") is kept in original order and tried only on a miss.
+_SHARED_AMOUNT = [0, 1, 2, 3, 4, 5, 6]
+
+PROVIDER_PATTERNS = {
+    "M-PESA": {
+        "reference": MPESA_REFERENCE_PATTERNS,
+        "amount": AMOUNT_PATTERNS.subset(_SHARED_AMOUNT + [7, 8], "amount:M-PESA"),
+        "balance": BALANCE_PATTERNS.subset([0, 1, 2], "balance:M-PESA"),
+        "fee": FEE_PATTERNS,
+    },
+    "YAS": {
+        "reference": TIGO_REFERENCE_PATTERNS,
+        "amount": AMOUNT_PATTERNS.subset(_SHARED_AMOUNT + [11, 12], "amount:YAS"),
+        "balance": BALANCE_PATTERNS.subset([5], "balance:YAS"),
+        "fee": FEE_PATTERNS,
+    },
+    "AIRTELMONEY": {
+        "reference": AIRTEL_REFERENCE_PATTERNS,
+        "amount": AMOUNT_PATTERNS.subset(_SHARED_AMOUNT + [9], "amount:AIRTELMONEY"),
+        "balance": BALANCE_PATTERNS.subset([3], "balance:AIRTELMONEY"),
+        "fee": FEE_PATTERNS,
+    },
+    "HALOPESA": {
+        "reference": HALO_REFERENCE_PATTERNS,
+        "amount": AMOUNT_PATTERNS.subset(_SHARED_AMOUNT + [10], "amount:HALOPESA"),
+        "balance": BALANCE_PATTERNS.subset([4], "balance:HALOPESA"),
+        "fee": FEE_PATTERNS,
+    },
+}
+
+GENERIC_PATTERNS = {
+    "amount": AMOUNT_PATTERNS,
+    "balance": BALANCE_PATTERNS,
+    "fee": FEE_PATTERNS,
+}
+
+# Patterns left over for each provider once its own chain has missed
+_FALLBACK_PATTERNS = {
+    key: {
+        field: GENERIC_PATTERNS[field].without(chain, f"{field}:{key}:fallback")
+        for field, chain in patterns.items() if field in GENERIC_PATTERNS
+    }
+    for key, patterns in PROVIDER_PATTERNS.items()
+}
+
+def detect_provider_key(sender, sms_lower):
+    """Cheap provider guess from the sender and a few keywords.
+
+    Returns a ``PROVIDER_PATTERNS`` key, or ``None`` when the provider is
+    unknown and the generic pattern chains must be used.
+    """
+    sender = (sender or "").strip().upper()
+
+    if sender in ["MPESA", "M-PESA"] or "m-pesa" in sms_lower:
+        return "M-PESA"
+    elif sender in ["TIGOPESA", "TIGO", "YAS"] or "mixx by yas" in sms_lower:
+        return "YAS"
+    elif sender in ["AIRTELMONEY", "AIRTEL"] or "airtelmoney" in sms_lower:
+        return "AIRTELMONEY"
+    elif sender in ["HALOPESA", "HALO"] or "halopesa" in sms_lower:
+        return "HALOPESA"
+    return None
+
+
+# ✅ Template Fingerprint Cache
+# Provider SMS come from a few dozen fixed templates. Masking the parts that
+# change (references, numbers, capitalized names) gives a fingerprint of the
+# template, and the cache maps it to the type the classifier gave that
+# template. Only messages the keyword rules cannot settle are fingerprinted:
+# a repeat template then reuses the type instead of running the classifier.
+# Pattern chains are never cached; a remembered winner cannot skip the
+# patterns ahead of it without changing results, so it saved no work.
+def _mask_name(match):
+    # Keep names that read as a type keyword (e.g. "ZAWADI") so rules still agree
+    name = match.group()
+    return name if TYPE_KEYWORDS.find(name.lower()) else "N"
+
+
+def _mask_reference(match):
+    # Letters and digits mixed; plain words and numbers are left to the other masks
+    token = match.group()
+    return token if token.isdigit() or token.isalpha() else "R"
+
+
+def _mask_phone(match):
+    # Phone-shaped digit runs keep their shape (255..., 0[67]..., [67]...)
+    digits = match.group()
+    if len(digits) == 12 and digits.startswith("255"):
+        return "P1"
+    if len(digits) == 10 and digits[0] == "0" and digits[1] in "67":
+        return "P2"
+    if len(digits) == 9 and digits[0] in "67":
+        return "P3"
+    return digits
+
+
+_DIGITS_TO_ZERO = str.maketrans("0123456789", "0000000000")
+
+# Plain candidates filtered in Python: cheaper than lookarounds at every position
+_TEMPLATE_MASKS = [
+    (re.compile(r'\b[A-Z0-9]{6,}\b'), _mask_reference),             # reference tokens
+    (re.compile(r'\d{9,}'), _mask_phone),                            # phone numbers
+    (re.compile(r'\b[A-Z]{2,}(?:\s+[A-Z]{2,})*\b'), _mask_name),     # capitalized name runs
+]
+
+# Winner recorded (for the instrumentation) when an extractor's whole chain missed
+_NO_MATCH = -1
+
+
+def template_fingerprint(sms_text):
+    for pattern, mask in _TEMPLATE_MASKS:
+        sms_text = pattern.sub(mask, sms_text)
+    # Remaining digits (amounts, dates, short numbers) keep only their length
+    return sms_text.translate(_DIGITS_TO_ZERO)
+
+
+class TemplateCache:
+    """Bounded LRU map from ``(provider key, fingerprint)`` to the classifier's type."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+template_cache = TemplateCache(int(os.environ.get("SMS_TEMPLATE_CACHE_SIZE", "1024")))
+
+
+def template_cache_stats():
+    """Hit/miss counters of the template cache, e.g. to confirm steady-state traffic hits it."""
+    return template_cache.stats()
+
+
+def _template_type(ctx):
+    if template_cache.maxsize <= 0:
+        return None
+    return template_cache.get(ctx.template_key)
+
+
+def _remember_template(ctx, transaction_type):
+    if template_cache.maxsize > 0:
+        template_cache.put(ctx.template_key, transaction_type)
+
+
+# ✅ Per-Message Parse Context
+class ParseContext:
+    """Views of one SMS shared by every extractor during a single parse.
+
+    Each view (stripped, lowercased, punctuation-free) is built on first use
+    and then reused, as are the provider key and the reference match.
+    Extractors accept either a plain string or a ``ParseContext``.
+    """
+
+    def __init__(self, sms_text, sender=None):
+        self.text = sms_text
+        self.sender = sender
+        # Pattern index that won per extractor, for the instrumentation
+        self.winners = {}
+
+    @cached_property
+    def stripped(self):
+        return self.text.strip()
+
+    @cached_property
+    def lower(self):
+        return self.text.lower()
+
+    @cached_property
+    def punctuation_free(self):
+        return self.text.replace(",", " ").replace(".", " ").replace("-", " ")
+
+    @cached_property
+    def sender_upper(self):
+        return (self.sender or "").strip().upper()
+
+    @cached_property
+    def provider_key(self):
+        return detect_provider_key(self.sender_upper, self.lower)
+
+    @cached_property
+    def type_keywords(self):
+        """Transaction-type keywords present in the message (one regex pass)."""
+        stats = _pattern_stats
+        if stats is None:
+            return TYPE_KEYWORDS.find(self.lower)
+        token = stats.start()
+        start = time.perf_counter_ns()
+        hits = TYPE_KEYWORDS.find(self.lower)
+        stats.attempt("type", 0, TYPE_KEYWORDS.pattern, bool(hits), time.perf_counter_ns() - start)
+        stats.finish(token, "type", self.provider_key or "UNKNOWN", 0 if hits else None)
+        return hits
+
+    @cached_property
+    def template_key(self):
+        return self.provider_key, template_fingerprint(self.text)
+
+    @cached_property
+    def reference(self):
+        """``(reference_id, provider)`` where provider is ``None`` unless a provider pattern matched."""
+        return _find_reference(self)
+
+
+def _context(sms_text, sender=None):
+    if isinstance(sms_text, ParseContext):
+        return sms_text
+    return ParseContext(sms_text, sender)
+
+
+def _search_for_provider(field, ctx, text, convert=None):
+    return _instrumented(field, ctx, _search_patterns, field, ctx, text, convert)
+
+
+def _search_patterns(field, ctx, text, convert):
+    provider_key = ctx.provider_key
+    if provider_key is None:
+        index, result = GENERIC_PATTERNS[field].search_indexed(text, convert)
+    else:
+        index, result = PROVIDER_PATTERNS[provider_key][field].search_indexed(text, convert)
+        if index is None:
+            index, result = _FALLBACK_PATTERNS[provider_key][field].search_indexed(text, convert)
+
+    ctx.winners[field] = _NO_MATCH if index is None else index
+    return result
+
+
+def _reference_from_match(provider_key, match, ctx):
+    if provider_key == "M-PESA":
+        return match.group(1).upper(), "M-PESA"
+    if provider_key == "YAS":
+        return match.group(1), "TIGOPESA" if "tigo" in ctx.lower else "YAS"
+    if provider_key == "HALOPESA":
+        if match.re is HALO_REFERENCE_PATTERNS.patterns[1]:
+            return f"HALODEP{match.group(1)}", "HALOPESA"
+        return match.group(1), "HALOPESA"
+    if provider_key == "GENERIC":
+        return match.group(1), None
+    return match.group(1), provider_key
+
+
+def _find_reference(ctx):
+    return _instrumented("reference", ctx, _match_reference, ctx)
+
+
+def _match_reference(ctx):
+    sms_text = ctx.stripped
+    provider_key = ctx.provider_key
+
+    # Known provider: its own patterns first, then every other provider in
+    # turn, then the generic patterns
+    chains = list(REFERENCE_PATTERNS.items())
+    if provider_key is not None:
+        chains.sort(key=lambda item: item[0] != provider_key)
+    chains.append(("GENERIC", GENERIC_REFERENCE_PATTERNS))
+
+    for key, patterns in chains:
+        index, match = patterns.search_indexed(sms_text)
         if match:
-            reference_id = match.group(1)
-            return reference_id, provider
+            ctx.winners["reference"] = (key, index)
+            return _reference_from_match(key, match, ctx)
+
+    ctx.winners["reference"] = _NO_MATCH
+    return None, None
 
-    return reference_id, provider
+
+# ✅ Enhanced Reference and Provider Extraction
+def extract_reference_and_provider(sms_text, sender=None):
+    ctx = _context(sms_text, sender)
+    reference_id, provider = ctx.reference
+    return reference_id, provider or ctx.sender or "UNKNOWN"
 
 # ✅ Enhanced Amount Extraction
 def extract_amount(sms_text):
-    sms_text = sms_text.lower()
-    
-    # Enhanced amount patterns covering all scenarios in dataset
-    amount_patterns = [
-        # Basic patterns
-        r'(?:kiasi|amount)[\s:]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        r'(?:umepokea|received)[\s]*(?:pesa[\s]*)?tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        r'(?:umelipa|paid)[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        r'(?:umetuma|sent)[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        r'(?:umetoa|withdraw)[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        r'(?:umeweka|deposit)[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        r'(?:umeongeza[\s]*salio[\s]*la)[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        
-        # M-Pesa specific
-        r'tsh[\s:\.]*([\d,]+(?:\.\d{2})?)[\s]*(?:kutoka|kwenda|kwa)',
-        r'tsh[\s:\.]*([\d,]+(?:\.\d{2})?)[\s]*(?:imetumwa|imehamishiwa)',
-        
-        # Airtel Money specific  
-        r'(?:umepokea|umetuma|umetoa|umelipa)[\s]*tsh[\s]*([\d,]+(?:\.\d{2})?)',
-        
-        # HaloPesa specific
-        r'(?:umelipia|umepokea|umetoa)[\s]*tsh[\s]*([\d,]+(?:\.\d{2})?)',
-        
-        # Yas/TigoPesa specific
-        r'kiasi[\s]*tsh[\s]*([\d,]+(?:\.\d{2})?)',
-        r'(?:kutoka|kwenda)[\s]*kwa.*?[\s]*tsh[\s]*([\d,]+(?:\.\d{2})?)',
-        
-        # Fee patterns
-        r'(?:ada|kamisheni|makato)[\s]*(?:ya[\s]*)?tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        r'(?:mrejaa|fee)[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        
-        # General patterns
-        r'tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-    ]
-
-    for pattern in amount_patterns:
-        match = re.search(pattern, sms_text)
-        if match:
-            amount_str = match.group(1).replace(",", "")
-            try:
-                return float(amount_str)
-            except ValueError:
-                continue
-    return None
+    ctx = _context(sms_text)
+    return _search_for_provider("amount", ctx, ctx.lower, _to_float)
 
 # ✅ Enhanced Customer Info Extraction
-def extract_customer_info(sms_text):
-    text = sms_text.replace(",", " ").replace(".", " ").replace("-", " ")
-    
-    # Enhanced phone patterns for Tanzania
-    phone_patterns = [
-        r'\b(255\d{9})\b',  # 255xxxxxxxxx
-        r'\b(0[67]\d{8})\b',  # 06xxxxxxxx or 07xxxxxxxx
-        r'\b([67]\d{8})\b',   # 6xxxxxxxx or 7xxxxxxxx
-        r'\b(\d{8,9})\b'      # 8-9 digit numbers
-    ]
-    
+def _find_phone(ctx):
+    # Extract phone number (Tanzania formats)
     customer_phone = None
-    customer_name = "UNKNOWN"
-    
-    # Extract phone number
-    for pattern in phone_patterns:
-        match = re.search(pattern, text)
-        if match:
-            customer_phone = match.group(1)
-            break
-    
+    index, match = PHONE_PATTERNS.search_indexed(ctx.punctuation_free)
+    if match:
+        customer_phone = match.group(1)
+    ctx.winners["phone"] = _NO_MATCH if customer_phone is None else index
+    return customer_phone
+
+
+def _find_name(ctx):
     # Enhanced name extraction patterns
-    name_patterns = [
-        # Pattern: "kutoka 255xxx - NAME" or "kutoka NAME"
-        r'(?:kutoka|from)[\s]*(?:\d+[\s]*-[\s]*)?([A-Z][A-Z\s]+?)(?:\.|,|\s+\d|\s+wakati|\s+salio)',
-        
-        # Pattern: "kwenda NAME" or "kwa NAME"
-        r'(?:kwenda|kwa)[\s]*(?:\d+[\s]*-[\s]*)?([A-Z][A-Z\s]+?)(?:\.|,|\s+\d|\s+salio|\s+wakati)',
-
-        r'kwa\s+mpokeaji\s+wa\s+\w+\s+([A-Z][A-Z\s]{2,})(?=\s*[-\.])'
-        
-        # Pattern: "NAME, wakati" or "NAME wakati"
-        r'([A-Z][A-Z\s]+?)[\s]*,?[\s]*wakati',
-        
-        # Pattern for Airtel: "Wakala: NAME"
-        r'[Ww]akala:[\s]*([A-Z][A-Z\s]+?)(?:\.|,|\s+\d|\s+salio)',
-        
-        # Generic capitalized name pattern
-        r'([A-Z]{2,}(?:\s+[A-Z]{2,})*(?:\s+[A-Z]{2,})*)',
-    ]
-    
-    for pattern in name_patterns:
-        matches = re.findall(pattern, sms_text, re.IGNORECASE)
+    stats = _pattern_stats
+    ctx.winners["name"] = _NO_MATCH
+    for index, pattern in NAME_PATTERNS.ordered():
+        start = time.perf_counter_ns() if stats is not None else 0
+        matches = pattern.findall(ctx.text)
+        clean_name = ""
         if matches:
             # Find the longest meaningful name
             best_name = max(matches, key=len) if matches else ""
             # Clean up the name
-            clean_name = ' '.join(word for word in best_name.split() 
-                                if word.isalpha() and len(word) > 1 
+            clean_name = ' '.join(word for word in best_name.split()
+                                if word.isalpha() and len(word) > 1
                                 and word.upper() not in ['TSH', 'KWA', 'KUTOKA', 'SALIO', 'WAKATI'])
-            if len(clean_name) > 3:
-                customer_name = clean_name.strip().upper()
-                break
+        if stats is not None:
+            stats.attempt("name", index, pattern, len(clean_name) > 3, time.perf_counter_ns() - start)
+        if len(clean_name) > 3:
+            ctx.winners["name"] = index
+            return clean_name.strip().upper()
+    return "UNKNOWN"
 
+
+def extract_customer_info(sms_text):
+    ctx = _context(sms_text)
+    customer_phone = _instrumented("phone", ctx, _find_phone, ctx)
+    customer_name = _instrumented("name", ctx, _find_name, ctx)
     return customer_name, customer_phone
 
 # ✅ Enhanced Balance Extraction
 def extract_balance(sms_text):
-    sms_text = sms_text.lower()
-    
-    balance_patterns = [
-        # M-Pesa patterns
-        r'salio\s+lako\s+(?:jipya\s+)?(?:la\s+)?(?:m-pesa\s+)?ni\s+tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        r'salio\s+(?:jipya\s+)?ni\s+tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        r'salio\s+(?:la\s+)?(?:akaunti\s+ya\s+)?(?:mtaji|kazi)\s+ni\s+tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        
-        # Airtel Money patterns
-        r'salio\s+tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        
-        # HaloPesa patterns
-        r'salio\s+lako\s+(?:jipya\s+)?(?:la\s+)?halopesa\s+ni\s+tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        
-        # Yas/TigoPesa patterns
-        r'salio\s+(?:jipya\s+)?ni\s+tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        
-        # Generic patterns
-        r'salio[\s\w]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-    ]
-
-    for pattern in balance_patterns:
-        match = re.search(pattern, sms_text)
-        if match:
-            try:
-                return float(match.group(1).replace(",", ""))
-            except ValueError:
-                continue
-    return None
+    ctx = _context(sms_text)
+    return _search_for_provider("balance", ctx, ctx.lower, _to_float)
 
 # ✅ Enhanced Transaction Fee Extraction
 def extract_transaction_fee(sms_text):
-    sms_text = sms_text.lower()
-    
-    fee_patterns = [
-        # Standard fee patterns
-        r'(?:kamisheni|commission)[\s]*(?:pamoja\s+na\s+kodi\s*)?tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        r'(?:ada|fee)[\s]*(?:ya\s*)?tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        r'(?:makato|deduction)[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        r'(?:mrejaa|charges)[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        r'(?:tozo|tax)[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        
-        # Combined fee patterns
-        r'jumla\s+ya\s+makato\s+tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        r'ada\s+ya\s+huduma[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-        
-        # Service fee patterns
-        r'ada\s+ya\s+huduma.*?imekatwa[\s]*tsh[\s:\.]*([\d,]+(?:\.\d{2})?)',
-    ]
-
-    for pattern in fee_patterns:
-        match = re.search(pattern, sms_text)
-        if match:
-            try:
-                return float(match.group(1).replace(",", ""))
-            except ValueError:
-                continue
-    return None
+    ctx = _context(sms_text)
+    return _search_for_provider("fee", ctx, ctx.lower, _to_float)
 
 # ✅ Enhanced Provider Detection
 def detect_provider(sender, sms_text):
-    if sender is None:
-        sender = ""
-
-    sender = sender.strip().upper()
-    sms_lower = sms_text.lower()
+    ctx = _context(sms_text, sender)
+    sender = ctx.sender_upper
+    sms_lower = ctx.lower
 
-    # Check Django model first
-    if Provider and Provider.objects.filter(name__iexact=sender).exists():
+    # Check the Provider table first
+    if sender and _is_registered_provider(sender):
         return sender
 
     # Provider detection based on SMS content and sender
@@ -287,170 +809,380 @@ def detect_provider(sender, sms_text):
     elif sender in ["HALOPESA", "HALO"] or "halopesa" in sms_lower:
         return "HALOPESA"
 
-    # Try to detect from reference patterns
-    reference_id, provider_from_text = extract_reference_and_provider(sms_text, sender)
-    if provider_from_text != "UNKNOWN":
-        return provider_from_text
-
-    return "UNKNOWN"
+    # Try to detect from reference patterns (reuses the reference match)
+    reference_id, provider_from_text = ctx.reference
+    return provider_from_text or sender or "UNKNOWN"
 
 # ✅ Enhanced Transaction Type Detection
-def detect_transaction_type(sms_text):
-    sms_lower = sms_text.lower()
-    
+# Rules in precedence order: the first type with a keyword hit wins
+TYPE_RULES = [
     # Insufficient funds patterns
-    if any(phrase in sms_lower for phrase in [
-        "hakitoshi", "insufficient", "haukukamilika", "declined", 
+    ("insufficient_funds", frozenset([
+        "hakitoshi", "insufficient", "haukukamilika", "declined",
         "salio halitoshi", "huduma haikufanikiwa"
-    ]):
-        return "insufficient_funds"
-    
-    # Fee notice patterns
-    if any(phrase in sms_lower for phrase in [
+    ])),
+    # Fee notice patterns (unless money actually moved, see FEE_NOTICE_EXCLUSIONS)
+    ("fee_notice", frozenset([
         "ada ya huduma", "kamisheni pamoja na kodi", "lengo lako",
         "zawadi", "punguzo la tozo", "imekatwa"
-    ]) and not any(phrase in sms_lower for phrase in ["umepokea", "umelipa", "umetuma"]):
-        return "fee_notice"
-    
-    # Received patterns
-    if any(phrase in sms_lower for phrase in [
+    ])),
+    # Received patterns ("received" with umepokea, otherwise "deposit")
+    ("received", frozenset([
         "umepokea", "received", "salio lako jipya ni tsh", "umeongeza salio"
-    ]):
-        return "received" if "umepokea" in sms_lower else "deposit"
-    
+    ])),
     # Payment patterns
-    if any(phrase in sms_lower for phrase in [
+    ("payment", frozenset([
         "umelipa", "umelipia", "malipo yamekamilika"
-    ]):
-        return "payment"
-    
-    # Transfer patterns  
-    if any(phrase in sms_lower for phrase in [
+    ])),
+    # Transfer patterns
+    ("transfer", frozenset([
         "imehamishiwa", "umetuma", "zoezi la kuhamisha", "imeamishiwa"
-    ]):
-        return "transfer"
-    
+    ])),
     # Withdrawal patterns
-    if any(phrase in sms_lower for phrase in [
+    ("withdrawal", frozenset([
         "umetoa", "toa tsh", "withdrawal", "kuchukua"
-    ]):
-        return "withdrawal"
-    
+    ])),
     # Deposit patterns
-    if any(phrase in sms_lower for phrase in [
+    ("deposit", frozenset([
         "umeweka", "umeongeza salio", "deposit", "kuweka"
-    ]):
-        return "deposit"
-    
-    return "unknown"
+    ])),
+]
+
+FEE_NOTICE_EXCLUSIONS = frozenset(["umepokea", "umelipa", "umetuma"])
+
+
+def _trie_pattern(words):
+    """One regex alternation shaped as a prefix trie, e.g. ``um(?:e(?:lipa|toa))``.
+
+    Sharing prefixes keeps the backtracking engine from retrying every
+    keyword at every position.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """Finds every keyword of a fixed set in a text with one regex pass.
+
+    A regex scan does not report a keyword that starts inside another
+    keyword's match (``umetoa tsh`` hides ``toa tsh``), so only those
+    possibly-hidden keywords get an extra substring check afterwards.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = frozenset(keywords)
+        self.pattern = re.compile(_trie_pattern(self.keywords))
+        self._hidden_by = {
+            keyword: tuple(other for other in self.keywords if other != keyword and _can_hide(keyword, other))
+            for keyword in self.keywords
+        }
+
+    def find(self, text):
+        hits = set(self.pattern.findall(text))
+        for keyword in tuple(hits):
+            for other in self._hidden_by[keyword]:
+                if other not in hits and other in text:
+                    hits.add(other)
+        return hits
+
+
+def _can_hide(keyword, other):
+    # ``other`` sits inside ``keyword`` or starts on one of its suffixes
+    return other in keyword or any(keyword.endswith(other[:k]) for k in range(1, len(other)))
+
+
+TYPE_KEYWORDS = KeywordMatcher(
+    set().union(*(keywords for _, keywords in TYPE_RULES)) | FEE_NOTICE_EXCLUSIONS
+)
+
+
+def _apply_type_rules(hits):
+    """``(type, keywords of the deciding rule)``; the keywords are empty for "unknown"."""
+    for transaction_type, keywords in TYPE_RULES:
+        if hits.isdisjoint(keywords):
+            continue
+        if transaction_type == "fee_notice" and not hits.isdisjoint(FEE_NOTICE_EXCLUSIONS):
+            continue
+        if transaction_type == "received":
+            return ("received" if "umepokea" in hits else "deposit"), keywords
+        return transaction_type, keywords
+
+    return "unknown", frozenset()
+
+
+def detect_transaction_type(sms_text):
+    hits = _context(sms_text).type_keywords
+    if not hits:
+        return "unknown"
+    return _apply_type_rules(hits)[0]
+
+
+# ✅ Rules-first Type Cascade
+# Rules decide alone at or above this confidence; below it the classifier runs
+TYPE_CONFIDENCE_THRESHOLD = float(os.environ.get("SMS_TYPE_CONFIDENCE", "0.75"))
+
+# Tiers that still need the classifier, and what each one means in the counters:
+#   rules            confident rules
+#   template         ambiguous rules, type the classifier gave the same template
+#   model_ambiguous  ambiguous rules and no template: classifier
+#   rules_fallback   classifier needed but missing or failing: rules
+_MODEL_TIERS = frozenset(["model_ambiguous"])
+
+# Best-effort counters, like sms_parser.dates
+_type_tiers = Counter()
+
+
+def rule_confidence(sms_text):
+    """``(type, confidence)`` from the keyword rules alone.
+
+    1.0 when every keyword hit belongs to the deciding rule (``umepokea``
+    on its own), 0.5 when hits of several rules had to be settled by
+    precedence, 0.0 when no keyword matched.
+    """
+    hits = _context(sms_text).type_keywords
+    if not hits:
+        return "unknown", 0.0
+    transaction_type, keywords = _apply_type_rules(hits)
+    return transaction_type, 1.0 if hits <= keywords else 0.5
+
+
+def _triage_type(ctx):
+    """``(type, tier)``; for the model tier the type is the rules' fallback answer."""
+    rule_type, confidence = rule_confidence(ctx)
+    if confidence >= TYPE_CONFIDENCE_THRESHOLD:
+        return rule_type, "rules"
+    # Only ambiguous messages pay for a template fingerprint
+    template_type = _template_type(ctx)
+    if template_type is not None:
+        return template_type, "template"
+    return rule_type, "model_ambiguous"
+
+
+def type_cascade_stats():
+    """How often each tier decided the type since start-up (or the last reset)."""
+    total = sum(_type_tiers.values())
+    tiers = ("rules", "template", "model_ambiguous", "rules_fallback")
+    return {
+        "counts": {tier: _type_tiers[tier] for tier in tiers},
+        "model_share": _type_tiers["model_ambiguous"] / total if total else 0.0,
+    }
+
+
+def reset_type_cascade_stats():
+    _type_tiers.clear()
 
 
 # ✅ Enhanced Date Parsing
 def parse_transaction_date(sms_text):
-    # Multiple date format patterns
-    date_patterns = [
-        r'(\d{1,2}/\d{1,2}/\d{2,4}\s+\d{1,2}:\d{2}(?::\d{2})?)',  # dd/mm/yyyy hh:mm or dd/mm/yy hh:mm
-        r'(\d{4}/\d{1,2}/\d{1,2}\s+\d{1,2}:\d{2}:\d{2})',          # yyyy/mm/dd hh:mm:ss
-        r'tarehe\s+(\d{1,2}/\d{1,2}/\d{2,4})\s+(?:saa\s+)?(\d{1,2}:\d{2})',  # tarehe dd/mm/yyyy saa hh:mm
-        r'mnamo\s+(\d{1,2}/\d{1,2}/\d{2,4})[,\s]+(\d{1,2}:\d{2})',  # mnamo dd/mm/yyyy, hh:mm
-        r'(\d{1,2}/\d{1,2}/\d{2,4})\s+(\d{1,2}:\d{2})',             # dd/mm/yyyy hh:mm separate
-    ]
-    
-    for pattern in date_patterns:
-        match = re.search(pattern, sms_text)
-        if match:
-            try:
-                if len(match.groups()) == 1:
-                    # Single group with full datetime
-                    date_str = match.group(1)
-                    # Determine format based on content
-                    if date_str.count('/') == 2:
-                        parts = date_str.split()
-                        date_part = parts[0]
-                        time_part = parts[1] if len(parts) > 1 else "00:00"
-                        
-                        date_components = date_part.split('/')
-                        if len(date_components[2]) == 2:
-                            # 2-digit year
-                            year = int(date_components[2])
-                            year = 2000 + year if year < 50 else 1900 + year
-                            formatted_date = f"{date_components[0]}/{date_components[1]}/{year} {time_part}"
-                            return datetime.strptime(formatted_date, "%d/%m/%Y %H:%M")
-                        else:
-                            # 4-digit year  
-                            if date_components[0].isdigit() and int(date_components[0]) > 12:
-                                # yyyy/mm/dd format
-                                return datetime.strptime(date_str, "%Y/%m/%d %H:%M:%S")
-                            else:
-                                # dd/mm/yyyy format
-                                return datetime.strptime(date_str, "%d/%m/%Y %H:%M")
-                else:
-                    # Separate date and time groups
-                    date_part = match.group(1)
-                    time_part = match.group(2)
-                    
-                    date_components = date_part.split('/')
-                    if len(date_components[2]) == 2:
-                        year = int(date_components[2])
-                        year = 2000 + year if year < 50 else 1900 + year
-                        formatted_date = f"{date_components[0]}/{date_components[1]}/{year} {time_part}"
-                        return datetime.strptime(formatted_date, "%d/%m/%Y %H:%M")
-                    else:
-                        return datetime.strptime(f"{date_part} {time_part}", "%d/%m/%Y %H:%M")
-                        
-            except Exception as e:
-                print(f"Date parse error for '{match.group()}': {e}")
-                continue
-    
-    return None
+    # The date engine memoizes repeated timestamps by itself
+    ctx = _context(sms_text)
+    stats = _pattern_stats
+    if stats is None:
+        return parse_date(ctx.text)
+    token = stats.start()
+    start = time.perf_counter_ns()
+    parsed = parse_date(ctx.text)
+    stats.attempt("date", 0, DATE_PATTERN, parsed is not None, time.perf_counter_ns() - start)
+    stats.finish(token, "date", ctx.provider_key or "UNKNOWN", 0 if parsed is not None else None)
+    return parsed
 
 # ✅ Enhanced SMS Parser Entry Point
-def parse_sms(sms_text, sender=None):
+def _build_result(ctx, transaction_type):
     result = {
         "reference_id": None,
         "network_provider": None,
-        "type": "unknown",
+        "type": transaction_type,
         "amount": None,
         "customer_phone": None,
         "customer_name": None,
         "balance": None,
         "transaction_fee": None,
         "date_transaction": None,
-        "raw_sms": sms_text,
-        "sender": sender
+        "raw_sms": ctx.text,
+        "sender": ctx.sender,
+        "model_version": None,
     }
 
-    # Enhanced transaction type detection
-    if model:
-        try:
-            predicted_type = model.predict([sms_text])[0]
-            result["type"] = predicted_type
-        except:
-            result["type"] = detect_transaction_type(sms_text)
-    else:
-        result["type"] = detect_transaction_type(sms_text)
-
     # Extract all fields using enhanced functions
-    reference_id, _ = extract_reference_and_provider(sms_text, sender)
+    reference_id, _ = ctx.reference
     result["reference_id"] = reference_id
     
-    result["network_provider"] = detect_provider(sender, sms_text)
-    result["amount"] = extract_amount(sms_text)
-    result["balance"] = extract_balance(sms_text)
-    result["transaction_fee"] = extract_transaction_fee(sms_text)
+    result["network_provider"] = detect_provider(ctx.sender, ctx)
+    result["amount"] = extract_amount(ctx)
+    result["balance"] = extract_balance(ctx)
+    result["transaction_fee"] = extract_transaction_fee(ctx)
     
-    customer_name, customer_phone = extract_customer_info(sms_text)
+    customer_name, customer_phone = extract_customer_info(ctx)
     result["customer_phone"] = customer_phone
     result["customer_name"] = customer_name
     
-    result["date_transaction"] = parse_transaction_date(sms_text)
+    result["date_transaction"] = parse_transaction_date(ctx)
+
+    return result
 
+
+def parse_sms(sms_text, sender=None):
+    # Every extractor shares one context: views and matches are computed once
+    ctx = ParseContext(sms_text, sender)
+
+    # Rules first; the classifier only settles ambiguous or contradicted ones
+    transaction_type, tier = _triage_type(ctx)
+    model_version = None
+    if tier in _MODEL_TIERS:
+        model, model_version = get_model_and_version()
+        try:
+            if model is None:
+                raise LookupError("no classifier loaded")
+            transaction_type = model.predict([sms_text])[0]
+            _remember_template(ctx, transaction_type)
+        except Exception:
+            tier, model_version = "rules_fallback", None
+    _type_tiers[tier] += 1
+
+    result = _build_result(ctx, transaction_type)
+    result["model_version"] = model_version
     return result
 
+
+# ✅ Batch SMS Parser Entry Point
+def parse_many(messages, senders=None):
+    """Parse a batch of SMS; returns one ``parse_sms``-shaped dict per message.
+
+    The classifier runs once over the whole batch (one sparse TF-IDF matrix)
+    instead of once per message, and only for the messages the type rules
+    leave to it (see ``parse_sms``); the rule extractors still run per message.
+    """
+    messages = list(messages)
+    senders = [None] * len(messages) if senders is None else list(senders)
+    if len(senders) != len(messages):
+        raise ValueError(f"Got {len(messages)} messages but {len(senders)} senders")
+
+    contexts = [ParseContext(sms_text, sender) for sms_text, sender in zip(messages, senders)]
+
+    triaged = [_triage_type(ctx) for ctx in contexts]
+    types = [transaction_type for transaction_type, _ in triaged]
+    tiers = [tier for _, tier in triaged]
+    pending = [i for i, tier in enumerate(tiers) if tier in _MODEL_TIERS]
+
+    model_version = None
+    if pending:
+        model, model_version = get_model_and_version()
+        try:
+            if model is None:
+                raise LookupError("no classifier loaded")
+            for i, predicted_type in zip(pending, model.predict([messages[i] for i in pending])):
+                types[i] = predicted_type
+                _remember_template(contexts[i], predicted_type)
+        except Exception:
+            for i in pending:
+                tiers[i] = "rules_fallback"
+    _type_tiers.update(tiers)
+
+    results = []
+    for ctx, transaction_type, tier in zip(contexts, types, tiers):
+        result = _build_result(ctx, transaction_type)
+        if tier in _MODEL_TIERS:
+            result["model_version"] = model_version
+        results.append(result)
+    return results
+
+
+# ✅ Streaming Command Line
+def _stream_record(line, default_sender=None):
+    """``(sms_text, sender)`` from one input line: a JSON object or the raw SMS."""
+    if line.startswith("{"):
+        record = json.loads(line)
+        sms_text = record.get("sms") or record.get("text") or record.get("raw_sms") or ""
+        return sms_text, record.get("sender") or default_sender
+    return line, default_sender
+
+
+def parse_stream(lines, default_sender=None, batch_size=500):
+    """Yield one result per non-empty input line, parsing ``batch_size`` lines at a time.
+
+    Lines are plain SMS text or JSON objects with ``sms``/``text``/``raw_sms``
+    and ``sender``. Only one batch is held in memory, and the classifier runs
+    once per batch (see ``parse_many``).
+    """
+    batch = []
+    for line_number, line in enumerate(lines, 1):
+        line = line.rstrip("\r\n")
+        if not line.strip():
+            continue
+        try:
+            batch.append(_stream_record(line, default_sender))
+        except ValueError as e:
+            logger.warning("Skipping line %d: not valid JSON (%s)", line_number, e)
+            continue
+        if len(batch) >= batch_size:
+            yield from parse_many([sms_text for sms_text, _ in batch], [sender for _, sender in batch])
+            batch = []
+    if batch:
+        yield from parse_many([sms_text for sms_text, _ in batch], [sender for _, sender in batch])
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        prog="python -m sms_parser.parser",
+        description="Parse one SMS, or stream newline-delimited SMS / JSONL to JSONL on stdout.",
+    )
+    arg_parser.add_argument("sms", nargs="?", default="No SMS provided", help="single SMS to parse")
+    arg_parser.add_argument("sender", nargs="?", default=None, help="sender of the single SMS")
+    arg_parser.add_argument("--stream", nargs="?", const="-", metavar="FILE",
+                            help="read one SMS or JSON object per line from FILE (default: stdin)")
+    arg_parser.add_argument("--default-sender", default=None, help="sender for streamed lines without one")
+    arg_parser.add_argument("--batch-size", type=int, default=500, help="messages per classifier call")
+    arg_parser.add_argument("--progress-every", type=int, default=10000,
+                            help="report progress on stderr every N messages (0 to disable)")
+    args = arg_parser.parse_args(argv)
+
+    if args.stream is None:
+        print(json.dumps(parse_sms(args.sms, args.sender), indent=4, default=str))
+        return
+
+    source = sys.stdin if args.stream == "-" else open(args.stream, encoding="utf-8")
+    out = sys.stdout
+    total = 0
+    start = time.perf_counter()
+    try:
+        for result in parse_stream(source, args.default_sender, args.batch_size):
+            out.write(json.dumps(result, default=str) + "\n")
+            total += 1
+            if total % args.batch_size == 0:
+                out.flush()
+            if args.progress_every and total % args.progress_every == 0:
+                elapsed = time.perf_counter() - start
+                print(f"⏳ {total} messages, {total / elapsed:,.0f} msg/s", file=sys.stderr)
+        out.flush()
+    except BrokenPipeError:
+        # Downstream closed early (e.g. piped into head): stop quietly and
+        # keep the interpreter's final flush from raising again
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+    elapsed = time.perf_counter() - start
+    rate = total / elapsed if elapsed else 0.0
+    print(f"✅ Parsed {total} messages in {elapsed:.1f}s ({rate:,.0f} msg/s)", file=sys.stderr)
+
+
 # CLI Test
+#   python -m sms_parser.parser "<sms text>" [SENDER]
+#   gateway-export | python -m sms_parser.parser --stream > parsed.jsonl
 if __name__ == "__main__":
-    sms = sys.argv[1] if len(sys.argv) > 1 else "No SMS provided"
-    sender = sys.argv[2] if len(sys.argv) > 2 else None
-    parsed = parse_sms(sms, sender)
-    print(json.dumps(parsed, indent=4, default=str))
-
+    main()
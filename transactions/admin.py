@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Transaction, RejectedSMS, Provider
+from .models import Transaction, RejectedSMS, Provider, QueuedSMS, DeviceSyncCursor
 
 @admin.register(Transaction)
 class TransactionAdmin(admin.ModelAdmin):
@@ -7,8 +7,16 @@ class TransactionAdmin(admin.ModelAdmin):
 
 @admin.register(RejectedSMS)
 class RejectedSMSAdmin(admin.ModelAdmin):
-    list_display = ('sender', 'reason', 'received_at', 'user')
+    list_display = ('sender', 'reason', 'occurrences', 'received_at', 'last_seen', 'user')
 
 @admin.register(Provider)
 class ProviderAdmin(admin.ModelAdmin):
     list_display = ('name', 'created_at')
+
+@admin.register(QueuedSMS)
+class QueuedSMSAdmin(admin.ModelAdmin):
+    list_display = ('id', 'status', 'user', 'attempts', 'created_at', 'finished_at')
+
+@admin.register(DeviceSyncCursor)
+class DeviceSyncCursorAdmin(admin.ModelAdmin):
+    list_display = ('user', 'device_id', 'last_sms_date', 'last_sms_id', 'synced_count', 'updated_at')
@@ -1,12 +1,23 @@
+import json
+import zlib
+
+from django.http import StreamingHttpResponse
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status, generics
-from .models import Transaction, RejectedSMS, Provider
+from .models import Transaction, RejectedSMS, Provider, QueuedSMS, DeviceSyncCursor
+from . import sms_queue
 from .serializers import TransactionSerializer, ProviderSerializer
+from .provider_registry import provider_registry
+from .ingestion import (
+    BULK_MAX_ITEMS, content_hash, cursor_position, find_duplicate, import_records, ingest_batch,
+    insert_or_ignore, iter_body_chunks, iter_ndjson, record_rejection, sync_device,
+)
 from sms_parser.parser import parse_sms
 from utils.sms_handler import handle_sms_submission
 from django.db.models import Count, Q
 from datetime import datetime, timedelta
+from collections import Counter
 from .models import Transaction, RejectedSMS
 from sms_parser.parser import parse_sms
 from datetime import datetime
@@ -18,22 +29,29 @@ from rest_framework.decorators import permission_classes
 
 # ✅ Providers API (used by Flutter to get allowed senders)
 class ProviderListAPIView(generics.ListAPIView):
-    queryset = Provider.objects.all()
     serializer_class = ProviderSerializer
 
+    def get_queryset(self):
+        return provider_registry.providers()
+
 
 from .models import Provider
 def handle_sms_submission(sms_text, sender=None, user=None):
+    # ✅ Re-synced messages stop at one indexed lookup, before any parsing
+    digest = content_hash(sms_text)
+    duplicate_of = find_duplicate(user, digest)
+    if duplicate_of:
+        if duplicate_of == "rejected":
+            record_rejection(sender or "UNKNOWN", sms_text, None, user, digest)
+        return {"saved": False, "rejected": False, "duplicate": duplicate_of, "parsed": None,
+                "content_hash": digest}
+
     parsed = parse_sms(sms_text, sender)
 
     # ✅ Provider must still exist
     provider_name = parsed.get("network_provider", "").upper()
-    if not Provider.objects.filter(name__iexact=provider_name).exists():
-        RejectedSMS.objects.create(
-            sender=sender or "UNKNOWN",
-            message=sms_text,
-            reason=f"Unknown provider: {provider_name}"
-        )
+    if not provider_registry.is_known(provider_name):
+        record_rejection(sender or "UNKNOWN", sms_text, f"Unknown provider: {provider_name}", user, digest)
         return {"saved": False, "rejected": True, "parsed": parsed, "error": "Unknown provider"}
 
     # ✅ No rejection for missing reference_id or amount (temporarily)
@@ -45,33 +63,36 @@ def handle_sms_submission(sms_text, sender=None, user=None):
     amount = parsed.get("amount") or 0.0
 
     try:
-        transaction, created = Transaction.objects.get_or_create(
+        # ✅ One INSERT ... ON CONFLICT DO NOTHING: no SELECT first, no race
+        created = insert_or_ignore(Transaction(
             reference_id=reference_id,
-            defaults={
-                "network_provider": provider_name,
-                "type": parsed.get("type") or "unknown",
-                "amount": amount,
-                "customer_phone": parsed.get("customer_phone"),
-                "customer_name": parsed.get("customer_name"),
-                "balance": parsed.get("balance"),
-                "transaction_fee": parsed.get("transaction_fee"),
-                "date_transaction": parsed.get("date_transaction") or datetime.now(),
-                "raw_sms": sms_text,
-                "sender": sender,
-                "user": user,
-                "is_incomplete": is_incomplete  # ✅ Save the flag
-            }
-        )
-
-
-        if not created:
-            return {"saved": False, "rejected": False, "parsed": parsed, "error": "Duplicate reference_id"}
-
-        return {"saved": True, "rejected": False, "parsed": parsed}
-
+            network_provider=provider_name,
+            type=parsed.get("type") or "unknown",
+            amount=amount,
+            customer_phone=parsed.get("customer_phone"),
+            customer_name=parsed.get("customer_name"),
+            balance=parsed.get("balance"),
+            transaction_fee=parsed.get("transaction_fee"),
+            date_transaction=parsed.get("date_transaction") or datetime.now(),
+            raw_sms=sms_text,
+            sender=sender,
+            user=user,
+            is_incomplete=is_incomplete,  # ✅ Save the flag
+            content_hash=digest,
+        ))
     except IntegrityError as e:
         return {"saved": False, "rejected": False, "parsed": parsed, "error": str(e)}
 
+    if not created:
+        # Same message stored meanwhile (concurrent upload), or another SMS with this reference
+        duplicate_of = find_duplicate(user, digest)
+        if duplicate_of:
+            return {"saved": False, "rejected": False, "duplicate": duplicate_of, "parsed": parsed,
+                    "content_hash": digest}
+        return {"saved": False, "rejected": False, "parsed": parsed, "error": "Duplicate reference_id"}
+
+    return {"saved": True, "rejected": False, "parsed": parsed}
+
 
 
 # ✅ Parse API - used by Flutter
@@ -84,16 +105,120 @@ def parse_and_store_sms(request):
     if not sms:
         return Response({"error": "No SMS provided."}, status=status.HTTP_400_BAD_REQUEST)
 
+    # ⏳ Accept-and-enqueue: a drain_sms_queue worker parses it later
+    if request.query_params.get("async", str(sms_queue.ASYNC_INGESTION)).lower() in ("1", "true", "yes"):
+        ticket = sms_queue.enqueue(sms, sender, request.user)
+        return Response({"status": "queued", "ticket": str(ticket.id)}, status=status.HTTP_202_ACCEPTED)
+
     result = handle_sms_submission(sms, sender, request.user)
 
     if result["saved"]:
         return Response({"status": "saved", "data": result["parsed"]}, status=status.HTTP_201_CREATED)
+    elif result.get("duplicate"):
+        # Not an error: the app re-sends its inbox on every sync
+        return Response({"status": "duplicate", "stored_as": result["duplicate"],
+                         "content_hash": result["content_hash"]}, status=status.HTTP_200_OK)
     elif result["rejected"]:
         return Response({"status": "rejected", "data": result["parsed"]}, status=status.HTTP_403_FORBIDDEN)
     else:
         return Response({"status": "error", "message": result["error"]}, status=status.HTTP_400_BAD_REQUEST)
 
 
+# ✅ Bulk Parse API - a whole inbox sync in one request
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def parse_and_store_sms_bulk(request):
+    items = request.data.get("items") if isinstance(request.data, dict) else request.data
+
+    if not isinstance(items, list) or not items:
+        return Response({"error": "Expected a non-empty list of {sms, sender} items."},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if len(items) > BULK_MAX_ITEMS:
+        return Response({"error": f"At most {BULK_MAX_ITEMS} items per request."},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    results = ingest_batch(items, request.user)
+    summary = Counter(result["status"] for result in results)
+    return Response({"summary": dict(summary), "results": results}, status=status.HTTP_200_OK)
+
+
+# ✅ Streamed Import API - gzip NDJSON archives, read and committed batch by batch
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def import_sms_stream(request):
+    encoding = request.META.get("HTTP_CONTENT_ENCODING", "").lower()
+    if encoding not in ("", "identity", "gzip"):
+        return Response({"error": f"Unsupported Content-Encoding: {encoding}"},
+                        status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    try:
+        batch_size = min(max(int(request.query_params.get("batch_size", 500)), 1), BULK_MAX_ITEMS)
+    except ValueError:
+        return Response({"error": "batch_size must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+    # request.data is never touched: the body is read straight off the socket as the summary streams out
+    user = request.user
+
+    def summaries():
+        try:
+            records = iter_ndjson(iter_body_chunks(request.read, encoding == "gzip"))
+            for summary in import_records(records, user, batch_size):
+                yield json.dumps(summary) + "\n"
+        except (ValueError, zlib.error) as e:
+            # Batches already reported stay committed
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return StreamingHttpResponse(summaries(), content_type="application/x-ndjson")
+
+
+# 🔄 Delta Sync API - the app asks for its cursor, then uploads only newer SMS
+def _cursor_data(device_id, cursor):
+    position = cursor_position(cursor) if cursor is not None else None
+    return {
+        "device_id": device_id,
+        "date": position[0] if position else None,
+        "id": position[1] if position else None,
+        "synced_count": cursor.synced_count if cursor is not None else 0,
+    }
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated])
+def device_sync(request, device_id):
+    if request.method == 'GET':
+        cursor = DeviceSyncCursor.objects.filter(user=request.user, device_id=device_id).first()
+        return Response({"cursor": _cursor_data(device_id, cursor)})
+
+    items = request.data.get("items") if isinstance(request.data, dict) else request.data
+    if not isinstance(items, list):
+        return Response({"error": "Expected a list of {sms, sender, id, date} items."},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if len(items) > BULK_MAX_ITEMS:
+        return Response({"error": f"At most {BULK_MAX_ITEMS} items per request."},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    cursor, results = sync_device(request.user, device_id, items)
+    summary = Counter(result["status"] for result in results)
+    return Response({"cursor": _cursor_data(device_id, cursor), "summary": dict(summary), "results": results},
+                    status=status.HTTP_200_OK)
+
+
+# ✅ Queued SMS status - the outcome behind a ticket from the async upload
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def queued_sms_status(request, ticket):
+    queued = QueuedSMS.objects.filter(id=ticket, user=request.user).first()
+    if queued is None:
+        return Response({"error": "Unknown ticket."}, status=status.HTTP_404_NOT_FOUND)
+
+    return Response({
+        "ticket": str(queued.id),
+        "status": queued.status,
+        "result": queued.result,
+        "created_at": queued.created_at,
+        "finished_at": queued.finished_at,
+    })
+
+
 # ✅ Transaction List API for Flutter App
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -251,7 +376,7 @@ def all_transactions_view(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def providers_with_transactions(request):
-    trusted_providers = list(Provider.objects.values_list('name', flat=True))
+    trusted_providers = provider_registry.names()
 
     providers = (
         Transaction.objects
@@ -288,7 +413,7 @@ from transactions.models import Provider, Transaction
 @api_view(['GET'])
 # @permission_classes([IsAuthenticated])  # 🔒 Commented out for now
 def providers_view(request):
-    providers = Provider.objects.all()
+    providers = provider_registry.providers()
     response_data = []
 
     for provider in providers:
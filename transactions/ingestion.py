@@ -0,0 +1,445 @@
+import hashlib
+import json
+import unicodedata
+import zlib
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import Value
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from sms_parser.parser import parse_many
+
+from .models import DeviceSyncCursor, RejectedSMS, Transaction
+from .provider_registry import provider_registry
+from .rejections import rejection_buffer
+
+# Largest batch the bulk endpoint accepts, and values per IN (...) query
+BULK_MAX_ITEMS = getattr(settings, "SMS_BULK_MAX_ITEMS", 5000)
+IN_QUERY_CHUNK = 1000
+# Streamed imports: compressed bytes read per step, and the longest NDJSON line accepted
+STREAM_READ_BYTES = 64 * 1024
+STREAM_MAX_LINE_BYTES = 64 * 1024
+
+
+def normalize_sms(sms_text):
+    """The message as it is hashed: NFC, with every whitespace run (newlines, tabs) as one space."""
+    return " ".join(unicodedata.normalize("NFC", sms_text or "").split())
+
+
+def content_hash(sms_text):
+    """Hex SHA-256 of the normalized message.
+
+    The sender is left out on purpose: the same SMS re-synced from the app
+    can arrive with the sender spelled differently ("M-PESA", "MPESA"), and
+    the body alone already carries the reference and timestamp.
+    """
+    return hashlib.sha256(normalize_sms(sms_text).encode("utf-8")).hexdigest()
+
+
+def insert_or_ignore(instance):
+    """Insert ``instance`` unless it collides with a unique index; ``True`` when the row is new.
+
+    PostgreSQL and SQLite get one ``INSERT ... ON CONFLICT DO NOTHING
+    RETURNING id`` statement: no SELECT first, and no IntegrityError (or
+    aborted transaction) when a concurrent upload of the same message wins.
+    Only unique conflicts are ignored; NOT NULL and other errors still raise
+    ``IntegrityError``. ``instance.pk`` is set when the row was inserted.
+    """
+    model = type(instance)
+    using = router.db_for_write(model, instance=instance)
+    connection = connections[using]
+    if connection.vendor not in ("postgresql", "sqlite"):
+        try:
+            with transaction.atomic(using=using):
+                instance.save(force_insert=True, using=using)
+            return True
+        except IntegrityError:
+            if _violates_unique(instance, using):
+                return False
+            raise
+
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+    placeholders = ", ".join(["%s"] * len(fields))
+    params = [field.get_db_prep_save(field.pre_save(instance, True), connection) for field in fields]
+    sql = f"INSERT INTO {connection.ops.quote_name(model._meta.db_table)} ({columns}) VALUES ({placeholders}) " \
+          "ON CONFLICT DO NOTHING"
+    returning = connection.features.can_return_columns_from_insert
+    if returning:
+        sql += f" RETURNING {connection.ops.quote_name(model._meta.pk.column)}"
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        if returning:
+            row = cursor.fetchone()
+            created = row is not None
+            if created:
+                instance.pk = row[0]
+        else:
+            created = cursor.rowcount == 1
+            if created:
+                instance.pk = connection.ops.last_insert_id(cursor, model._meta.db_table, model._meta.pk.column)
+    if created:
+        instance._state.adding = False
+        instance._state.db = using
+    return created
+
+
+def _violates_unique(instance, using):
+    # Fallback backends only: was the failed insert a unique-index collision?
+    model = type(instance)
+    lookups = [{field.attname: getattr(instance, field.attname)}
+               for field in model._meta.concrete_fields if field.unique and not field.primary_key]
+    lookups += [{model._meta.get_field(name).attname: getattr(instance, model._meta.get_field(name).attname)
+                 for name in constraint.fields}
+                for constraint in model._meta.total_unique_constraints]
+    # NULLs never collide, so lookups holding one cannot explain the error
+    return any(model._default_manager.using(using).filter(**lookup).exists()
+               for lookup in lookups if None not in lookup.values())
+
+
+def find_duplicate(user, digest):
+    """``"saved"`` or ``"rejected"`` if this user already submitted the message, else ``None``.
+
+    One query over the two ``(user, content_hash)`` unique indexes, none
+    when the rejection is still waiting in the rejection buffer.
+    """
+    if rejection_buffer.contains(_user_id(user), digest):
+        return "rejected"
+    user_filter = {"user": user} if user is not None and user.is_authenticated else {"user__isnull": True}
+    saved = (Transaction.objects.filter(content_hash=digest, **user_filter)
+             .annotate(outcome=Value("saved")).values_list("outcome", flat=True))
+    rejected = (RejectedSMS.objects.filter(content_hash=digest, **user_filter)
+                .annotate(outcome=Value("rejected")).values_list("outcome", flat=True))
+    return next(iter(saved.union(rejected, all=True)[:1]), None)
+
+
+def _user_id(user):
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+def record_rejection(sender, message, reason, user=None, digest=None):
+    """Queue a rejection for the buffered writer (see ``rejections.RejectionBuffer``).
+
+    Pass ``reason=None`` for a message already rejected earlier: it only
+    adds to that row's ``occurrences``.
+    """
+    rejection_buffer.add(sender, message, reason, _user_id(user), digest or content_hash(message))
+
+
+def _chunks(values, size=IN_QUERY_CHUNK):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _existing(queryset, field, values):
+    """The subset of ``values`` already stored in ``field``, a few ``IN`` queries at most."""
+    found = set()
+    for chunk in _chunks(values):
+        found.update(queryset.filter(**{f"{field}__in": chunk}).values_list(field, flat=True))
+    return found
+
+
+def _owned(model, user):
+    if user is not None and user.is_authenticated:
+        return model.objects.filter(user=user)
+    return model.objects.filter(user__isnull=True)
+
+
+def _stored_hashes(user, digests):
+    """``{digest: "saved" | "rejected"}`` for the ones this user already has."""
+    stored = {digest: "rejected" for digest in _existing(_owned(RejectedSMS, user), "content_hash", digests)}
+    stored.update((digest, "rejected") for digest in rejection_buffer.pending_hashes(_user_id(user), digests))
+    stored.update((digest, "saved") for digest in _existing(_owned(Transaction, user), "content_hash", digests))
+    return stored
+
+
+def _write_batch(candidates, statuses):
+    taken = _existing(Transaction.objects.all(), "reference_id", [row.reference_id for _, _, row in candidates])
+    new_rows, seen_references = [], set()
+    for i, parsed, row in candidates:
+        if row.reference_id in taken or row.reference_id in seen_references:
+            statuses[i] = {"status": "duplicate", "stored_as": "reference_id", "error": "Duplicate reference_id"}
+            continue
+        seen_references.add(row.reference_id)
+        new_rows.append(row)
+        statuses[i] = {"status": "saved", "reference_id": row.reference_id, "type": row.type,
+                       "amount": row.amount, "model_version": parsed.get("model_version")}
+    with transaction.atomic():
+        Transaction.objects.bulk_create(new_rows, batch_size=500)
+
+
+def _received_at(item):
+    """The device's receive time from ``received_at`` (ISO 8601 or epoch milliseconds), if usable.
+
+    Always timezone-aware: epoch values are UTC, and ISO strings without an
+    offset are taken in the current time zone.
+    """
+    value = item.get("received_at")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return datetime.fromtimestamp(value / 1000, tz=dt_timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            return None
+    if isinstance(value, str):
+        try:
+            parsed = parse_datetime(value)
+        except ValueError:
+            return None
+        if parsed is not None and timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+    return None
+
+
+def ingest_batch(items, user=None):
+    """Parse and store many ``{"sms", "sender"}`` items; returns one status dict per item, in order.
+
+    Statuses: ``saved``, ``rejected`` (unknown provider), ``duplicate``
+    (already stored for this user, by content or reference), ``invalid``.
+    Known messages are found with one ``IN`` query per table, the rest are
+    parsed with one ``parse_many`` call, and new transactions are written
+    with ``bulk_create`` in a single transaction. Rejections, repeats
+    within the batch included, go through ``record_rejection``.
+    """
+    statuses = [None] * len(items)
+    pending = []  # (index, sms, sender, digest)
+    batch_hashes = set()
+    received = {}
+    repeats = Counter()
+    for i, item in enumerate(items):
+        sms = item.get("sms") if isinstance(item, dict) else None
+        if not isinstance(sms, str) or not sms.strip():
+            statuses[i] = {"status": "invalid", "error": "No SMS provided."}
+            continue
+        digest = content_hash(sms)
+        if digest in batch_hashes:
+            statuses[i] = {"status": "duplicate", "stored_as": "batch"}
+            repeats[digest] += 1
+            continue
+        batch_hashes.add(digest)
+        pending.append((i, sms, item.get("sender"), digest))
+        received[digest] = _received_at(item)
+
+    stored = _stored_hashes(user, batch_hashes)
+    for i, sms, sender, digest in pending:
+        if digest in stored:
+            statuses[i] = {"status": "duplicate", "stored_as": stored[digest]}
+            if stored[digest] == "rejected":
+                for _ in range(1 + repeats[digest]):
+                    record_rejection(sender or "UNKNOWN", sms, None, user, digest)
+    pending = [entry for entry in pending if entry[3] not in stored]
+
+    parsed_items = parse_many([sms for _, sms, _, _ in pending], [sender for _, _, sender, _ in pending])
+    owner = user if user is not None and user.is_authenticated else None
+    now = timezone.now()
+
+    candidates = []
+    for (i, sms, sender, digest), parsed in zip(pending, parsed_items):
+        provider_name = (parsed.get("network_provider") or "").upper()
+        if not provider_registry.is_known(provider_name):
+            record_rejection(sender or "UNKNOWN", sms, f"Unknown provider: {provider_name}", user, digest)
+            # Later copies in this batch count as repeats of the same row
+            for _ in range(repeats[digest]):
+                record_rejection(sender or "UNKNOWN", sms, None, user, digest)
+            statuses[i] = {"status": "rejected", "error": "Unknown provider"}
+            continue
+        # Timestamps alone would collide within one batch, so the hash keeps them unique
+        reference_id = parsed.get("reference_id") or f"UNKNOWN-{now.timestamp()}-{digest[:12]}"
+        candidates.append((i, parsed, Transaction(
+            reference_id=reference_id,
+            network_provider=provider_name,
+            type=parsed.get("type") or "unknown",
+            amount=parsed.get("amount") or 0.0,
+            customer_phone=parsed.get("customer_phone"),
+            customer_name=parsed.get("customer_name"),
+            balance=parsed.get("balance"),
+            transaction_fee=parsed.get("transaction_fee"),
+            # Messages without a date of their own fall back to when the phone received them
+            date_transaction=parsed.get("date_transaction") or received[digest] or now,
+            raw_sms=sms,
+            sender=sender,
+            user=owner,
+            is_incomplete=not parsed.get("reference_id") or parsed.get("amount") is None,
+            content_hash=digest,
+        )))
+
+    try:
+        _write_batch(candidates, statuses)
+    except IntegrityError:
+        # A concurrent upload stored some of these between the checks and the
+        # insert: mark those as duplicates and write the rest once more
+        stored = _stored_hashes(user, [row.content_hash for _, _, row in candidates])
+        for i, _, row in candidates:
+            if row.content_hash in stored:
+                statuses[i] = {"status": "duplicate", "stored_as": stored[row.content_hash]}
+        _write_batch([entry for entry in candidates if entry[2].content_hash not in stored], statuses)
+    return statuses
+
+
+def _sms_position(item):
+    """``(date, id)`` of a synced SMS, or ``None`` when the device did not send both as integers."""
+    if not isinstance(item, dict):
+        return None
+    date, sms_id = item.get("date"), item.get("id")
+    if isinstance(date, bool) or isinstance(sms_id, bool) or not isinstance(date, int) or not isinstance(sms_id, int):
+        return None
+    return date, sms_id
+
+
+def cursor_position(cursor):
+    if cursor.last_sms_date is None:
+        return None
+    return cursor.last_sms_date, cursor.last_sms_id
+
+
+def sync_device(user, device_id, items):
+    """Ingest a device's new messages and move its cursor past them; returns ``(cursor, statuses)``.
+
+    Items are ``{"sms", "sender", "id", "date"}`` with the phone's inbox id
+    and epoch-millisecond date. Only items after the cursor, ordered by
+    ``(date, id)``, are parsed; anything at or before it was acknowledged
+    by an earlier sync and is answered ``behind_cursor`` without work. The
+    cursor only moves up to the first item that was not stored (saved,
+    rejected or duplicate), so a corrected resend of an invalid item is
+    still ingested. The cursor row is locked for the whole call and
+    advanced in the same transaction as the inserts, so a sync either
+    lands with its cursor move or not at all, and two syncs from one
+    device run one after the other.
+    """
+    statuses = [None] * len(items)
+    with transaction.atomic():
+        cursor, _ = DeviceSyncCursor.objects.select_for_update().get_or_create(user=user, device_id=device_id)
+        acknowledged = cursor_position(cursor)
+
+        new_items = []  # (position, index, item)
+        for i, item in enumerate(items):
+            position = _sms_position(item)
+            if position is None:
+                statuses[i] = {"status": "invalid", "error": "Each item needs integer id and date."}
+            elif acknowledged is not None and position <= acknowledged:
+                statuses[i] = {"status": "behind_cursor"}
+            else:
+                new_items.append((position, i, item))
+
+        for (_, i, _), status in zip(new_items, ingest_batch([item for _, _, item in new_items], user)):
+            statuses[i] = status
+
+        newest, synced = acknowledged, 0
+        for position, i, _ in sorted(new_items, key=lambda entry: entry[:2]):
+            if statuses[i]["status"] not in ("saved", "rejected", "duplicate"):
+                break
+            newest, synced = position, synced + 1
+
+        if synced:
+            cursor.last_sms_date, cursor.last_sms_id = newest
+            cursor.synced_count += synced
+            cursor.save(update_fields=["last_sms_date", "last_sms_id", "synced_count", "updated_at"])
+    return cursor, statuses
+
+
+# ✅ Streamed NDJSON imports
+
+def iter_body_chunks(read, gzipped, read_bytes=STREAM_READ_BYTES):
+    """Yield the request body in pieces as it arrives, gunzipped on the fly when ``gzipped``.
+
+    Output is capped at ``read_bytes`` per piece, so a highly compressed
+    body never inflates more than that at once. Concatenated gzip members
+    (``cat a.gz b.gz``) are decompressed one after the other. A corrupt
+    or truncated body raises ``zlib.error``.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+    in_member = False
+    while True:
+        chunk = read(read_bytes)
+        if not chunk:
+            break
+        if decompressor is None:
+            yield chunk
+            continue
+        in_member = True
+        while True:
+            data = decompressor.decompress(chunk, read_bytes)
+            if data:
+                yield data
+            if decompressor.eof:
+                # Next gzip member, if any
+                chunk = decompressor.unused_data
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                in_member = bool(chunk)
+                if not chunk:
+                    break
+                continue
+            chunk = decompressor.unconsumed_tail
+            # A full piece may leave more output inside zlib even with no input left
+            if not chunk and len(data) < read_bytes:
+                break
+    if in_member:
+        raise zlib.error("Compressed body ended before the end of the gzip stream")
+
+
+def iter_ndjson(chunks, max_line_bytes=STREAM_MAX_LINE_BYTES):
+    """Yield ``(line_number, record_or_None, error)`` for each non-blank NDJSON line in ``chunks``."""
+    pending, line_number = b"", 0
+    for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        if len(pending) > max_line_bytes:
+            raise ValueError(f"Line {line_number + len(lines) + 1} is longer than {max_line_bytes} bytes")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield _decode_record(line_number, line)
+    if pending.strip():
+        yield _decode_record(line_number + 1, pending)
+
+
+def _decode_record(line_number, line):
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        return line_number, None, f"Invalid JSON: {e}"
+    if not isinstance(record, dict):
+        return line_number, None, "Expected a {sms, sender, received_at} object"
+    return line_number, record, None
+
+
+def import_records(records, user=None, batch_size=500):
+    """Ingest ``iter_ndjson`` output ``batch_size`` records at a time; yields one summary per batch.
+
+    Each batch goes through ``ingest_batch`` and is committed before the
+    next one is read, so memory holds one batch whatever the import size,
+    and a broken connection keeps every batch already reported. The last
+    summary has ``"done": True`` and the totals.
+    """
+    totals, batch, errors, first_line, batches = Counter(), [], [], None, 0
+
+    def flush(last_line):
+        summary = Counter(result["status"] for result in ingest_batch(batch, user)) if batch else Counter()
+        if errors:
+            summary["invalid"] += len(errors)
+        totals.update(summary)
+        return {"batch": batches, "lines": [first_line, last_line], "summary": dict(summary), "errors": errors}
+
+    last_line = 0
+    for line_number, record, error in records:
+        if first_line is None:
+            first_line = line_number
+        last_line = line_number
+        if error:
+            errors.append({"line": line_number, "error": error})
+        else:
+            batch.append(record)
+        if len(batch) + len(errors) >= batch_size:
+            batches += 1
+            yield flush(last_line)
+            batch, errors, first_line = [], [], None
+    if batch or errors:
+        batches += 1
+        yield flush(last_line)
+    yield {"done": True, "batches": batches, "lines": last_line, "summary": dict(totals)}
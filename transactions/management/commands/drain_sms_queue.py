@@ -0,0 +1,46 @@
+import multiprocessing
+import os
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from transactions import sms_queue
+
+
+class Command(BaseCommand):
+    help = "Parse and store SMS queued by the API, with a pool of local worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                            help="worker processes (default: up to 4)")
+        parser.add_argument("--batch-size", type=int, default=sms_queue.BATCH_SIZE,
+                            help="messages each worker claims at a time")
+        parser.add_argument("--poll", type=float, default=1.0, help="seconds to wait when the queue is empty")
+        parser.add_argument("--stale-after", type=int, default=sms_queue.STALE_AFTER_SECONDS,
+                            help="seconds before a claimed but unfinished message is queued again")
+        parser.add_argument("--once", action="store_true", help="exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        worker_options = {
+            "batch_size": options["batch_size"],
+            "poll_seconds": options["poll"],
+            "stale_after": options["stale_after"],
+            "once": options["once"],
+        }
+        workers = max(1, options["workers"])
+        self.stdout.write(f"🚀 Draining the SMS queue with {workers} worker(s)")
+
+        if workers == 1:
+            processed = [sms_queue.drain(**worker_options)]
+        else:
+            # Children open their own connections (see run_worker)
+            connections.close_all()
+            with multiprocessing.Pool(workers, initializer=django.setup) as pool:
+                try:
+                    processed = pool.map(sms_queue.run_worker, [worker_options] * workers)
+                except KeyboardInterrupt:
+                    pool.terminate()
+                    raise
+
+        self.stdout.write(self.style.SUCCESS(f"✅ Processed {sum(processed)} queued SMS"))
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.8 on 2026-10-18 17:20
+
+import hashlib
+import unicodedata
+
+from django.db import migrations, models
+
+
+def _content_hash(sms_text):
+    # Frozen copy of transactions.ingestion.content_hash
+    normalized = " ".join(unicodedata.normalize("NFC", sms_text or "").split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def backfill_content_hash(apps, schema_editor):
+    # The oldest row of each (user, message) keeps the hash; later copies stay
+    # NULL so the unique constraint can be added over existing duplicates.
+    for model_name, text_field in (("Transaction", "raw_sms"), ("RejectedSMS", "message")):
+        model = apps.get_model("transactions", model_name)
+        seen = set()
+        pending = []
+        for row_id, user_id, text in model.objects.order_by("id").values_list("id", "user_id", text_field).iterator():
+            digest = _content_hash(text)
+            if (user_id, digest) in seen:
+                continue
+            seen.add((user_id, digest))
+            pending.append(model(id=row_id, content_hash=digest))
+            if len(pending) >= 1000:
+                model.objects.bulk_update(pending, ["content_hash"])
+                pending = []
+        model.objects.bulk_update(pending, ["content_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0002_transaction_is_incomplete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rejectedsms',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(backfill_content_hash, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='rejectedsms',
+            constraint=models.UniqueConstraint(fields=('user', 'content_hash'), name='unique_rejected_sms_per_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='transaction',
+            constraint=models.UniqueConstraint(fields=('user', 'content_hash'), name='unique_transaction_sms_per_user'),
+        ),
+    ]
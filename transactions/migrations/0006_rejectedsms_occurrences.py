@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:20
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_last_seen(apps, schema_editor):
+    RejectedSMS = apps.get_model("transactions", "RejectedSMS")
+    RejectedSMS.objects.filter(last_seen__isnull=True).update(last_seen=F("received_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0005_devicesynccursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rejectedsms',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='rejectedsms',
+            name='occurrences',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(backfill_last_seen, migrations.RunPython.noop),
+    ]
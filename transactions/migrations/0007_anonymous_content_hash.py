@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def release_anonymous_duplicates(apps, schema_editor):
+    # Anonymous copies were never blocked by the (user, content_hash) index:
+    # the oldest row keeps the hash and later copies go back to NULL, as in 0003.
+    for model_name in ("Transaction", "RejectedSMS"):
+        model = apps.get_model("transactions", model_name)
+        seen = set()
+        duplicates = []
+        rows = (model.objects.filter(user__isnull=True, content_hash__isnull=False)
+                .order_by("id").values_list("id", "content_hash").iterator())
+        for row_id, digest in rows:
+            if digest in seen:
+                duplicates.append(row_id)
+            seen.add(digest)
+        for start in range(0, len(duplicates), 500):
+            model.objects.filter(id__in=duplicates[start:start + 500]).update(content_hash=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0006_rejectedsms_occurrences'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(release_anonymous_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='rejectedsms',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('content_hash',), name='unique_rejected_sms_anonymous'),
+        ),
+        migrations.AddConstraint(
+            model_name='transaction',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('content_hash',), name='unique_transaction_sms_anonymous'),
+        ),
+    ]
@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from django.conf import settings
 
@@ -18,6 +20,17 @@ class Transaction(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True,related_name='transactions')
     is_incomplete = models.BooleanField(default=False)
+    # SHA-256 of the normalized SMS (see ingestion.content_hash), one row per user and message
+    content_hash = models.CharField(max_length=64, null=True, blank=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'content_hash'], name='unique_transaction_sms_per_user'),
+            # NULL users never collide in the index above: anonymous rows need their own
+            models.UniqueConstraint(fields=['content_hash'], condition=models.Q(user__isnull=True),
+                                    name='unique_transaction_sms_anonymous'),
+        ]
+
     def __str__(self):
         return f"{self.reference_id} - {self.type} - {self.amount}"
 
@@ -29,6 +42,18 @@ class RejectedSMS(models.Model):
     reason = models.CharField(max_length=255)  # e.g., unknown sender, pattern mismatch
     received_at = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
+    content_hash = models.CharField(max_length=64, null=True, blank=True, editable=False)
+    # The same message rejected again only bumps these (see rejections.RejectionBuffer)
+    occurrences = models.PositiveIntegerField(default=1)
+    last_seen = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'content_hash'], name='unique_rejected_sms_per_user'),
+            # NULL users never collide in the index above: anonymous rows need their own
+            models.UniqueConstraint(fields=['content_hash'], condition=models.Q(user__isnull=True),
+                                    name='unique_rejected_sms_anonymous'),
+        ]
 
     def __str__(self):
         return f"Rejected from {self.sender} at {self.received_at}"
@@ -45,3 +70,51 @@ class Provider(models.Model):
         return self.name
 
 
+# ⏳ Raw SMS accepted by the API and waiting for a drain_sms_queue worker
+class QueuedSMS(models.Model):
+    QUEUED = "queued"
+    PROCESSING = "processing"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [(QUEUED, "Queued"), (PROCESSING, "Processing"), (DONE, "Done"), (FAILED, "Failed")]
+
+    # The ticket handed back to the client
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
+    sms = models.TextField()
+    sender = models.CharField(max_length=100, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    # Per-message outcome, as returned by ingestion.ingest_batch
+    result = models.JSONField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    claimed_by = models.CharField(max_length=64, null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='queued_sms_status_created'),
+        ]
+
+    def __str__(self):
+        return f"{self.id} - {self.status}"
+
+
+# 🔄 How far each device's inbox has been synced, by the device's own SMS date and id
+class DeviceSyncCursor(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='sync_cursors')
+    device_id = models.CharField(max_length=128)
+    # Epoch milliseconds and inbox id of the newest SMS acknowledged, exactly as the phone reports them
+    last_sms_date = models.BigIntegerField(null=True, blank=True)
+    last_sms_id = models.BigIntegerField(null=True, blank=True)
+    synced_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'device_id'], name='unique_sync_cursor_per_device'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} / {self.device_id} @ {self.last_sms_date}"
@@ -0,0 +1,88 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Provider
+
+# Bumped on every Provider change. With a shared cache backend (Redis,
+# memcached, database, file) this lets other processes notice the change
+# too. A per-process cache cannot carry it across processes, so then the
+# table is simply reloaded every check interval.
+VERSION_KEY = "transactions:provider-registry:version"
+
+
+def _cache_is_shared():
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache))
+
+
+class ProviderRegistry:
+    """Process-local copy of the Provider table.
+
+    The table is loaded once and lookups are served from a case-folded set
+    in memory. It reloads after a Provider save/delete in this process
+    commits (a rolled-back edit never reaches it), and
+    every ``check_interval`` seconds either when the shared version stamp
+    changed or, without a shared cache, unconditionally (one small query),
+    so other workers' changes are seen within that interval.
+    """
+
+    def __init__(self, check_interval=30):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        # (providers, case-folded names), swapped as a whole on reload
+        self._snapshot = None
+        self._version = None
+        self._checked_at = 0.0
+
+    def _load(self):
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if snapshot is not None and now - self._checked_at < self.check_interval:
+            return snapshot
+
+        shared = _cache_is_shared()
+        version = cache.get(VERSION_KEY) if shared else None
+        with self._lock:
+            if self._snapshot is None or not shared or version != self._version:
+                providers = list(Provider.objects.all())
+                self._snapshot = (providers, frozenset(provider.name.casefold() for provider in providers))
+                self._version = version
+            self._checked_at = now
+            return self._snapshot
+
+    def providers(self):
+        """All Provider rows, as loaded from the database."""
+        return list(self._load()[0])
+
+    def names(self):
+        return [provider.name for provider in self._load()[0]]
+
+    def is_known(self, name):
+        """Case-insensitive membership test, equivalent to ``name__iexact`` ``exists()``."""
+        return (name or "").casefold() in self._load()[1]
+
+    def invalidate(self):
+        """Drop the local copy and bump the shared version stamp."""
+        with self._lock:
+            self._snapshot = None
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, 1, None)
+
+
+provider_registry = ProviderRegistry(getattr(settings, "PROVIDER_REGISTRY_CHECK_INTERVAL", 30))
+
+
+@receiver(post_save, sender=Provider)
+@receiver(post_delete, sender=Provider)
+def _invalidate_provider_registry(sender, using, **kwargs):
+    # Inside the writer's transaction a reload would read rows that may still be rolled back
+    transaction.on_commit(provider_registry.invalidate, using=using)
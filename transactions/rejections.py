@@ -0,0 +1,166 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import RejectedSMS
+
+logger = logging.getLogger(__name__)
+
+# Used when a repeat of an already-stored rejection is flushed but that row is gone
+REPEAT_REASON = "Previously rejected"
+
+
+class RejectionBuffer:
+    """Collects rejected SMS in memory and writes them in bulk.
+
+    Rejections are keyed by ``(user, content_hash)``, the same key as the
+    table's unique constraint: a message rejected again, in the buffer or
+    already stored, becomes one row whose ``occurrences`` and
+    ``last_seen`` move forward instead of a new INSERT. The buffer is
+    flushed once it holds ``max_size`` messages (after the caller's
+    transaction commits), ``max_age`` seconds after the first one arrived
+    (on a timer thread), and at process exit.
+    A flush is one ``IN`` lookup, one ``bulk_update`` for rows that exist
+    and one ``bulk_create`` for the rest.
+    """
+
+    def __init__(self, max_size=200, max_age=5.0):
+        self.max_size = max_size
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # (user_id, content_hash) -> pending row fields and count
+        self._pending = {}
+        self._timer = None
+
+    def add(self, sender, message, reason, user_id, digest):
+        """Count one rejection; ``reason=None`` means a repeat of a message already rejected."""
+        now = timezone.now()
+        key = (user_id, digest)
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                self._pending[key] = {"sender": sender, "message": message, "reason": reason,
+                                      "count": 1, "last_seen": now}
+            else:
+                entry["count"] += 1
+                entry["last_seen"] = now
+                entry["reason"] = entry["reason"] or reason
+            full = len(self._pending) >= self.max_size
+            # Also when full: the timer still writes them if the commit below never comes
+            self._schedule()
+        if full:
+            # Not inside the caller's transaction: a rollback there would take
+            # every buffered rejection with it. Runs now outside atomic blocks.
+            transaction.on_commit(self._flush_quietly)
+
+    def _schedule(self):
+        # Called with _lock held
+        if self._timer is None:
+            self._timer = threading.Timer(self.max_age, self._flush_from_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def contains(self, user_id, digest):
+        """Whether this rejection is waiting to be written (it counts as stored for duplicate checks)."""
+        return (user_id, digest) in self._pending
+
+    def pending_hashes(self, user_id, digests):
+        return {digest for digest in digests if (user_id, digest) in self._pending}
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of messages written."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if not pending:
+                return 0
+            try:
+                for attempt in range(2):
+                    try:
+                        with transaction.atomic():
+                            self._write(pending)
+                        break
+                    except IntegrityError:
+                        # Another process stored one of these first: the next lookup sees it
+                        if attempt:
+                            raise
+            except Exception:
+                self._restore(pending)
+                raise
+            return sum(entry["count"] for entry in pending.values())
+
+    def _restore(self, pending):
+        # A failed flush keeps its messages for the next one
+        with self._lock:
+            for key, entry in pending.items():
+                current = self._pending.get(key)
+                if current is None:
+                    self._pending[key] = entry
+                else:
+                    current["count"] += entry["count"]
+                    current["reason"] = current["reason"] or entry["reason"]
+            self._schedule()
+
+    def _write(self, pending):
+        digests = {digest for _, digest in pending}
+        existing = {}
+        for row in (RejectedSMS.objects.filter(content_hash__in=digests)
+                    .only("id", "user_id", "content_hash").order_by("-id")):
+            # The oldest row wins where anonymous copies share a hash
+            existing[(row.user_id, row.content_hash)] = row
+
+        updated, created = [], []
+        for key, entry in pending.items():
+            row = existing.get(key)
+            if row is not None:
+                row.occurrences = F("occurrences") + entry["count"]
+                row.last_seen = entry["last_seen"]
+                updated.append(row)
+            else:
+                user_id, digest = key
+                created.append(RejectedSMS(
+                    sender=entry["sender"],
+                    message=entry["message"],
+                    reason=entry["reason"] or REPEAT_REASON,
+                    user_id=user_id,
+                    content_hash=digest,
+                    occurrences=entry["count"],
+                    last_seen=entry["last_seen"],
+                ))
+        RejectedSMS.objects.bulk_update(updated, ["occurrences", "last_seen"], batch_size=500)
+        RejectedSMS.objects.bulk_create(created, batch_size=500)
+
+    def _flush_quietly(self):
+        started = time.perf_counter()
+        try:
+            written = self.flush()
+            if written:
+                logger.info("Flushed %d rejected SMS in %.3fs", written, time.perf_counter() - started)
+        except Exception:
+            logger.exception("Could not flush rejected SMS; kept for the next flush")
+
+    def _flush_from_timer(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self._flush_quietly()
+        finally:
+            # This thread's own database connection
+            connections.close_all()
+
+
+rejection_buffer = RejectionBuffer(
+    getattr(settings, "SMS_REJECTION_BUFFER_SIZE", 200),
+    getattr(settings, "SMS_REJECTION_FLUSH_SECONDS", 5.0),
+)
+atexit.register(rejection_buffer._flush_quietly)
@@ -0,0 +1,142 @@
+"""Database-backed SMS queue: the API enqueues, ``drain_sms_queue`` workers ingest.
+
+``POST /api/parse-sms/?async=1`` (or every request, with
+``SMS_ASYNC_INGESTION = True``) stores the raw message as a ``QueuedSMS``
+row and answers 202 with its id as the ticket; nothing is parsed in the
+request. Workers started by::
+
+    python manage.py drain_sms_queue --workers 4
+
+claim queued rows in micro-batches with a conditional ``UPDATE``, so two
+workers never take the same row and no broker or row locking is needed
+(this works the same on SQLite and PostgreSQL). Each batch goes through
+``ingestion.ingest_batch`` — one ``parse_many`` call and bulk inserts —
+and the per-message outcome is written back on the row, where
+``GET /api/parse-sms/status/<ticket>/`` reads it. Rows claimed by a worker
+that died are queued again after ``stale_after`` seconds.
+"""
+import logging
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F
+from django.utils import timezone
+
+from .ingestion import ingest_batch
+from .models import QueuedSMS
+from .rejections import rejection_buffer
+
+logger = logging.getLogger(__name__)
+
+ASYNC_INGESTION = getattr(settings, "SMS_ASYNC_INGESTION", False)
+BATCH_SIZE = 200
+MAX_ATTEMPTS = 3
+STALE_AFTER_SECONDS = 300
+
+
+def enqueue(sms, sender=None, user=None):
+    """Store one raw SMS for the workers; returns the ``QueuedSMS`` (its ``id`` is the ticket)."""
+    return QueuedSMS.objects.create(
+        sms=sms,
+        sender=sender,
+        user=user if user is not None and user.is_authenticated else None,
+    )
+
+
+def claim_batch(size=BATCH_SIZE):
+    """Take up to ``size`` of the oldest queued rows for this worker; returns them.
+
+    Candidates are read without locks and flipped to ``processing`` only if
+    still ``queued``; whatever another worker took in between is simply not
+    ours, so concurrent workers split the queue instead of blocking.
+    """
+    candidates = list(QueuedSMS.objects.filter(status=QueuedSMS.QUEUED)
+                      .order_by("created_at").values_list("id", flat=True)[:size])
+    if not candidates:
+        return []
+    token = uuid.uuid4().hex
+    QueuedSMS.objects.filter(id__in=candidates, status=QueuedSMS.QUEUED).update(
+        status=QueuedSMS.PROCESSING, claimed_by=token, claimed_at=timezone.now(), attempts=F("attempts") + 1,
+    )
+    return list(QueuedSMS.objects.filter(claimed_by=token, status=QueuedSMS.PROCESSING)
+                .select_related("user").order_by("created_at"))
+
+
+def process_batch(rows):
+    """Ingest claimed rows, one ``ingest_batch`` call per user, and record each outcome.
+
+    If the rejections cannot be written the error propagates and the rows
+    stay claimed, to be queued again by ``requeue_stale``.
+    """
+    by_user = {}
+    for row in rows:
+        by_user.setdefault(row.user_id, []).append(row)
+
+    finished = timezone.now()
+    for user_rows in by_user.values():
+        try:
+            results = ingest_batch([{"sms": row.sms, "sender": row.sender} for row in user_rows], user_rows[0].user)
+        except Exception as e:
+            logger.exception("Queued SMS batch of %d failed", len(user_rows))
+            for row in user_rows:
+                # Retried by a later claim until MAX_ATTEMPTS
+                row.status = QueuedSMS.FAILED if row.attempts >= MAX_ATTEMPTS else QueuedSMS.QUEUED
+                row.result = {"status": "error", "error": str(e)}
+                row.finished_at = finished if row.status == QueuedSMS.FAILED else None
+            continue
+        for row, result in zip(user_rows, results):
+            row.status, row.result, row.finished_at = QueuedSMS.DONE, result, finished
+    # Pool workers are terminated, so neither the buffer's timer nor its
+    # atexit flush can be relied on: rejections are written before the rows
+    # that produced them are marked done
+    rejection_buffer.flush()
+    QueuedSMS.objects.bulk_update(rows, ["status", "result", "finished_at"], batch_size=500)
+
+
+def requeue_stale(stale_after=STALE_AFTER_SECONDS):
+    """Give rows claimed by a worker that never finished them back to the queue.
+
+    A row that has already used ``MAX_ATTEMPTS`` claims is marked failed
+    instead, as ``process_batch`` does, so a message that kills its worker
+    is not retried forever. Returns the number of rows queued again.
+    """
+    now = timezone.now()
+    stale = QueuedSMS.objects.filter(status=QueuedSMS.PROCESSING, claimed_at__lt=now - timedelta(seconds=stale_after))
+    failed = stale.filter(attempts__gte=MAX_ATTEMPTS).update(
+        status=QueuedSMS.FAILED, claimed_by=None, finished_at=now,
+        result={"status": "error", "error": f"Worker did not finish after {MAX_ATTEMPTS} attempts"},
+    )
+    if failed:
+        logger.warning("Gave up on %d queued SMS after %d attempts", failed, MAX_ATTEMPTS)
+    return stale.update(status=QueuedSMS.QUEUED, claimed_by=None)
+
+
+def drain(batch_size=BATCH_SIZE, poll_seconds=1.0, stale_after=STALE_AFTER_SECONDS, once=False):
+    """Claim and process batches until the queue is empty (``once``) or forever; returns rows done."""
+    processed = 0
+    while True:
+        rows = claim_batch(batch_size)
+        if rows:
+            started = time.perf_counter()
+            process_batch(rows)
+            processed += len(rows)
+            logger.info("Ingested %d queued SMS in %.2fs", len(rows), time.perf_counter() - started)
+            continue
+        if requeue_stale(stale_after):
+            continue
+        if once:
+            return processed
+        time.sleep(poll_seconds)
+
+
+def run_worker(options):
+    """Pool entry point: one worker process draining with ``options`` (``drain`` keyword arguments)."""
+    # Connections inherited from the parent must not be shared across processes
+    connections.close_all()
+    try:
+        return drain(**options)
+    finally:
+        connections.close_all()
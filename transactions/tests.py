@@ -1,3 +1,786 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import threading
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.loader import MigrationLoader
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from sms_parser import parser
+from sms_parser.benchmark import DATASET_PATH
+
+from . import sms_queue
+from .api_views import handle_sms_submission
+from .ingestion import STREAM_MAX_LINE_BYTES, content_hash, insert_or_ignore, iter_body_chunks, iter_ndjson
+from .models import DeviceSyncCursor, Provider, QueuedSMS, RejectedSMS, Transaction
+from .provider_registry import provider_registry
+from .rejections import RejectionBuffer, rejection_buffer
+
+SMS = ("CCK9H7R56G1 Imethibitishwa. Umelipa Tsh77,000.00 kwa LIPA ABOU OMARY SILLIAH 20/3/25 9:51 PM "
+       "kwa ada ya Tsh1,700.00. Salio lako jipya la M-Pesa ni Tsh155,524.98.")
+
+
+class ConcurrentSubmissionTests(TransactionTestCase):
+    """Parallel uploads of one message must store it exactly once, without errors."""
+
+    workers = 8
+
+    def setUp(self):
+        Provider.objects.create(name="M-PESA")
+
+    def submit_in_parallel(self, messages):
+        barrier = threading.Barrier(len(messages))
+        results = [None] * len(messages)
+
+        def submit(i, sms):
+            try:
+                barrier.wait()
+                results[i] = handle_sms_submission(sms, "M-PESA")
+            except Exception as e:
+                results[i] = {"exception": e}
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=submit, args=(i, sms)) for i, sms in enumerate(messages)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def assert_stored_once(self, results):
+        self.assertEqual([r for r in results if "exception" in r], [])
+        self.assertEqual(sum(r["saved"] for r in results), 1)
+        self.assertEqual(Transaction.objects.filter(reference_id="CCK9H7R56G1").count(), 1)
+        for r in results:
+            if not r["saved"]:
+                self.assertTrue(r.get("duplicate") or r.get("error") == "Duplicate reference_id", r)
+
+    def test_same_message(self):
+        self.assert_stored_once(self.submit_in_parallel([SMS] * self.workers))
+
+    def test_same_reference_different_text(self):
+        # Different content hashes, so only the reference_id index can stop them
+        self.assert_stored_once(self.submit_in_parallel([f"{SMS} ({i})" for i in range(self.workers)]))
+
+
+class InsertOrIgnoreTests(TransactionTestCase):
+    def make(self, **fields):
+        return Transaction(reference_id="REF1", network_provider="M-PESA", type="payment", amount=1.0,
+                           date_transaction="2025-03-20 21:51", raw_sms="sms", **fields)
+
+    def test_reports_whether_row_was_new(self):
+        first = self.make()
+        self.assertTrue(insert_or_ignore(first))
+        self.assertIsNotNone(first.pk)
+        self.assertEqual(Transaction.objects.get(pk=first.pk).reference_id, "REF1")
+
+        second = self.make()
+        self.assertFalse(insert_or_ignore(second))
+        self.assertIsNone(second.pk)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+
+class TemplateCacheTests(TestCase):
+    """A warm template cache must never change what a message parses to.
+
+    Only ``model_version`` may differ: a cache hit reuses the type the
+    classifier gave the template instead of asking it again.
+    """
+
+    senders = [None, "M-PESA", "TIGOPESA", "AIRTEL", "HALOPESA"]
+
+    def setUp(self):
+        self.maxsize = parser.template_cache.maxsize
+        self.model = parser.get_model_and_version()
+        self.addCleanup(self.restore_parser)
+
+    def restore_parser(self):
+        parser.set_model(*self.model)
+        parser.template_cache.maxsize = self.maxsize
+        parser.template_cache.clear()
+
+    def parse_all(self, messages, cache_size):
+        parser.template_cache.clear()
+        parser.template_cache.maxsize = cache_size
+        return [dict(parser.parse_sms(text, sender), model_version=None) for text, sender in messages]
+
+    def dataset(self):
+        with open(DATASET_PATH, encoding="utf-8") as f:
+            return [row["text"] for row in csv.DictReader(f)]
+
+    def test_reference_does_not_follow_previous_template(self):
+        sms = ("XY12345678 Imethibitishwa. Umelipa Tsh5,000.00 kwa JOHN DOE 20/3/25 9:51 PM. "
+               "Salio lako jipya la M-Pesa ni Tsh1,000.00.")
+        other = sms.replace("XY", "CY", 1)
+        cold = self.parse_all([(other, "M-PESA")], 0)
+        warm = self.parse_all([(sms, "M-PESA"), (other, "M-PESA")], 1024)
+        self.assertEqual(warm[1], cold[0])
+
+    def test_cached_and_uncached_parses_match(self):
+        messages = [(text, sender) for sender in self.senders for text in self.dataset()]
+        uncached = self.parse_all(messages, 0)
+        self.assertEqual(self.parse_all(messages, 1024), uncached)
+        self.assertEqual(self.parse_all(messages[::-1], 1024)[::-1], uncached)
+
+    def test_only_messages_ambiguous_to_the_rules_are_looked_up(self):
+        texts = self.dataset()
+        ambiguous = sum(parser.rule_confidence(text)[1] < parser.TYPE_CONFIDENCE_THRESHOLD for text in texts)
+        self.parse_all([(text, None) for text in texts], 1024)
+        stats = parser.template_cache_stats()
+        self.assertEqual(stats["hits"] + stats["misses"], ambiguous)
+        self.assertLess(ambiguous, len(texts) / 10)
+
+
+class DeviceSyncTests(TestCase):
+    def setUp(self):
+        # Committed as far as the provider registry is concerned
+        with self.captureOnCommitCallbacks(execute=True):
+            Provider.objects.create(name="M-PESA")
+        self.user = User.objects.create_user("phone-owner", password="secret")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse("device-sync", args=["pixel-7"])
+        # Buffered rejections are written inside the test transaction, never by the timer
+        self.addCleanup(rejection_buffer.flush)
+
+    def sync(self, items):
+        response = self.client.post(self.url, {"items": items}, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_first_sync_stores_messages_and_moves_cursor(self):
+        other = SMS.replace("CCK9H7R56G1", "CCK9H7R56G2").replace("77,000", "12,500")
+        body = self.sync([
+            {"sms": SMS, "sender": "M-PESA", "id": 41, "date": 1742496660000},
+            {"sms": other, "sender": "M-PESA", "id": 42, "date": 1742496660000},
+        ])
+
+        self.assertEqual(body["summary"], {"saved": 2})
+        self.assertEqual(body["cursor"], {"device_id": "pixel-7", "date": 1742496660000, "id": 42,
+                                          "synced_count": 2})
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(self.client.get(self.url).json()["cursor"], body["cursor"])
+
+    def test_resync_answers_behind_cursor(self):
+        first = {"sms": SMS, "sender": "M-PESA", "id": 41, "date": 1742496660000}
+        self.sync([first])
+        newer = {"sms": SMS.replace("CCK9H7R56G1", "CCK9H7R56G3"), "sender": "M-PESA",
+                 "id": 43, "date": 1742496720000}
+
+        body = self.sync([first, newer])
+
+        self.assertEqual([r["status"] for r in body["results"]], ["behind_cursor", "saved"])
+        self.assertEqual(body["cursor"]["id"], 43)
+        self.assertEqual(body["cursor"]["synced_count"], 2)
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 2)
+
+        body = self.sync([first, newer])
+        self.assertEqual(body["summary"], {"behind_cursor": 2})
+        self.assertEqual(body["cursor"]["synced_count"], 2)
+
+    def test_mixed_valid_and_invalid_items(self):
+        body = self.sync([
+            {"sms": SMS, "sender": "M-PESA", "id": 41, "date": 1742496660000},
+            {"sms": SMS, "sender": "M-PESA", "id": "41", "date": 1742496660000},
+            {"sms": "Promo: win a phone today", "sender": "SHOP", "id": 44, "date": 1742496780000},
+            {"sms": "", "sender": "M-PESA", "id": 45, "date": 1742496840000},
+            {"sms": SMS, "sender": "M-PESA", "id": 46, "date": 1742496900000},
+        ])
+
+        self.assertEqual([r["status"] for r in body["results"]],
+                         ["saved", "invalid", "rejected", "invalid", "duplicate"])
+        # The item without integer id/date is not counted, and the empty SMS holds the cursor back
+        self.assertEqual(body["cursor"]["id"], 44)
+        self.assertEqual(body["cursor"]["synced_count"], 2)
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 1)
+
+        rejection_buffer.flush()
+        self.assertEqual(list(RejectedSMS.objects.filter(user=self.user).values_list("message", "occurrences")),
+                         [("Promo: win a phone today", 1)])
+        self.assertEqual(DeviceSyncCursor.objects.get(user=self.user, device_id="pixel-7").last_sms_id, 44)
+
+    def test_corrected_resend_of_an_invalid_item_is_ingested(self):
+        corrected = {"sms": SMS.replace("CCK9H7R56G1", "CCK9H7R56G5"), "sender": "M-PESA",
+                     "id": 45, "date": 1742496840000}
+        later = {"sms": SMS, "sender": "M-PESA", "id": 46, "date": 1742496900000}
+        body = self.sync([later, dict(corrected, sms="")])
+
+        self.assertEqual([r["status"] for r in body["results"]], ["saved", "invalid"])
+        self.assertIsNone(body["cursor"]["id"])
+        self.assertEqual(body["cursor"]["synced_count"], 0)
+
+        body = self.sync([corrected, later])
+
+        self.assertEqual([r["status"] for r in body["results"]], ["saved", "duplicate"])
+        self.assertEqual(body["cursor"]["id"], 46)
+        self.assertEqual(body["cursor"]["synced_count"], 2)
+        self.assertEqual(sorted(Transaction.objects.filter(user=self.user).values_list("reference_id", flat=True)),
+                         ["CCK9H7R56G1", "CCK9H7R56G5"])
+
+
+def ndjson(records):
+    return b"".join(json.dumps(record).encode() + b"\n" for record in records)
+
+
+class StreamReaderTests(SimpleTestCase):
+    def chunks(self, body, gzipped, read_bytes=64):
+        return b"".join(iter_body_chunks(io.BytesIO(body).read, gzipped, read_bytes))
+
+    def test_plain_body_passes_through(self):
+        self.assertEqual(self.chunks(b"a\nb\n" * 100, False), b"a\nb\n" * 100)
+
+    def test_gzip_members_are_read_one_after_the_other(self):
+        first, second = b"first\n" * 500, b"second\n" * 500
+        self.assertEqual(self.chunks(gzip.compress(first) + gzip.compress(second), True), first + second)
+
+    def test_output_is_capped_per_piece(self):
+        pieces = list(iter_body_chunks(io.BytesIO(gzip.compress(b"0" * 100_000)).read, True, 1024))
+        self.assertEqual(b"".join(pieces), b"0" * 100_000)
+        self.assertLessEqual(max(len(piece) for piece in pieces), 1024)
+
+    def test_truncated_gzip_raises(self):
+        body = gzip.compress(b"line\n" * 1000)
+        with self.assertRaises(zlib.error):
+            self.chunks(body[:-8], True)
+
+    def test_ndjson_lines_split_across_chunks(self):
+        chunks = [b'{"sms": "a"}\n{"sm', b's": "b"}\n\n[1]\nnot json\n', b'{"sms": "c"}']
+        self.assertEqual([(n, record) for n, record, _ in iter_ndjson(chunks)],
+                         [(1, {"sms": "a"}), (2, {"sms": "b"}), (4, None), (5, None), (6, {"sms": "c"})])
+
+    def test_overlong_line_raises(self):
+        chunks = [b'{"sms": "a"}\n', b"x" * 1000, b"x" * 1000]
+        with self.assertRaisesMessage(ValueError, "Line 2 is longer than 1500 bytes"):
+            list(iter_ndjson(chunks, max_line_bytes=1500))
+
+
+class StreamedImportTests(TestCase):
+    def setUp(self):
+        # Committed as far as the provider registry is concerned
+        with self.captureOnCommitCallbacks(execute=True):
+            Provider.objects.create(name="M-PESA")
+        self.user = User.objects.create_user("importer", password="secret")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.addCleanup(rejection_buffer.flush)
+
+    def records(self, count):
+        return [{"sms": SMS.replace("CCK9H7R56G1", f"CCK{i:08d}"), "sender": "M-PESA"} for i in range(count)]
+
+    def post(self, body, batch_size=50, **headers):
+        response = self.client.post(f"{reverse('import-sms-stream')}?batch_size={batch_size}", body,
+                                    content_type="application/x-ndjson", **headers)
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+    def test_gzip_body_reports_each_batch(self):
+        lines = self.post(gzip.compress(ndjson(self.records(200))), HTTP_CONTENT_ENCODING="gzip")
+
+        self.assertEqual([line["lines"] for line in lines[:-1]], [[1, 50], [51, 100], [101, 150], [151, 200]])
+        self.assertEqual([line["summary"] for line in lines[:-1]], [{"saved": 50}] * 4)
+        self.assertEqual(lines[-1], {"done": True, "batches": 4, "lines": 200, "summary": {"saved": 200}})
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 200)
+
+    def test_multi_member_gzip_with_bad_lines(self):
+        records = self.records(3)
+        body = gzip.compress(ndjson(records[:2])) + gzip.compress(b"not json\n" + ndjson(records))
+        lines = self.post(body, batch_size=10, HTTP_CONTENT_ENCODING="gzip")
+
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]["summary"], {"saved": 3, "duplicate": 2, "invalid": 1})
+        self.assertEqual([error["line"] for error in lines[0]["errors"]], [3])
+        self.assertEqual(lines[1]["summary"], {"saved": 3, "duplicate": 2, "invalid": 1})
+
+    def test_truncated_body_keeps_reported_batches(self):
+        body = gzip.compress(ndjson(self.records(200)))
+        lines = self.post(body[:-8], HTTP_CONTENT_ENCODING="gzip")
+
+        self.assertIn("ended before the end of the gzip stream", lines[-1]["error"])
+        self.assertNotIn("done", json.dumps(lines))
+        reported = sum(line["summary"]["saved"] for line in lines[:-1])
+        self.assertGreaterEqual(reported, 150)
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), reported)
+
+    def test_overlong_line_stops_import(self):
+        body = ndjson(self.records(1)) + b'{"sms": "' + b"x" * (STREAM_MAX_LINE_BYTES + 1)
+        lines = self.post(body, batch_size=1)
+
+        self.assertEqual(lines[0]["summary"], {"saved": 1})
+        self.assertEqual(lines[1], {"error": f"Line 2 is longer than {STREAM_MAX_LINE_BYTES} bytes"})
+
+    def test_unsupported_encoding(self):
+        response = self.client.post(reverse("import-sms-stream"), b"", content_type="application/x-ndjson",
+                                    HTTP_CONTENT_ENCODING="br")
+        self.assertEqual(response.status_code, 415)
+
+
+class SmsQueueTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Provider.objects.create(name="M-PESA")
+        self.user = User.objects.create_user("queue-owner", password="secret")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.addCleanup(rejection_buffer.flush)
+
+    def queue(self, count):
+        return [sms_queue.enqueue(SMS.replace("CCK9H7R56G1", f"CCK9H7R56G{n}"), "M-PESA", self.user)
+                for n in range(count)]
+
+    def test_claims_never_share_a_row(self):
+        self.queue(5)
+        first = sms_queue.claim_batch(2)
+        second = sms_queue.claim_batch(2)
+
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 2)
+        self.assertFalse({row.id for row in first} & {row.id for row in second})
+        self.assertEqual(len(sms_queue.claim_batch(10)), 1)
+        self.assertEqual(sms_queue.claim_batch(10), [])
+
+    def test_a_row_taken_between_read_and_update_is_not_claimed_twice(self):
+        self.queue(3)
+        real_uuid4 = uuid.uuid4
+        interleaved = []
+
+        def another_worker_claims_first():
+            # Runs after this worker has read its candidates, before its UPDATE
+            if not interleaved:
+                interleaved.append(None)
+                interleaved[0] = sms_queue.claim_batch(2)
+            return real_uuid4()
+
+        with mock.patch.object(sms_queue.uuid, "uuid4", side_effect=another_worker_claims_first):
+            mine = sms_queue.claim_batch(3)
+
+        theirs = interleaved[0]
+        self.assertEqual(len(theirs), 2)
+        self.assertEqual(len(mine), 1)
+        self.assertFalse({row.id for row in mine} & {row.id for row in theirs})
+        self.assertEqual(QueuedSMS.objects.filter(status=QueuedSMS.PROCESSING).count(), 3)
+
+    def test_stale_rows_are_requeued_then_failed(self):
+        (row,) = self.queue(1)
+        long_ago = timezone.now() - timedelta(seconds=sms_queue.STALE_AFTER_SECONDS + 60)
+        for attempt in range(1, sms_queue.MAX_ATTEMPTS + 1):
+            self.assertEqual([claimed.id for claimed in sms_queue.claim_batch()], [row.id])
+            # The worker died: the claim is never finished
+            QueuedSMS.objects.filter(id=row.id).update(claimed_at=long_ago)
+            if attempt < sms_queue.MAX_ATTEMPTS:
+                self.assertEqual(sms_queue.requeue_stale(), 1)
+                row.refresh_from_db()
+                self.assertEqual((row.attempts, row.status, row.claimed_by), (attempt, QueuedSMS.QUEUED, None))
+
+        with self.assertLogs("transactions.sms_queue", "WARNING"):
+            self.assertEqual(sms_queue.requeue_stale(), 0)
+        row.refresh_from_db()
+        self.assertEqual((row.attempts, row.status), (sms_queue.MAX_ATTEMPTS, QueuedSMS.FAILED))
+        self.assertEqual(row.result["status"], "error")
+        self.assertIsNotNone(row.finished_at)
+        self.assertEqual(sms_queue.claim_batch(), [])
+
+    def test_fresh_claims_are_left_alone(self):
+        self.queue(1)
+        sms_queue.claim_batch()
+        self.assertEqual(sms_queue.requeue_stale(), 0)
+        self.assertEqual(QueuedSMS.objects.get().status, QueuedSMS.PROCESSING)
+
+    def test_async_upload_and_status(self):
+        response = self.client.post(reverse("parse-sms") + "?async=1", {"sms": SMS, "sender": "M-PESA"},
+                                    format="json")
+        self.assertEqual(response.status_code, 202, response.content)
+        self.assertEqual(response.json()["status"], "queued")
+        ticket = response.json()["ticket"]
+        status_url = reverse("parse-sms-status", args=[ticket])
+        # Nothing is parsed in the request
+        self.assertEqual(Transaction.objects.count(), 0)
+
+        body = self.client.get(status_url).json()
+        self.assertEqual((body["ticket"], body["status"], body["result"]), (ticket, "queued", None))
+
+        sms_queue.claim_batch()
+        self.assertEqual(self.client.get(status_url).json()["status"], "processing")
+
+        QueuedSMS.objects.update(status=QueuedSMS.QUEUED)
+        self.assertEqual(sms_queue.drain(once=True), 1)
+        body = self.client.get(status_url).json()
+        self.assertEqual(body["status"], "done")
+        self.assertEqual(body["result"]["status"], "saved")
+        self.assertEqual(body["result"]["reference_id"], "CCK9H7R56G1")
+        self.assertIsNotNone(body["finished_at"])
+        self.assertEqual(Transaction.objects.get().user, self.user)
+
+    def test_status_of_another_users_ticket(self):
+        response = self.client.post(reverse("parse-sms") + "?async=1", {"sms": SMS}, format="json")
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user("someone-else", password="secret"))
+        status_url = reverse("parse-sms-status", args=[response.json()["ticket"]])
+
+        self.assertEqual(other.get(status_url).status_code, 404)
+        self.assertEqual(self.client.get(reverse("parse-sms-status", args=[uuid.uuid4()])).status_code, 404)
+
+    def test_empty_async_upload_is_not_queued(self):
+        response = self.client.post(reverse("parse-sms") + "?async=1", {"sms": ""}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(QueuedSMS.objects.exists())
+
+
+class DrainWorkersTests(TransactionTestCase):
+    def test_rejections_from_pool_workers_are_written(self):
+        Provider.objects.create(name="M-PESA")
+        user = User.objects.create_user("queue-owner", password="secret")
+        promos = [f"Promo {n}: win a phone today" for n in range(6)]
+        for sms in promos + [SMS, promos[0]]:
+            sms_queue.enqueue(sms, "SHOP", user)
+
+        call_command("drain_sms_queue", workers=2, batch_size=2, once=True, stdout=io.StringIO())
+
+        self.assertEqual(QueuedSMS.objects.exclude(status=QueuedSMS.DONE).count(), 0)
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertEqual(sorted(RejectedSMS.objects.values_list("message", "occurrences")),
+                         sorted([(promos[0], 2)] + [(sms, 1) for sms in promos[1:]]))
+
+
+class RejectionBufferTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("buffer-owner", password="secret")
+        self.buffer = RejectionBuffer(max_size=3, max_age=60)
+        self.addCleanup(self.buffer.flush)
+
+    def add(self, message, reason="Unknown provider: SHOP", user_id=None):
+        digest = content_hash(message)
+        self.buffer.add("SHOP", message, reason, self.user.id if user_id is None else user_id, digest)
+        return digest
+
+    def test_repeats_collapse_into_one_row(self):
+        digest = self.add("Promo: win a phone today")
+        self.add("Promo: win a phone today", reason=None)
+        self.add("Promo: win a phone today", reason=None)
+
+        self.assertTrue(self.buffer.contains(self.user.id, digest))
+        self.assertFalse(self.buffer.contains(self.user.id + 1, digest))
+        self.assertEqual(self.buffer.pending_hashes(self.user.id, [digest, content_hash("other")]), {digest})
+        self.assertEqual(RejectedSMS.objects.count(), 0)
+
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertFalse(self.buffer.contains(self.user.id, digest))
+        row = RejectedSMS.objects.get()
+        self.assertEqual((row.occurrences, row.reason, row.user), (3, "Unknown provider: SHOP", self.user))
+
+        # Later repeats move the stored row forward
+        self.add("Promo: win a phone today", reason=None)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(RejectedSMS.objects.get().occurrences, 4)
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_failed_flush_keeps_its_messages(self):
+        digest = self.add("Promo: win a phone today")
+        with mock.patch.object(self.buffer, "_write", side_effect=DatabaseError("database is locked")):
+            with self.assertRaises(DatabaseError):
+                self.buffer.flush()
+
+        self.assertTrue(self.buffer.contains(self.user.id, digest))
+        self.add("Promo: win a phone today", reason=None)
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(RejectedSMS.objects.get().occurrences, 2)
+
+    def test_full_buffer_flushes_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            for n in range(3):
+                self.add(f"Promo {n}: win a phone today")
+            self.assertEqual(RejectedSMS.objects.count(), 0)
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(RejectedSMS.objects.count(), 3)
+        self.assertEqual(self.buffer.pending_hashes(self.user.id, [content_hash("Promo 0: win a phone today")]),
+                         set())
+
+
+class ProviderRegistryTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.provider = Provider.objects.create(name="M-PESA")
+        self.assertTrue(provider_registry.is_known("m-pesa"))
+
+    def test_add_edit_delete(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Provider.objects.create(name="HaloPesa")
+        self.assertTrue(provider_registry.is_known("HALOPESA"))
+        self.assertEqual(sorted(provider_registry.names()), ["HaloPesa", "M-PESA"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.provider.name = "MPESA"
+            self.provider.save()
+        self.assertFalse(provider_registry.is_known("M-PESA"))
+        self.assertTrue(provider_registry.is_known("mpesa"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.provider.delete()
+        self.assertFalse(provider_registry.is_known("MPESA"))
+        self.assertEqual([p.name for p in provider_registry.providers()], ["HaloPesa"])
+
+    def test_lookups_need_no_queries(self):
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                self.assertTrue(provider_registry.is_known("M-PESA"))
+                self.assertFalse(provider_registry.is_known("UNKNOWN"))
+
+    def test_rolled_back_edit_never_reaches_the_registry(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    Provider.objects.create(name="AIRTELMONEY")
+                    # Not committed yet: still the old snapshot
+                    self.assertFalse(provider_registry.is_known("AIRTELMONEY"))
+                    raise RuntimeError("rollback")
+            except RuntimeError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertFalse(provider_registry.is_known("AIRTELMONEY"))
+        self.assertFalse(Provider.objects.filter(name="AIRTELMONEY").exists())
+
+
+class ContentHashTests(TestCase):
+    """A message already stored for its owner is answered from the hash index, without parsing."""
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Provider.objects.create(name="M-PESA")
+        self.user = User.objects.create_user("owner", password="secret")
+        self.addCleanup(rejection_buffer.flush)
+
+    def parse_calls(self, module):
+        return mock.patch(f"{module}.parse_sms", wraps=parser.parse_sms)
+
+    def test_api_submission(self):
+        self.assertTrue(handle_sms_submission(SMS, "M-PESA", self.user)["saved"])
+        # Same text once normalized: different spacing and line breaks
+        with self.parse_calls("transactions.api_views") as parse:
+            result = handle_sms_submission(SMS.replace(" ", "\n  ", 3), "MPESA", self.user)
+        parse.assert_not_called()
+        self.assertEqual(result["duplicate"], "saved")
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 1)
+
+    def test_api_submission_of_rejected_message_counts_a_repeat(self):
+        promo = "Promo: win a phone today"
+        self.assertTrue(handle_sms_submission(promo, "SHOP", self.user)["rejected"])
+        rejection_buffer.flush()
+        with self.parse_calls("transactions.api_views") as parse:
+            result = handle_sms_submission(promo, "SHOP", self.user)
+        parse.assert_not_called()
+        self.assertEqual(result["duplicate"], "rejected")
+        rejection_buffer.flush()
+        self.assertEqual(RejectedSMS.objects.get(user=self.user).occurrences, 2)
+
+    def test_sms_handler(self):
+        from utils.sms_handler import handle_sms_submission as handle_plain_submission
+
+        self.assertTrue(handle_plain_submission(SMS)["saved"])
+        with self.parse_calls("utils.sms_handler") as parse:
+            result = handle_plain_submission(SMS + "\r\n")
+        parse.assert_not_called()
+        self.assertEqual(result["error"], "Duplicate transaction")
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_upload_form(self):
+        url = reverse("sms_upload_form")
+        self.assertTrue(self.client.post(url, {"sms": SMS}).context["saved"])
+        with self.parse_calls("transactions.views") as parse:
+            response = self.client.post(url, {"sms": SMS})
+        parse.assert_not_called()
+        self.assertFalse(response.context["saved"])
+        self.assertEqual(response.context["error"], "⚠️ This SMS was already processed.")
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_anonymous_uploads_store_one_row_per_message(self):
+        results = [handle_sms_submission(SMS, "M-PESA") for _ in range(2)]
+        self.assertEqual([r["saved"] for r in results], [True, False])
+        self.assertEqual(results[1]["duplicate"], "saved")
+        self.assertEqual(Transaction.objects.filter(user__isnull=True).count(), 1)
+
+        # The partial unique index holds even when the duplicate check is skipped
+        copy = Transaction.objects.get()
+        copy.pk, copy.reference_id = None, "OTHERREF01"
+        self.assertFalse(insert_or_ignore(copy))
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_each_user_keeps_their_own_copy(self):
+        other = User.objects.create_user("other", password="secret")
+        self.assertTrue(handle_sms_submission(SMS, "M-PESA", self.user)["saved"])
+        # Same reference too, so only the user's own hash decides it is not a duplicate of theirs
+        result = handle_sms_submission(SMS, "M-PESA", other)
+        self.assertNotIn("duplicate", result)
+        self.assertEqual(result["error"], "Duplicate reference_id")
+
+
+class ContentHashMigrationTests(TransactionTestCase):
+    """0003 backfills hashes over existing duplicates; 0007 does the same for anonymous rows."""
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([("transactions", target)])
+        return executor.loader.project_state([("transactions", target)]).apps
+
+    def tearDown(self):
+        self.migrate(MigrationLoader(connection).graph.leaf_nodes("transactions")[0][1])
+
+    def make(self, apps, model_name, count, **fields):
+        model = apps.get_model("transactions", model_name)
+        for i in range(count):
+            if model_name == "Transaction":
+                model.objects.create(reference_id=f"REF{model.objects.count()}", network_provider="M-PESA",
+                                     type="payment", amount=1.0, date_transaction="2025-03-20 21:51", **fields)
+            else:
+                model.objects.create(sender="SHOP", reason="Unknown provider", **fields)
+        return list(model.objects.order_by("id").values_list("id", flat=True))
+
+    def test_backfill_keeps_the_oldest_copy(self):
+        apps = self.migrate("0002_transaction_is_incomplete")
+        User = apps.get_model("auth", "User")
+        owner = User.objects.create(username="owner")
+        ids = self.make(apps, "Transaction", 2, raw_sms=SMS, user_id=owner.pk)
+        self.make(apps, "Transaction", 1, raw_sms=f"  {SMS}\n", user_id=owner.pk)
+        rejected = self.make(apps, "RejectedSMS", 2, message="promo")
+
+        apps = self.migrate("0003_content_hash")
+        Transaction = apps.get_model("transactions", "Transaction")
+        RejectedSMS = apps.get_model("transactions", "RejectedSMS")
+        self.assertEqual(list(Transaction.objects.order_by("id").values_list("id", "content_hash")),
+                         [(ids[0], content_hash(SMS)), (ids[1], None), (ids[1] + 1, None)])
+        self.assertEqual(dict(RejectedSMS.objects.values_list("id", "content_hash")),
+                         {rejected[0]: content_hash("promo"), rejected[1]: None})
+
+    def test_anonymous_duplicates_are_released_before_the_constraint(self):
+        apps = self.migrate("0006_rejectedsms_occurrences")
+        ids = self.make(apps, "Transaction", 3, raw_sms=SMS, content_hash=content_hash(SMS))
+        rejected = self.make(apps, "RejectedSMS", 2, message="promo", content_hash=content_hash("promo"))
+
+        apps = self.migrate("0007_anonymous_content_hash")
+        Transaction = apps.get_model("transactions", "Transaction")
+        RejectedSMS = apps.get_model("transactions", "RejectedSMS")
+        self.assertEqual(list(Transaction.objects.order_by("id").values_list("content_hash", flat=True)),
+                         [content_hash(SMS), None, None])
+        self.assertEqual(list(RejectedSMS.objects.order_by("id").values_list("content_hash", flat=True)),
+                         [content_hash("promo"), None])
+        self.assertEqual(Transaction.objects.order_by("id").first().id, ids[0])
+        self.assertEqual(RejectedSMS.objects.order_by("id").first().id, rejected[0])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Transaction.objects.create(reference_id="REF9", network_provider="M-PESA", type="payment", amount=1.0,
+                                       date_transaction="2025-03-20 21:51", raw_sms=SMS,
+                                       content_hash=content_hash(SMS))
+
+
+class BulkIngestionTests(TestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Provider.objects.create(name="M-PESA")
+        self.user = User.objects.create_user("bulk-owner", password="secret")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.addCleanup(rejection_buffer.flush)
+
+    def post(self, items, expected_status=200):
+        response = self.client.post(reverse("parse-sms-bulk"), {"items": items}, format="json")
+        self.assertEqual(response.status_code, expected_status, response.content)
+        return response.json()
+
+    def statuses(self, body):
+        return [(r["status"], r.get("stored_as")) for r in body["results"]]
+
+    def test_mixed_items_get_one_status_each(self):
+        body = self.post([
+            {"sms": SMS, "sender": "M-PESA"},
+            {"sms": "", "sender": "M-PESA"},
+            "not an object",
+            {"sms": "Promo: win a phone today", "sender": "SHOP"},
+        ])
+
+        self.assertEqual(self.statuses(body), [("saved", None), ("invalid", None), ("invalid", None),
+                                               ("rejected", None)])
+        self.assertEqual(body["summary"], {"saved": 1, "invalid": 2, "rejected": 1})
+        self.assertEqual(body["results"][0]["reference_id"], "CCK9H7R56G1")
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 1)
+
+    def test_duplicates_within_the_batch(self):
+        body = self.post([{"sms": SMS, "sender": "M-PESA"}, {"sms": f" {SMS}\n", "sender": "MPESA"},
+                          {"sms": SMS.replace("Tsh77,000.00", "Tsh78,000.00"), "sender": "M-PESA"}])
+
+        self.assertEqual(self.statuses(body), [("saved", None), ("duplicate", "batch"),
+                                               ("duplicate", "reference_id")])
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_duplicates_of_stored_messages(self):
+        self.post([{"sms": SMS, "sender": "M-PESA"}, {"sms": "Promo: win a phone today", "sender": "SHOP"}])
+        rejection_buffer.flush()
+
+        body = self.post([
+            {"sms": SMS, "sender": "M-PESA"},
+            {"sms": "Promo: win a phone today", "sender": "SHOP"},
+            # New text, reference already stored
+            {"sms": SMS.replace("9:51 PM", "9:52 PM"), "sender": "M-PESA"},
+        ])
+
+        self.assertEqual(self.statuses(body), [("duplicate", "saved"), ("duplicate", "rejected"),
+                                               ("duplicate", "reference_id")])
+        self.assertEqual(Transaction.objects.count(), 1)
+        rejection_buffer.flush()
+        self.assertEqual(RejectedSMS.objects.get().occurrences, 2)
+
+    def test_too_many_items(self):
+        with mock.patch("transactions.api_views.BULK_MAX_ITEMS", 2):
+            body = self.post([{"sms": SMS}] * 3, expected_status=400)
+        self.assertEqual(body["error"], "At most 2 items per request.")
+        self.post([], expected_status=400)
+        self.assertEqual(Transaction.objects.count(), 0)
+
+    def test_undated_messages_fall_back_to_received_at_in_utc(self):
+        undated = SMS.replace(" 20/3/25 9:51 PM", "")
+        self.post([
+            {"sms": undated, "sender": "M-PESA", "received_at": 1742496660000},
+            {"sms": undated.replace("CCK9H7R56G1", "CCK9H7R56G2"), "sender": "M-PESA",
+             "received_at": "2025-03-20T21:51:00"},
+            {"sms": undated.replace("CCK9H7R56G1", "CCK9H7R56G3"), "sender": "M-PESA"},
+        ])
+
+        dates = dict(Transaction.objects.values_list("reference_id", "date_transaction"))
+        self.assertEqual(dates["CCK9H7R56G1"], datetime(2025, 3, 20, 18, 51, tzinfo=dt_timezone.utc))
+        self.assertEqual(dates["CCK9H7R56G2"], datetime(2025, 3, 20, 21, 51, tzinfo=dt_timezone.utc))
+        self.assertLess(abs(timezone.now() - dates["CCK9H7R56G3"]), timedelta(minutes=1))
+
+    def test_concurrent_insert_is_retried_as_duplicate(self):
+        from . import ingestion
+
+        other = SMS.replace("CCK9H7R56G1", "CCK9H7R56G2")
+        write_batch = ingestion._write_batch
+
+        def store_first_meanwhile(candidates, statuses):
+            # Another upload of the first message lands between the checks and the
+            # insert; its own reference keeps the pre-insert reference check quiet
+            if not Transaction.objects.exists():
+                row = candidates[0][2]
+                Transaction.objects.create(reference_id="CONCURRENT", network_provider="M-PESA",
+                                           type=row.type, amount=row.amount, date_transaction=row.date_transaction,
+                                           raw_sms=row.raw_sms, user=self.user, content_hash=row.content_hash)
+            return write_batch(candidates, statuses)
+
+        with mock.patch.object(ingestion, "_write_batch", side_effect=store_first_meanwhile) as writes:
+            body = self.post([{"sms": SMS, "sender": "M-PESA"}, {"sms": other, "sender": "M-PESA"}])
+
+        self.assertEqual(writes.call_count, 2)
+        self.assertEqual(self.statuses(body), [("duplicate", "saved"), ("saved", None)])
+        self.assertEqual(sorted(Transaction.objects.values_list("reference_id", flat=True)),
+                         ["CCK9H7R56G2", "CONCURRENT"])
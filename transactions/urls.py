@@ -16,6 +16,10 @@ urlpatterns = [
 urlpatterns += [
     # path('api/providers/', api_views.ProviderListAPIView.as_view(), name='provider-list'),
     path('api/parse-sms/', api_views.parse_and_store_sms, name='parse-sms'),
+    path('api/parse-sms/bulk/', api_views.parse_and_store_sms_bulk, name='parse-sms-bulk'),
+    path('api/parse-sms/status/<uuid:ticket>/', api_views.queued_sms_status, name='parse-sms-status'),
+    path('api/sync/<str:device_id>/', api_views.device_sync, name='device-sync'),
+    path('api/import/', api_views.import_sms_stream, name='import-sms-stream'),
     path('api/transactions/', api_views.list_transactions, name='list-transactions'),
     path('api/transactions/<str:provider>/', api_views.provider_transactions_api, name='provider-transactions'),
     path('api/dashboard-summary/', api_views.dashboard_summary_view, name='dashboard-summary'),
@@ -1,5 +1,6 @@
 
 from .models import Transaction, RejectedSMS
+from .ingestion import content_hash, find_duplicate, insert_or_ignore, record_rejection
 from sms_parser.parser import parse_sms
 from .models import Transaction
 from django.shortcuts import render
@@ -29,12 +30,19 @@ def sms_upload_form(request):
         form = SMSForm(request.POST)
         if form.is_valid():
             sms = form.cleaned_data['sms']
-            parsed = parse_sms(sms)
+            # Already stored messages are not parsed again
+            digest = content_hash(sms)
+            duplicate_of = find_duplicate(None, digest)
+            if duplicate_of == "rejected":
+                record_rejection("UNKNOWN", sms, None, digest=digest)
+            parsed = None if duplicate_of else parse_sms(sms)
 
             # Only save if SMS is legit
-            if parsed['type'] != 'unknown' and parsed['network_provider'] != 'UNKNOWN':
+            if parsed is None:
+                error = "⚠️ This SMS was already processed."
+            elif parsed['type'] != 'unknown' and parsed['network_provider'] != 'UNKNOWN':
                 try:
-                    Transaction.objects.create(
+                    saved = insert_or_ignore(Transaction(
                         reference_id = parsed.get("reference_id"),
                         network_provider = parsed.get("network_provider"),
                         type = parsed.get("type"),
@@ -44,23 +52,19 @@ def sms_upload_form(request):
                         balance = parsed.get("balance"),
                         transaction_fee = parsed.get("transaction_fee"),
                         date_transaction = parsed.get("date_transaction") or datetime.now(),
-                        raw_sms = sms
-                    )
-                    saved = True
-                except IntegrityError as e:
-                    if "UNIQUE constraint failed" in str(e):
+                        raw_sms = sms,
+                        content_hash = digest
+                    ))
+                    if not saved:
                         error = "⚠️ This SMS was already processed (duplicate reference ID)."
-                        amount = parsed.get("amount")
-                    if not amount:
+                except IntegrityError as e:
+                    if not parsed.get("amount"):
                         error = "❌ Amount not found. SMS was not saved."
                     else:
                         error = f"❌ Failed to save SMS: {str(e)}"
             else:
-                RejectedSMS.objects.create(
-                    sender = parsed.get("customer_phone") or "UNKNOWN",
-                    message = sms,
-                    reason = "Rejected in web form: unrecognized type/provider"
-                )
+                record_rejection(parsed.get("customer_phone") or "UNKNOWN", sms,
+                                 "Rejected in web form: unrecognized type/provider", digest=digest)
                 rejected = True
     else:
         form = SMSForm()
@@ -1,4 +1,5 @@
 from transactions.models import Transaction, RejectedSMS
+from transactions.ingestion import content_hash, find_duplicate, insert_or_ignore, record_rejection
 from sms_parser.parser import parse_sms
 from datetime import datetime
 from django.db import IntegrityError
@@ -7,18 +8,28 @@ def handle_sms_submission(sms_text):
     # ✅ Clean control characters (multiline to single-line)
     sms_text = sms_text.replace("\r", " ").replace("\n", " ").replace("\t", " ").strip()
 
-    parsed = parse_sms(sms_text)
-
     result = {
         "saved": False,
         "rejected": False,
         "error": None,
-        "parsed": parsed
+        "parsed": None
     }
 
+    # ✅ Already stored (saved or rejected): skip parsing altogether
+    digest = content_hash(sms_text)
+    duplicate_of = find_duplicate(None, digest)
+    if duplicate_of:
+        if duplicate_of == "rejected":
+            record_rejection("UNKNOWN", sms_text, None, digest=digest)
+        result["error"] = "Duplicate transaction" if duplicate_of == "saved" else "Duplicate rejected SMS"
+        return result
+
+    parsed = parse_sms(sms_text)
+    result["parsed"] = parsed
+
     if parsed['type'] != 'unknown' and parsed['network_provider'] != 'UNKNOWN':
         try:
-            Transaction.objects.create(
+            created = insert_or_ignore(Transaction(
                 reference_id = parsed.get("reference_id"),
                 network_provider = parsed.get("network_provider"),
                 type = parsed.get("type"),
@@ -28,20 +39,17 @@ def handle_sms_submission(sms_text):
                 balance = parsed.get("balance"),
                 transaction_fee = parsed.get("transaction_fee"),
                 date_transaction = parsed.get("date_transaction") or datetime.now(),
-                raw_sms = sms_text
-            )
-            result["saved"] = True
-        except IntegrityError as e:
-            if "UNIQUE constraint failed" in str(e):
+                raw_sms = sms_text,
+                content_hash = digest
+            ))
+            result["saved"] = created
+            if not created:
                 result["error"] = "Duplicate transaction"
-            else:
-                result["error"] = str(e)
+        except IntegrityError as e:
+            result["error"] = str(e)
     else:
-        RejectedSMS.objects.create(
-            sender = parsed.get("customer_phone") or "UNKNOWN",
-            message = sms_text,
-            reason = "Unrecognized provider or transaction type"
-        )
+        record_rejection(parsed.get("customer_phone") or "UNKNOWN", sms_text,
+                         "Unrecognized provider or transaction type", digest=digest)
         result["rejected"] = True
 
     return result